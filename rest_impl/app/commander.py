@@ -6,6 +6,8 @@ from flask import render_template, jsonify, request
 from flask_swagger import swagger
 from controller import CommanderServer
 from model import definitions, Commander
+from model.report_cache import ReportCache
+from model.spool import Spool
 from utils.helpers import get_ip, get_mac, DelegateHandler
 
 logger = getLogger(__name__)
@@ -32,6 +34,21 @@ if __name__ == "__main__":
         '-E', '--endpoint', type=str, default='', help='endpoint')
     parser.add_argument(
         '-T', '--token', type=str, default='', help='slack token')
+    parser.add_argument(
+        '--notify_url', type=str, default='',
+        help='url to post error notifications (default: slack)')
+    parser.add_argument(
+        '--report_cache_size', type=int, default=1000,
+        help='max number of recent reports kept in memory')
+    parser.add_argument(
+        '--report_cache_age', type=float, default=3600,
+        help='seconds to keep recent reports in memory')
+    parser.add_argument(
+        '--spool_dir', type=str, default='',
+        help='directory to spool values that could not be stored')
+    parser.add_argument(
+        '--spool_max_mb', type=int, default=256,
+        help='disk budget of the spool in MB')
     parser.add_argument(
         '-R', '--rec_addr', type=str, help="recruiter url",
         default="http://localhost:50000/recruiter/")
@@ -59,6 +76,14 @@ if __name__ == "__main__":
     commander = Commander(params.id, params.name, ep)
     commander.awake(params.rec_addr)
     commander.token = params.token
+    if params.notify_url != "":
+        commander.notifier.url = params.notify_url
+    commander.report_cache = ReportCache(params.report_cache_size,
+                                         params.report_cache_age)
+    if params.spool_dir != "":
+        spool = Spool(params.spool_dir,
+                      max_bytes=params.spool_max_mb * 1024 * 1024)
+        commander.ingest.attach_spool(spool)
     CommanderServer.set_model(commander)
 
     @server.route(params.prefix + '/spec.json')
@@ -1,11 +1,17 @@
 import argparse
 import json
+import os
 import signal
 from flask import render_template, jsonify, request
 from flask_swagger import swagger
 from logging import getLogger, StreamHandler, DEBUG, ERROR
 from controller import LeaderServer
+import model.edge_aggregation as edge_aggregation
+import utils.rest as rest
+import utils.wire as wire
 from model import definitions, Leader
+from model.outbox import Outbox
+from model.spool import Spool
 from utils.helpers import DelegateHandler, get_ip, get_mac
 
 logger = getLogger(__name__)
@@ -31,6 +37,33 @@ if __name__ == "__main__":
     parser.add_argument(
         '-R', '--rec_addr', type=str, help="recruiter url",
         default="http://localhost:50000/recruiter/")
+    parser.add_argument(
+        '--columnar', action="store_true", help='send columnar reports')
+    parser.add_argument(
+        '--passthrough', action="store_true",
+        help='embed received works into reports without decoding')
+    parser.add_argument(
+        '--aggregate', action="store_true",
+        help='send statistics of received values instead of the values')
+    parser.add_argument(
+        '--percentiles', type=float, nargs='*', default=[50, 90],
+        help='percentiles reported in the aggregate mode')
+    parser.add_argument(
+        '--compress', type=str, choices=[wire.GZIP, wire.ZSTD],
+        help='compress request bodies with the given content-encoding')
+    parser.add_argument(
+        '--compress_threshold', type=int, default=1024,
+        help='minimum body size in bytes to be compressed')
+    parser.add_argument(
+        '--outbox_dir', type=str, default=None,
+        help='directory to keep reports that could not be posted '
+             '(default: ~/.troops/outbox-<id>, "" keeps them in memory)')
+    parser.add_argument(
+        '--outbox_max_mb', type=int, default=64,
+        help='disk budget of the outbox in MB')
+    parser.add_argument(
+        '--outbox_max_reports', type=int, default=1000,
+        help='number of reports kept in memory with --outbox_dir ""')
     params = parser.parse_args()
 
     # server setting
@@ -50,6 +83,39 @@ if __name__ == "__main__":
     host_addr = get_ip()
     ep = 'http://{0}:{1}{2}/'.format(host_addr, params.port, params.prefix)
     leader = Leader(params.id, params.name, ep)
+    if params.columnar:
+        leader.report_format = "columnar"
+    if params.passthrough:
+        leader.report_format = "passthrough"
+    if params.aggregate:
+        leader.report_format = "aggregate"
+        leader.percentiles = tuple(params.percentiles)
+        if not edge_aggregation.uses_numpy():
+            logger.info("numpy is not installed: aggregate without numpy")
+    if params.compress is not None:
+        if wire.supports_coding(params.compress):
+            rest.set_compression(params.compress, params.compress_threshold)
+        else:
+            logger.info("{0} is not supported: send without compression".
+                        format(params.compress))
+    # 送れなかったreportは既定でディスクに溜め，再起動しても失わない
+    if params.outbox_dir is None:
+        params.outbox_dir = os.path.expanduser(
+            "~/.troops/outbox-{0}".format(params.id))
+    spool = None
+    if params.outbox_dir != "":
+        try:
+            spool = Spool(params.outbox_dir,
+                          max_bytes=params.outbox_max_mb * 1024 * 1024)
+        except OSError as e:
+            logger.error("failed to open the outbox in {0}: {1}".format(
+                params.outbox_dir, e))
+    if spool is not None:
+        leader.outbox = Outbox(spool=spool)
+    else:
+        logger.warning("the outbox keeps reports in memory: reports waiting "
+                       "for retry are lost when the leader restarts")
+        leader.outbox = Outbox(max_reports=params.outbox_max_reports)
 
     retry = 10
     for i in range(retry):
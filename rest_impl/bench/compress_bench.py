@@ -0,0 +1,83 @@
+"""
+reportのボディの圧縮によるバイト数の削減と，圧縮・展開にかかる時間
+SensorTagの11種のweaponを1秒ごとに送るsoldierのworkを，
+1回のreport分（30秒）溜めた場合で比較する．値は1秒ごとに少しずつ揺らす
+
+break-evenは圧縮が得になる回線速度の上限で，これより遅い回線では
+圧縮の時間より削減したバイト数の送信時間の方が長い
+Leaderの載るRaspberry Piなどの遅いコアでは，このマシンとの速度比を
+slowdownに指定すると圧縮時間とbreak-evenをその分換算する
+
+    python -m bench.compress_bench [slowdown]
+"""
+import datetime
+import random
+import sys
+import timeit
+import utils.wire as wire
+from bench.wire_bench import SENSORTAG_VALUES
+from model import Report
+
+
+def _jitter(value, rnd):
+    if isinstance(value, list):
+        return [_jitter(v, rnd) for v in value]
+    if isinstance(value, int):
+        return value
+    return value * (1 + rnd.uniform(-0.01, 0.01))
+
+
+def sensortag_report(soldiers, interval=30, seed=0):
+    rnd = random.Random(seed)
+    start = datetime.datetime(2016, 11, 1, 12, 0, 0,
+                              tzinfo=datetime.timezone.utc)
+    values = []
+    for sec in range(interval):
+        time = (start + datetime.timedelta(seconds=sec)).isoformat()
+        for i in range(soldiers):
+            values.append({
+                "time": time,
+                "place": "soldier{0}".format(i),
+                "values": [{"type": t, "value": _jitter(v, rnd), "unit": u}
+                           for t, v, u in SENSORTAG_VALUES]})
+    return Report(start.isoformat(), "left", "some purpose", values)
+
+
+def main(slowdown=1.0, number=20):
+    codings = [(wire.GZIP, 1), (wire.GZIP, 6), (wire.ZSTD, 3)]
+    print("slowdown: {0:g}".format(slowdown))
+    print("{0:>8} {1:<22} {2:<8} {3:>10} {4:>8} {5:>10} {6:>10} {7:>12}".
+          format("soldiers", "format", "coding", "bytes", "ratio",
+                 "comp [ms]", "dec [ms]", "break-even"))
+    for soldiers in [1, 10, 50]:
+        payload = sensortag_report(soldiers).to_dict()
+        for mimetype in [wire.JSON, wire.MSGPACK]:
+            if not wire.supports(mimetype):
+                continue
+            data = wire.encode(payload, mimetype)
+            print("{0:>8} {1:<22} {2:<8} {3:>10}".format(
+                soldiers, mimetype, wire.IDENTITY, len(data)))
+            for coding, level in codings:
+                name = "{0}-{1}".format(coding, level)
+                if not wire.supports_coding(coding):
+                    print("{0:>8} {1:<22} {2:<8} (not installed)".format(
+                        soldiers, mimetype, name))
+                    continue
+                compressed = wire.compress(data, coding, level)
+                assert wire.decompress(compressed, coding) == data
+                comp = timeit.timeit(
+                    lambda: wire.compress(data, coding, level),
+                    number=number) / number * slowdown
+                dec = timeit.timeit(
+                    lambda: wire.decompress(compressed, coding),
+                    number=number) / number
+                saved = len(data) - len(compressed)
+                print("{0:>8} {1:<22} {2:<8} {3:>10} {4:>8.3f} {5:>10.3f} "
+                      "{6:>10.3f} {7:>7.0f} Mbps".format(
+                          soldiers, mimetype, name, len(compressed),
+                          len(compressed) / len(data), comp * 1e3, dec * 1e3,
+                          saved * 8 / comp / 1e6))
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)
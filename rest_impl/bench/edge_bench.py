@@ -0,0 +1,55 @@
+"""
+Leaderのaggregateモードでのreportの大きさと集約にかかる時間
+SensorTagの11種のweaponを1秒ごとに送るsoldierのworkを，
+1回のreport分（30秒）溜めた場合で比較する
+
+    python -m bench.edge_bench
+"""
+import timeit
+from unittest.mock import patch
+import model.edge_aggregation as edge_aggregation
+import utils.wire as wire
+from bench.wire_bench import sensortag_work
+from model import Report
+
+
+def buffered_works(soldiers, interval=30):
+    work = sensortag_work()
+    return [(work.time, "soldier{0}".format(i), work.values)
+            for i in range(soldiers) for _ in range(interval)]
+
+
+def rows_report(works):
+    return Report("2016-11-01T12:00:00", "left", "some purpose",
+                  [{"time": t, "place": p, "values": v}
+                   for t, p, v in works])
+
+
+def aggregate_report(works):
+    return Report("2016-11-01T12:00:00", "left", "some purpose",
+                  edge_aggregation.summarize(works))
+
+
+def main(number=20):
+    print("numpy: {0}".format(edge_aggregation.uses_numpy()))
+    print("{0:>8} {1:>12} {2:>12} {3:>14} {4:>14}".format(
+        "soldiers", "rows [B]", "agg [B]", "numpy [ms]", "python [ms]"))
+    for soldiers in [1, 10, 50]:
+        works = buffered_works(soldiers)
+        rows = len(wire.encode(rows_report(works).to_dict()))
+        agg = len(wire.encode(aggregate_report(works).to_dict()))
+        if edge_aggregation.uses_numpy():
+            t_np = timeit.timeit(lambda: aggregate_report(works),
+                                 number=number) / number * 1e3
+            t_np = "{0:.3f}".format(t_np)
+        else:
+            t_np = "-"
+        with patch.object(edge_aggregation, "numpy", None):
+            t_py = timeit.timeit(lambda: aggregate_report(works),
+                                 number=number) / number * 1e3
+        print("{0:>8} {1:>12} {2:>12} {3:>14} {4:>14.3f}".format(
+            soldiers, rows, agg, t_np, t_py))
+
+
+if __name__ == "__main__":
+    main()
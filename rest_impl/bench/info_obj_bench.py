@@ -0,0 +1,82 @@
+"""
+InformationObject.to_dictのマイクロベンチマーク
+旧来のdir()ベースの実装と，クラスごとに生成したto_dictを比較する
+
+    python -m bench.info_obj_bench
+"""
+import timeit
+from model import Requirement, Mission, Order, Work, SoldierInfo, LeaderInfo
+from model.info_obj import InformationObject
+
+
+# 旧来の実装の後に加わった，スキーマに含まれない公開プロパティ
+_NON_SCHEMA_PROPS = {'version'}
+
+
+def legacy_props(obj):
+    return filter(lambda key:
+                  key[0] != '.' and
+                  key[0] != '_' and
+                  key not in _NON_SCHEMA_PROPS and
+                  not callable(getattr(obj, key)),
+                  dir(obj))
+
+
+def legacy_to_dict(obj):
+    res_dict = {}
+    for key in legacy_props(obj):
+        value = getattr(obj, key)
+        if isinstance(value, InformationObject):
+            value = legacy_to_dict(value)
+        if isinstance(value, list):
+            first = value[0] if len(value) > 0 else None
+            if isinstance(first, InformationObject):
+                value = [legacy_to_dict(v) for v in value]
+        if isinstance(value, list):
+            try:
+                value = sorted(value)
+            except TypeError:
+                pass
+        res_dict[key] = value
+    return res_dict
+
+
+def sample_objects():
+    req = Requirement(values=["temperature", "humidity"],
+                      trigger={"timer": 10})
+    missions = [Mission(author="lxxx0", requirement=req, trigger={"timer": 30},
+                        place="All", purpose="purpose-{0}".format(i))
+                for i in range(5)]
+    orders = [Order(author="sxxx0", values=["temperature", "humidity"],
+                    trigger={"timer": 10}, purpose="purpose-{0}".format(i))
+              for i in range(5)]
+    work = Work(time="2016-11-01T12:00:00.000000+00:00",
+                purpose="purpose-0",
+                values=[{"type": "temperature", "value": 24.5, "unit": "degC"},
+                        {"type": "humidity", "value": 43.1, "unit": "%"}])
+    return {
+        "Work": work,
+        "SoldierInfo": SoldierInfo(id="sxxx0", name="soldier", place="left",
+                                   weapons=["temperature", "humidity"],
+                                   orders=orders),
+        "LeaderInfo": LeaderInfo(id="lxxx0", name="leader", place="desk",
+                                 endpoint="http://localhost:50002/leader/",
+                                 subordinates=["sxxx0", "sxxx1"],
+                                 missions=missions),
+    }
+
+
+def main(number=20000):
+    print("{0:<12} {1:>12} {2:>12} {3:>8}".format(
+        "class", "dir() [us]", "schema [us]", "speedup"))
+    for name, obj in sample_objects().items():
+        assert legacy_to_dict(obj) == obj.to_dict()
+        legacy = timeit.timeit(lambda: legacy_to_dict(obj), number=number)
+        schema = timeit.timeit(lambda: obj.to_dict(), number=number)
+        print("{0:<12} {1:>12.2f} {2:>12.2f} {3:>7.1f}x".format(
+            name, legacy / number * 1e6, schema / number * 1e6,
+            legacy / schema))
+
+
+if __name__ == "__main__":
+    main()
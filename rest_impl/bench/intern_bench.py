@@ -0,0 +1,129 @@
+"""
+Mission・Orderの生成で増えるメモリ量の比較
+1k人の部下に対してMissionとOrderを生成し，requirement・triggerを
+部下ごとに複製する旧来の方法と共有する方法とで，部下の情報から辿れる
+オブジェクトの合計サイズ（共有されているものは1回だけ数える）を比べる
+
+    python -m bench.intern_bench
+"""
+import copy
+import sys
+from logging import getLogger, ERROR
+from model import Commander, Leader, LeaderInfo, SoldierInfo, \
+    Campaign, Mission, Order, Requirement
+
+getLogger("model").setLevel(ERROR)
+
+SUBORDINATES = 1000
+WEAPONS = ["temperature", "humidity", "barometer", "accelerometer",
+           "magnetometer", "gyroscope", "brightness", "target_temp",
+           "humi_temp", "baro_temp", "battery"]
+
+
+def sample_campaign():
+    return Campaign(author="cxxx0",
+                    requirement=Requirement(values=list(WEAPONS),
+                                            trigger={"timer": 10}),
+                    trigger={"timer": 30},
+                    place="All",
+                    purpose="sensing-all",
+                    destination="mongodb://localhost/troops/values")
+
+
+def legacy_missions(commander, campaign):
+    m_base = Mission(author='',
+                     place='All',
+                     purpose=campaign.get_id(),
+                     requirement=campaign.requirement,
+                     trigger=campaign.trigger)
+    for t_id in commander.subordinates.keys():
+        mission = copy.deepcopy(m_base)
+        mission.author = t_id
+        commander.subordinates[t_id].missions.append(mission)
+
+
+def legacy_orders(leader, mission):
+    for sol in leader.subordinates.values():
+        m_req = mission.requirement
+        values = list(set(m_req.values).intersection(sol.weapons))
+        sol.orders.append(Order(author=sol.id,
+                                values=values,
+                                trigger=m_req.trigger,
+                                purpose=mission.get_id()))
+
+
+# 割り当て先はplace_indexで探されるので，部下はaccept_subordinateで登録する
+def new_commander():
+    commander = Commander("cxxx0", "commander", "http://localhost/")
+    for i in range(SUBORDINATES):
+        l_id = "lxxx{0}".format(i)
+        commander.accept_subordinate(LeaderInfo(
+            id=l_id, name="leader", place="desk", endpoint="",
+            subordinates=[], missions=[]))
+    return commander
+
+
+def new_leader():
+    leader = Leader("lxxx0", "leader", "http://localhost/")
+    for i in range(SUBORDINATES):
+        s_id = "sxxx{0}".format(i)
+        leader.accept_subordinate(SoldierInfo(
+            id=s_id, name="soldier", place="left",
+            weapons=list(WEAPONS), orders=[]))
+    return leader
+
+
+def deep_size(obj, seen=None):
+    """
+    objから辿れるオブジェクトのサイズの合計．同じオブジェクトは1回だけ数える
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, type):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    if hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+
+def measure(setup, action):
+    target = setup()
+    before = deep_size(target.subordinates)
+    action(target)
+    return deep_size(target.subordinates) - before, target
+
+
+def main():
+    print("{0:<24} {1:>14} {2:>14}".format(
+        "{0} subordinates".format(SUBORDINATES), "copied [KiB]",
+        "shared [KiB]"))
+
+    legacy, _ = measure(new_commander,
+                        lambda c: legacy_missions(c, sample_campaign()))
+    shared, _ = measure(new_commander,
+                        lambda c: c.accept_campaign(sample_campaign()))
+    print("{0:<24} {1:>14.1f} {2:>14.1f}".format(
+        "Commander missions", legacy / 1024, shared / 1024))
+
+    mission = Mission.make({
+        "author": "lxxx0",
+        "requirement": sample_campaign().requirement.to_dict(),
+        "trigger": {"timer": 3600},
+        "place": "All",
+        "purpose": "sensing-all"})
+    legacy, _ = measure(new_leader, lambda l: legacy_orders(l, mission))
+    shared, leader = measure(new_leader, lambda l: l.accept_mission(mission))
+    leader.shutdown()
+    print("{0:<24} {1:>14.1f} {2:>14.1f}".format(
+        "Leader orders", legacy / 1024, shared / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+MongoDBに格納する値の時刻の変換時間
+1秒あたり10万件の値（1つのWorkに10件）を想定し，
+dateutil・isotime.parse・isotime.CachedParserを比較する
+
+    python -m bench.isotime_bench
+"""
+import datetime
+import timeit
+import dateutil.parser
+import utils.isotime as isotime
+
+
+def make_values(count, per_work=10):
+    start = datetime.datetime.now(datetime.timezone.utc)
+    values = []
+    for i in range(count):
+        time = start + datetime.timedelta(seconds=i // per_work)
+        values.append({"time": time.isoformat(),
+                       "data": {"type": "temperature", "value": i}})
+    return values
+
+
+def with_dateutil(values):
+    return [dict(v, time=dateutil.parser.parse(v["time"])) for v in values]
+
+
+def with_parse(values):
+    return [dict(v, time=isotime.parse(v["time"])) for v in values]
+
+
+def with_cache(values):
+    parse = isotime.CachedParser()
+    return [dict(v, time=parse(v["time"])) for v in values]
+
+
+def main(count=100000, number=3):
+    values = make_values(count)
+    assert with_dateutil(values) == with_cache(values)
+    print("{0:<16} {1:>12} {2:>16}".format(
+        "parser", "time [s]", "values/s"))
+    for name, func in [("dateutil", with_dateutil),
+                       ("isotime.parse", with_parse),
+                       ("CachedParser", with_cache)]:
+        t = timeit.timeit(lambda: func(values), number=number) / number
+        print("{0:<16} {1:>12.3f} {2:>16,.0f}".format(name, t, count / t))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Leaderのreport組み立て時間
+Workをデコードして再エンコードする場合と，バイト列のままつなぎ合わせる
+passthroughの場合を比較する
+
+    python -m bench.passthrough_bench
+"""
+import timeit
+import utils.wire as wire
+from bench.wire_bench import sensortag_work
+from model import Work, Report
+
+
+def decode_and_encode(bodies, mimetype):
+    values = []
+    for place, body in bodies:
+        work = Work.make(wire.decode(body, mimetype))
+        values.append({"time": work.time,
+                       "place": place,
+                       "values": work.values})
+    report = Report("2016-11-01T12:00:00", "left", "some purpose", values)
+    return wire.encode(report.to_dict(), mimetype)
+
+
+def splice(bodies, mimetype):
+    head = {"time": "2016-11-01T12:00:00",
+            "place": "left",
+            "purpose": "some purpose"}
+    rows = [("place", place, body) for place, body in bodies]
+    return wire.splice_rows(head, "values", rows, mimetype)
+
+
+def main(works=100, number=200):
+    payload = sensortag_work().to_dict()
+    print("{0:<24} {1:>16} {2:>16}".format(
+        "format", "decode [ms]", "passthrough [ms]"))
+    for mimetype in [wire.JSON, wire.MSGPACK]:
+        if not wire.supports(mimetype):
+            print("{0:<24} (not installed)".format(mimetype))
+            continue
+        body = wire.encode(payload, mimetype)
+        bodies = [("place{0}".format(i), body) for i in range(works)]
+        t_dec = timeit.timeit(lambda: decode_and_encode(bodies, mimetype),
+                              number=number)
+        t_spl = timeit.timeit(lambda: splice(bodies, mimetype),
+                              number=number)
+        print("{0:<24} {1:>16.3f} {2:>16.3f}".format(
+            mimetype, t_dec / number * 1e3, t_spl / number * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Workのエンコード形式ごとのペイロードサイズとエンコード・デコード時間
+SensorTagの11種のweaponを全て載せたWorkで比較する
+
+    python -m bench.wire_bench
+"""
+import datetime
+import timeit
+import utils.wire as wire
+from model import Work
+
+SENSORTAG_VALUES = [
+    ("temperature", 24.03125, "degC"),
+    ("humidity", 45.587158203125, "%"),
+    ("barometer", 1008.87, "mbar"),
+    ("accelerometer", [0.0107421875, -0.0146484375, 1.0224609375], "g"),
+    ("magnetometer", [-33.129, 117.0, -129.735], "uT"),
+    ("gyroscope", [-1.4190673828125, 0.8087158203125, 0.30517578125],
+     "deg/sec"),
+    ("brightness", 325.12, "lux"),
+    ("target_temp", 20.8125, "degC"),
+    ("humi_temp", 24.7894287109375, "degC"),
+    ("baro_temp", 24.68, "degC"),
+    ("battery", 87, "%"),
+]
+
+
+def sensortag_work():
+    time = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    values = [{"type": t, "value": v, "unit": u}
+              for t, v, u in SENSORTAG_VALUES]
+    return Work(time, "3b4f3a8b6f3a44a0c8e0a1b8c9d0e1f2", values)
+
+
+def main(number=20000):
+    payload = sensortag_work().to_dict()
+    print("{0:<24} {1:>8} {2:>12} {3:>12}".format(
+        "format", "bytes", "encode [us]", "decode [us]"))
+    for mimetype in [wire.JSON, wire.MSGPACK]:
+        if not wire.supports(mimetype):
+            print("{0:<24} (not installed)".format(mimetype))
+            continue
+        data = wire.encode(payload, mimetype)
+        assert wire.decode(data, mimetype) == payload
+        enc = timeit.timeit(lambda: wire.encode(payload, mimetype),
+                            number=number)
+        dec = timeit.timeit(lambda: wire.decode(data, mimetype),
+                            number=number)
+        print("{0:<24} {1:>8} {2:>12.2f} {3:>12.2f}".format(
+            mimetype, len(data), enc / number * 1e6, dec / number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
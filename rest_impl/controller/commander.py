@@ -1,8 +1,11 @@
 from functools import wraps
 from flask import jsonify, request, Blueprint, make_response
-from model import LeaderInfo, Report, Campaign
+from model import validators
+from model.aggregation import parse_aggregation
 from model.commander import Commander
-from utils.helpers import json_input, ResponseStatus
+from model.report_cache import parse_time
+from utils.helpers import json_input, request_body, encoded_response, \
+    paginated_response, ResponseStatus
 from controller import logger
 
 
@@ -55,7 +58,15 @@ def get_campaigns():
     Accepted campaigns
     このCommanderが受理したCampaignsの一覧を返す
     ---
-    parameters: []
+    parameters:
+      - name: limit
+        description: Maximum number of entries to be returned
+        in: query
+        type: integer
+      - name: after
+        description: Return entries after this ID, given as "next"
+        in: query
+        type: string
     responses:
       200:
         description: A list of campaign that is accepted by the commander
@@ -64,14 +75,16 @@ def get_campaigns():
             _status:
               description: Response status
               $ref: '#/definitions/ResponseStatus'
+            next:
+              description: ID to be given as "after" for the next page,
+                           or null at the last page. Only if "limit" is given
+              type: string
             campaigns:
               type: array
               items:
                 $ref: '#/definitions/Campaign'
     """
-    camps_raw = commander.campaigns
-    camps_dicts = [camp.to_dict() for camp in camps_raw.values()]
-    return jsonify(_status=ResponseStatus.Success, campaigns=camps_dicts), 200
+    return paginated_response("campaigns", commander.campaigns)
 
 
 @server.route('/campaigns', methods=['POST'])
@@ -99,8 +112,21 @@ def accept_campaigns():
             accepted:
               description: The accepted campaign
               $ref: '#/definitions/Campaign'
+      400:
+        description: Input parameter is invalid
+        schema:
+          properties:
+            _status:
+              description: Response status
+              $ref: '#/definitions/ResponseStatus'
     """
-    campaign = Campaign.make(request.json)
+    campaign, err = validators["Campaign"](request_body())
+    if err is None and campaign.aggregation is not None:
+        _, err = parse_aggregation(campaign.aggregation)
+        if err is not None:
+            err = "Campaign." + err
+    if err is not None:
+        return jsonify(_status=ResponseStatus.make_error(err)), 400
     accepted = commander.accept_campaign(campaign).to_dict()
     if accepted is None:
         return jsonify(_status=ResponseStatus.Failed), 500
@@ -120,7 +146,15 @@ def get_subordinates():
     """
     All subordinates of this commander
     ---
-    parameters: []
+    parameters:
+      - name: limit
+        description: Maximum number of entries to be returned
+        in: query
+        type: integer
+      - name: after
+        description: Return entries after this ID, given as "next"
+        in: query
+        type: string
     responses:
       200:
         description: The subordinate is found
@@ -129,15 +163,17 @@ def get_subordinates():
             _status:
               description: Response status
               $ref: '#/definitions/ResponseStatus'
+            next:
+              description: ID to be given as "after" for the next page,
+                           or null at the last page. Only if "limit" is given
+              type: string
             subordinates:
               description: Information object of the subordinate
               type: array
               items:
                 $ref: '#/definitions/LeaderInfo'
     """
-    subs_raw = commander.subordinates
-    subs_dicts = [sub.to_dict() for sub in subs_raw.values()]
-    return jsonify(_status=ResponseStatus.Success, subordinates=subs_dicts)
+    return paginated_response("subordinates", commander.subordinates)
 
 
 @server.route('/subordinates', methods=['POST'])
@@ -165,7 +201,7 @@ def accept_subordinate():
               description: Information object of the subordinate
               $ref: '#/definitions/LeaderInfo'
       400:
-        description: "[NT] Requested leader already exists in the troop"
+        description: "[NT] Leader already exists or input is invalid"
         schema:
           properties:
             _status:
@@ -176,7 +212,9 @@ def accept_subordinate():
         400: "Requested leader already exists in the troop",
     }
 
-    leader = LeaderInfo.make(request.json)
+    leader, err = validators["LeaderInfo"](request_body())
+    if err is not None:
+        return jsonify(_status=ResponseStatus.make_error(err)), 400
     if commander.check_subordinate(leader.id):
         return jsonify(_status=ResponseStatus.make_error(msgs[400])), 400
 
@@ -214,6 +252,11 @@ def get_sub_info(sub_id):
         description: ID of a requested subordinate
         in: path
         type: string
+      - name: since
+        description: Cursor returned by the previous request,
+                     or empty to get the first cursor
+        in: query
+        type: string
     responses:
       200:
         description: The subordinate is found
@@ -223,8 +266,25 @@ def get_sub_info(sub_id):
               description: Response status
               $ref: '#/definitions/ResponseStatus'
             info:
-              description: Information object of the subordinate
+              description: Information object of the subordinate,
+                           only if the delta is not available
               $ref: '#/definitions/LeaderInfo'
+            delta:
+              description: Changes since the cursor given as "since"
+              properties:
+                added:
+                  type: array
+                  items:
+                    $ref: '#/definitions/Mission'
+                removed:
+                  description: IDs of removed entries
+                  type: array
+                  items:
+                    type: string
+            cursor:
+              description: Cursor to be given as "since" next time,
+                           only if "since" is given
+              type: string
       404:
         description: The subordinate is not found
         schema:
@@ -234,13 +294,38 @@ def get_sub_info(sub_id):
               $ref: '#/definitions/ResponseStatus'
     """
     info = commander.get_sub_info(sub_id)
+    if info is None:  # 存在チェックの後に期限切れで除かれた
+        return jsonify(_status=ResponseStatus.make_error(
+            "The subordinate is not found"
+        )), 404
     commander.receive_heartbeat(sub_id)
     etag = info.hash()
     if_none_match = str(request.if_none_match)[1:-1]  # ダブルクォートを削除
     if etag == if_none_match:
         return make_response(), 304
 
-    response = jsonify(_status=ResponseStatus.Success, info=info.to_dict())
+    # sinceが与えられればcursorを発行し，sinceの時点からの差分が求まれば
+    # 差分のみを返す．cursorを先に発行するので，以降の変更は次回にも
+    # 重複して返ることがある
+    since = request.args.get('since')
+    if since is None:
+        response = jsonify(_status=ResponseStatus.Success,
+                           info=info.to_dict())
+        response.set_etag(etag)
+        return response
+
+    cursor = info.cursor()
+    delta = info.changes_since(since)
+    if delta is None:
+        response = jsonify(_status=ResponseStatus.Success,
+                           info=info.to_dict(),
+                           cursor=cursor)
+    else:
+        added, removed = delta
+        response = jsonify(_status=ResponseStatus.Success,
+                           delta={"added": [c.to_dict() for c in added],
+                                  "removed": removed},
+                           cursor=cursor)
     response.set_etag(etag)
     return response
 
@@ -283,6 +368,10 @@ def delete_commander_info(lid):
 def accept_report(sub_id):
     """
     Accept new report
+    reportはReportかColumnarReportのどちらかの形式で受け付ける
+    {"reports": [report, ...]}の形式で複数のreportをまとめて受け付ける
+    ことができ，その場合acceptedは受理したreportのリストになる
+    キューが一杯で受理できなければ，先頭から受理できた数をacceptedに入れる
     ---
     parameters:
       - name: sub_id
@@ -306,6 +395,13 @@ def accept_report(sub_id):
             accepted:
               description: The accepted report
               $ref: '#/definitions/Report'
+      400:
+        description: Input parameter is invalid
+        schema:
+          properties:
+            _status:
+              description: Response status
+              $ref: '#/definitions/ResponseStatus'
       404:
         description: The subordinate is not found
         schema:
@@ -313,7 +409,136 @@ def accept_report(sub_id):
             _status:
               description: Response status
               $ref: '#/definitions/ResponseStatus'
+      503:
+        description: The ingest queue is full, retry later
+        schema:
+          properties:
+            _status:
+              description: Response status
+              $ref: '#/definitions/ResponseStatus'
     """
-    report = Report.make(request.json)
-    commander.accept_report(sub_id, report)
-    return jsonify(_status=ResponseStatus.Success, accepted=report.to_dict())
+    body = request_body()
+    batch = isinstance(body, dict) and "reports" in body
+    if batch and not isinstance(body["reports"], list):
+        return jsonify(_status=ResponseStatus.make_error(
+            "reports: array required")), 400
+    reports = []
+    for i, source in enumerate(body["reports"] if batch else [body]):
+        if isinstance(source, dict) and "columns" in source:
+            report, err = validators["ColumnarReport"](source)
+        else:
+            report, err = validators["Report"](source)
+        if err is not None:
+            if batch:
+                err = "reports[{0}].{1}".format(i, err)
+            return jsonify(_status=ResponseStatus.make_error(err)), 400
+        reports.append(report)
+
+    for i, report in enumerate(reports):
+        if not commander.accept_report(sub_id, report):
+            response = jsonify(_status=ResponseStatus.make_error(
+                "The ingest queue is full"
+            ), accepted=i)
+            response.headers['Retry-After'] = 1
+            return response, 503
+    if batch:
+        return encoded_response(_status=ResponseStatus.Success,
+                                accepted=[r.to_dict() for r in reports])
+    return encoded_response(_status=ResponseStatus.Success,
+                            accepted=reports[0].to_dict())
+
+
+@server.route('/reports', methods=['GET'])
+def get_reports():
+    """
+    Recently accepted reports
+    直近に受理したreportを新しい順に返す．DBは参照しない
+    ---
+    parameters:
+      - name: purpose
+        description: Purpose (=campaign ID) of reports
+        in: query
+        type: string
+      - name: place
+        description: Place of the leader who sent reports
+        in: query
+        type: string
+      - name: start
+        description: Earliest time of reports in ISO 8601
+        in: query
+        type: string
+      - name: end
+        description: Latest time of reports in ISO 8601
+        in: query
+        type: string
+      - name: limit
+        description: Maximum number of reports to be returned
+        in: query
+        type: integer
+    responses:
+      200:
+        description: A list of reports
+        schema:
+          properties:
+            _status:
+              description: Response status
+              $ref: '#/definitions/ResponseStatus'
+            reports:
+              type: array
+              items:
+                $ref: '#/definitions/Report'
+      400:
+        description: Query parameter is invalid
+        schema:
+          properties:
+            _status:
+              description: Response status
+              $ref: '#/definitions/ResponseStatus'
+    """
+    range_times = {}
+    for key in ['start', 'end']:
+        value = request.args.get(key)
+        if value is None:
+            continue
+        range_times[key] = parse_time(value)
+        if range_times[key] is None:
+            return jsonify(_status=ResponseStatus.make_error(
+                "{0} must be ISO 8601 time".format(key)
+            )), 400
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit():
+            return jsonify(_status=ResponseStatus.make_error(
+                "limit must be a positive integer"
+            )), 400
+        limit = int(limit)
+
+    reports = commander.report_cache.query(purpose=request.args.get('purpose'),
+                                           place=request.args.get('place'),
+                                           limit=limit,
+                                           **range_times)
+    return jsonify(_status=ResponseStatus.Success,
+                   reports=[r.to_dict() for r in reports])
+
+
+@server.route('/ingest', methods=['GET'])
+def get_ingest_stats():
+    """
+    Statistics of the ingest queue
+    reportの値をDBに書き込むキューの状態
+    ---
+    parameters: []
+    responses:
+      200:
+        description: Statistics of the ingest queue
+        schema:
+          properties:
+            _status:
+              description: Response status
+              $ref: '#/definitions/ResponseStatus'
+            ingest:
+              description: Queue depth, batch size and insert latency [sec]
+              type: object
+    """
+    return jsonify(_status=ResponseStatus.Success,
+                   ingest=commander.ingest.stats())
@@ -1,7 +1,9 @@
 from functools import wraps
-from model import SoldierInfo, Work
+import utils.wire as wire
+from model import validators
 from model.leader import Leader
-from utils.helpers import json_input, ResponseStatus
+from utils.helpers import json_input, request_body, encoded_response, \
+    paginated_response, ResponseStatus
 from flask import jsonify, request, Blueprint, make_response
 from controller import logger
 
@@ -38,7 +40,15 @@ def get_missions():
     """
     Accepted missions
     ---
-    parameters: []
+    parameters:
+      - name: limit
+        description: Maximum number of entries to be returned
+        in: query
+        type: integer
+      - name: after
+        description: Return entries after this ID, given as "next"
+        in: query
+        type: string
     responses:
       200:
         description: A list of missions that is accepted by the leader
@@ -47,15 +57,16 @@ def get_missions():
             _status:
               description: Response status
               $ref: '#/definitions/ResponseStatus'
+            next:
+              description: ID to be given as "after" for the next page,
+                           or null at the last page. Only if "limit" is given
+              type: string
             missions:
               type: array
               items:
                 $ref: '#/definitions/Mission'
     """
-    missions_raw = leader.missions
-    missions_dicts = [m.to_dict() for m in missions_raw.values()]
-    return jsonify(_status=ResponseStatus.Success,
-                   missions=missions_dicts), 200
+    return paginated_response("missions", leader.missions)
 
 
 @server.route('/subordinates', methods=['GET'])
@@ -64,7 +75,15 @@ def get_subordinates():
     """
     All subordinates of this leader
     ---
-    parameters: []
+    parameters:
+      - name: limit
+        description: Maximum number of entries to be returned
+        in: query
+        type: integer
+      - name: after
+        description: Return entries after this ID, given as "next"
+        in: query
+        type: string
     responses:
       200:
         description: The subordinate is found
@@ -73,15 +92,17 @@ def get_subordinates():
             _status:
               description: Response status
               $ref: '#/definitions/ResponseStatus'
+            next:
+              description: ID to be given as "after" for the next page,
+                           or null at the last page. Only if "limit" is given
+              type: string
             subordinates:
               description: Information object of the subordinate
               type: array
               items:
                 $ref: '#/definitions/SoldierInfo'
     """
-    subs_raw = leader.subordinates
-    subs_dicts = [sub.to_dict() for sub in subs_raw.values()]
-    return jsonify(_status=ResponseStatus.Success, subordinates=subs_dicts)
+    return paginated_response("subordinates", leader.subordinates)
 
 
 @server.route('/subordinates', methods=['POST'])
@@ -108,8 +129,17 @@ def accept_subordinate():
             accepted:
               description: Information object of the subordinate
               $ref: '#/definitions/SoldierInfo'
+      400:
+        description: Input parameter is invalid
+        schema:
+          properties:
+            _status:
+              description: Response status
+              $ref: '#/definitions/ResponseStatus'
     """
-    soldier = SoldierInfo.make(request.json)
+    soldier, err = validators["SoldierInfo"](request_body())
+    if err is not None:
+        return jsonify(_status=ResponseStatus.make_error(err)), 400
     if not leader.accept_subordinate(soldier):
         return jsonify(_status=ResponseStatus.Failed), 500
 
@@ -145,6 +175,11 @@ def get_sub_info(sub_id):
         description: ID of a requested subordinate
         in: path
         type: string
+      - name: since
+        description: Cursor returned by the previous request,
+                     or empty to get the first cursor
+        in: query
+        type: string
     responses:
       200:
         description: The subordinate is found
@@ -154,17 +189,59 @@ def get_sub_info(sub_id):
               description: Response status
               $ref: '#/definitions/ResponseStatus'
             info:
-              description: Information object of the subordinate
+              description: Information object of the subordinate,
+                           only if the delta is not available
               $ref: '#/definitions/SoldierInfo'
+            delta:
+              description: Changes since the cursor given as "since"
+              properties:
+                added:
+                  type: array
+                  items:
+                    $ref: '#/definitions/Order'
+                removed:
+                  description: IDs of removed entries
+                  type: array
+                  items:
+                    type: string
+            cursor:
+              description: Cursor to be given as "since" next time,
+                           only if "since" is given
+              type: string
     """
     info = leader.get_sub_info(sub_id)
+    if info is None:  # 存在チェックの後に期限切れで除かれた
+        return jsonify(_status=ResponseStatus.make_error(
+            "The subordinate is not found"
+        )), 404
     leader.receive_heartbeat(sub_id)
     etag = info.hash()
     if_none_match = str(request.if_none_match)[1:-1]  # ダブルクォートを削除
     if etag == if_none_match:
         return make_response(), 304
 
-    response = jsonify(_status=ResponseStatus.Success, info=info.to_dict())
+    # sinceが与えられればcursorを発行し，sinceの時点からの差分が求まれば
+    # 差分のみを返す．cursorを先に発行するので，以降の変更は次回にも
+    # 重複して返ることがある
+    since = request.args.get('since')
+    if since is None:
+        response = jsonify(_status=ResponseStatus.Success,
+                           info=info.to_dict())
+        response.set_etag(etag)
+        return response
+
+    cursor = info.cursor()
+    delta = info.changes_since(since)
+    if delta is None:
+        response = jsonify(_status=ResponseStatus.Success,
+                           info=info.to_dict(),
+                           cursor=cursor)
+    else:
+        added, removed = delta
+        response = jsonify(_status=ResponseStatus.Success,
+                           delta={"added": [c.to_dict() for c in added],
+                                  "removed": removed},
+                           cursor=cursor)
     response.set_etag(etag)
     return response
 
@@ -203,16 +280,21 @@ def delete_commander_info(sid):
 
 @server.route('/subordinates/<sub_id>/work', methods=['POST'])
 @access_subordinate
-@json_input
 def accept_work(sub_id):
     """
     Accept new work
+    passthroughモードのLeaderはpurposeが指定されたworkをデコードせずに受理する
+    その場合レスポンスにacceptedは含まれない
     ---
     parameters:
       - name: sub_id
         description: The work's author-id
         in: path
         type: string
+      - name: purpose
+        description: The work's purpose
+        in: query
+        type: string
       - name: work
         description: A work to be accepted
         in: body
@@ -230,7 +312,68 @@ def accept_work(sub_id):
             accepted:
               description: The accepted work
               $ref: '#/definitions/Work'
+      400:
+        description: Input parameter is invalid
+        schema:
+          properties:
+            _status:
+              description: Response status
+              $ref: '#/definitions/ResponseStatus'
     """
-    work = Work.make(request.json)
+    purpose = request.args.get('purpose', type=str)
+    # 圧縮されたworkはそのまま埋め込めないので，展開して通常通り受理する
+    if leader.report_format == "passthrough" and purpose is not None and \
+            wire.supports(request.mimetype) and \
+            request.headers.get('Content-Encoding') is None:
+        body = request.get_data()
+        # 壊れたworkを埋め込むとreport全体が不正になるので，
+        # 埋め込むのはバイト列のままだが検査はデコードして行う
+        try:
+            work, err = validators["Work"](wire.decode(body,
+                                                       request.mimetype))
+        except ValueError:
+            work, err = None, "The work couldn't be decoded"
+        if err is None and work.purpose != purpose:
+            err = "The work's purpose doesn't match the query"
+        if err is not None:
+            return jsonify(_status=ResponseStatus.make_error(err)), 400
+        if not leader.accept_raw_work(sub_id, purpose, request.mimetype,
+                                      body):
+            return jsonify(_status=ResponseStatus.make_error(
+                "The work must be an object"
+            )), 400
+        return encoded_response(_status=ResponseStatus.Success)
+    return _accept_work(sub_id)
+
+
+@json_input
+def _accept_work(sub_id):
+    work, err = validators["Work"](request_body())
+    if err is not None:
+        return jsonify(_status=ResponseStatus.make_error(err)), 400
     leader.accept_work(sub_id, work)
-    return jsonify(_status=ResponseStatus.Success, accepted=work.to_dict())
+    return encoded_response(_status=ResponseStatus.Success,
+                            accepted=work.to_dict())
+
+
+@server.route('/outbox', methods=['GET'])
+def get_outbox_stats():
+    """
+    Statistics of the report outbox
+    上官に送れなかったreportの送信待ちの状態
+    ---
+    parameters: []
+    responses:
+      200:
+        description: Statistics of the report outbox
+        schema:
+          properties:
+            _status:
+              description: Response status
+              $ref: '#/definitions/ResponseStatus'
+            outbox:
+              description: Pending reports, retry state and drop counts
+              type: object
+    """
+    return jsonify(_status=ResponseStatus.Success,
+                   outbox=leader.outbox.stats())
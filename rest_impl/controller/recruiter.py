@@ -1,6 +1,6 @@
-from model import CommanderInfo
+from model import validators
 from model.recruiter import Recruiter
-from utils.helpers import json_input, ResponseStatus
+from utils.helpers import json_input, request_body, ResponseStatus
 from flask import jsonify, request, Blueprint
 from controller import logger
 
@@ -113,14 +113,13 @@ def register_commanders(com_id):
         400: "Input parameter is invalid",
     }
 
-    try:
-        com = CommanderInfo.make(request.json)
-    except TypeError:
-        return jsonify(_status=ResponseStatus.make_error(msgs[400]),
-                       input=request.json), 400
+    com, err = validators["CommanderInfo"](request_body())
+    if err is not None:
+        return jsonify(_status=ResponseStatus.make_error(err),
+                       input=request_body()), 400
     if com.id != com_id:
         return jsonify(_status=ResponseStatus.make_error(msgs[400]),
-                       input=request.json), 400
+                       input=request_body()), 400
 
     accepted = recruiter.register_commander_info(com)
     if accepted is None:
@@ -5,19 +5,22 @@ handler.setLevel(DEBUG)
 logger.setLevel(DEBUG)
 logger.addHandler(handler)
 
-from model.info_obj import Requirement, Campaign, Mission, Order, Report, Work
+from model.info_obj import Requirement, Campaign, Mission, Order, Report, \
+    ColumnarReport, Work
 from model.soldier import Soldier, SoldierInfo
 from model.leader import Leader, LeaderInfo
 from model.commander import Commander, CommanderInfo
 from model.recruiter import Recruiter
 
 definitions = dict()
+validators = dict()
 
 
 def __init__():
     import model.soldier
     import model.leader
     import model.commander
+    from model.validator import compile_validators
     global definitions
 
     definitions["ResponseStatus"] = {
@@ -34,4 +37,18 @@ def __init__():
 
     definitions.update(model.info_obj.definitions)
 
+    # リクエストの検査・生成関数をdefinitionsから生成する
+    validators.update(compile_validators(definitions, {
+        "Requirement": Requirement,
+        "Campaign": Campaign,
+        "Mission": Mission,
+        "Order": Order,
+        "Report": Report,
+        "ColumnarReport": ColumnarReport,
+        "Work": Work,
+        "SoldierInfo": SoldierInfo,
+        "LeaderInfo": LeaderInfo,
+        "CommanderInfo": CommanderInfo,
+    }))
+
 __init__()
@@ -0,0 +1,245 @@
+"""
+Campaignのaggregationに従い，値を時間窓ごとの集約値にまとめる
+
+    "aggregation": {"window": 60, "functions": ["min", "max", "mean"],
+                    "sample": true}
+
+(place, 値の種類)ごとに現在の窓の集約値だけを持ち，次の窓の値が来れば
+それまでの窓の集約値を1つのドキュメントとして出力する
+sampleがtrueであれば，窓ごとに最後の生の値のドキュメントも出力する
+"""
+import datetime
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+from model.report_cache import parse_time
+
+FUNCTIONS = ("count", "sum", "min", "max", "mean", "first", "last")
+
+
+def parse_aggregation(spec):
+    """
+    Campaignのaggregationを検査する
+    :param Dict spec: aggregationの値
+    :return: (window, functions, sample)とNone，不正であればNoneとエラー
+    """
+    if not isinstance(spec, dict):
+        return None, "aggregation: object required"
+    window = spec.get("window")
+    if isinstance(window, bool) or not isinstance(window, (int, float)) or \
+            window <= 0:
+        return None, "aggregation.window: positive number required"
+    functions = spec.get("functions", ["min", "max", "mean"])
+    if not isinstance(functions, list) or len(functions) == 0:
+        return None, "aggregation.functions: non-empty array required"
+    for i, f in enumerate(functions):
+        if f not in FUNCTIONS:
+            return None, "aggregation.functions[{0}]: one of {1}".format(
+                i, ", ".join(FUNCTIONS))
+    sample = spec.get("sample", False)
+    if not isinstance(sample, bool):
+        return None, "aggregation.sample: boolean required"
+    return (window, functions, sample), None
+
+
+class _Window(object):
+    __slots__ = ('bucket', 'unit', 'count', 'sum', 'min', 'max',
+                 'first', 'last', 'last_doc')
+
+    def __init__(self, bucket, unit, value, doc):
+        self.bucket = bucket
+        self.unit = unit
+        self.count = 1
+        self.sum = value
+        self.min = value
+        self.max = value
+        self.first = value
+        self.last = value
+        self.last_doc = doc
+
+    def copy(self):
+        other = _Window.__new__(_Window)
+        for name in self.__slots__:
+            setattr(other, name, getattr(self, name))
+        return other
+
+    def add(self, value, doc):
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.last = value
+        self.last_doc = doc
+
+
+class WindowAggregator(object):
+    def __init__(self, purpose, window, functions, sample=False):
+        """
+        :param str purpose: 出力するドキュメントのpurpose
+        :param float window: 窓の幅 [sec]
+        :param List[str] functions: 出力する集約値（FUNCTIONSのいずれか）
+        :param bool sample: 窓ごとに最後の生の値も出力する
+        """
+        self.purpose = purpose
+        self.window = window
+        self.functions = functions
+        self.sample = sample
+        self.lock = Lock()
+        self.windows = {}  # type: Dict[Tuple[str, str], _Window]
+        self.latest = None
+        # 格納できず，取り消しもできなかった出力．次の出力の先頭に付ける
+        self.pending = []  # type: List[Dict]
+        # addのたびに増やす．commitの失敗時に取り消せるかの判定に使う
+        self.generation = 0
+
+        self.received = 0
+        self.emitted = 0
+
+    @classmethod
+    def make(cls, campaign):
+        """
+        Campaignのaggregationから生成する
+        :param Campaign campaign: 対象のCampaign
+        :return WindowAggregator: aggregationが無いか不正であればNone
+        """
+        if campaign.aggregation is None:
+            return None
+        settings, err = parse_aggregation(campaign.aggregation)
+        if err is not None:
+            return None
+        return cls(campaign.purpose, *settings)
+
+    def add(self, documents, commit: Callable = None) -> List[Dict]:
+        """
+        値のドキュメントを集約し，出力するドキュメントを返す
+        数値でない値や時刻の読めない値，完了した窓に遅れて届いた値は
+        集約せずにそのまま返す
+        commitが指定されていれば，ロックを放してから出力するドキュメントを渡す
+        Falseが返れば（格納できなければ）集約を取り消して呼ぶ前の状態に戻す
+        その間に他のaddが集約を進めていれば取り消せないので，出力は次回に回し
+        値は集約に加えたままにする
+        :param List[Dict] documents: 格納するはずだったドキュメント
+        :param Callable commit: 出力するドキュメントを受け取る関数
+        :return List[Dict]: 代わりに格納するドキュメント．取り消せばNone
+        """
+        with self.lock:
+            # 窓のキー -> 変更前の窓（新しく開いた窓はNone）
+            undo = {}
+            saved = (self.latest, self.received, self.emitted)
+            pending, self.pending = self.pending, []
+            output = pending + self._add(documents, undo)
+            self.generation += 1
+            generation = self.generation
+        if commit is None or commit(output):
+            return output
+
+        with self.lock:
+            if self.generation != generation:
+                self.pending = output + self.pending
+                return []
+            for key, window in undo.items():
+                if window is None:
+                    self.windows.pop(key, None)
+                else:
+                    self.windows[key] = window
+            self.latest, self.received, self.emitted = saved
+            self.pending = pending + self.pending
+        return None
+
+    def _add(self, documents, undo):
+        output = []
+        epochs = {}
+        for doc in documents:
+            data = doc["data"]
+            value = data.get("value")
+            if isinstance(value, bool) or \
+                    not isinstance(value, (int, float)):
+                output.append(doc)
+                continue
+            epoch = epochs.get(doc["time"], False)
+            if epoch is False:
+                parsed = parse_time(doc["time"])
+                epoch = epochs[doc["time"]] = \
+                    None if parsed is None else parsed.timestamp()
+            if epoch is None:
+                output.append(doc)
+                continue
+
+            self.received += 1
+            bucket = int(epoch // self.window)
+            key = (doc["place"], data["type"])
+            current = self.windows.get(key)
+            if key not in undo:
+                undo[key] = None if current is None else current.copy()
+            if current is not None and bucket == current.bucket:
+                current.add(value, doc)
+                continue
+            if current is not None and bucket < current.bucket:
+                output.append(doc)
+                continue
+            if current is not None:
+                output.extend(self._emit(key, current))
+            self.windows[key] = _Window(bucket, data.get("unit"),
+                                        value, doc)
+            if self.latest is None or bucket > self.latest:
+                self.latest = bucket
+                output.extend(self._emit_idle(undo))
+        return output
+
+    def flush(self) -> List[Dict]:
+        """
+        途中の窓も含めて全ての集約値を出力する
+        :return List[Dict]: 格納するドキュメント
+        """
+        with self.lock:
+            output, self.pending = self.pending, []
+            self.generation += 1
+            for key, current in list(self.windows.items()):
+                output.extend(self._emit(key, current))
+            self.windows.clear()
+        return output
+
+    def stats(self):
+        with self.lock:
+            return {
+                "window": self.window,
+                "open_windows": len(self.windows),
+                "pending": len(self.pending),
+                "received": self.received,
+                "emitted": self.emitted,
+            }
+
+    def _emit_idle(self, undo):
+        """
+        他の値が2つ先の窓に進んでも更新の無い窓を出力する
+        """
+        output = []
+        idle = [key for key, w in self.windows.items()
+                if w.bucket < self.latest - 1]
+        for key in idle:
+            window = self.windows.pop(key)
+            undo.setdefault(key, window)
+            output.extend(self._emit(key, window))
+        return output
+
+    def _emit(self, key, current):
+        place, v_type = key
+        start = datetime.datetime.fromtimestamp(
+            current.bucket * self.window, datetime.timezone.utc)
+        data = {"type": v_type, "unit": current.unit, "window": self.window}
+        for f in self.functions:
+            if f == "mean":
+                data[f] = current.sum / current.count
+            else:
+                data[f] = getattr(current, f)
+        documents = [{
+            "purpose": self.purpose,
+            "place": place,
+            "time": start.isoformat(),
+            "data": data
+        }]
+        if self.sample:
+            documents.append(current.last_doc)
+        self.emitted += len(documents)
+        return documents
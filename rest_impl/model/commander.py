@@ -1,11 +1,18 @@
-import copy
 import json
+from threading import RLock
+import utils.isotime as isotime
+import utils.mongo as mongo
 import utils.rest as rest
-import requests
-from threading import Thread, Event
-from typing import List, Dict
-from model.info_obj import InformationObject
-from model import LeaderInfo, Campaign, Mission
+from typing import List, Dict, Set
+from model.aggregation import WindowAggregator
+from model.info_obj import InformationObject, intern_value
+from model.ingest import IngestQueue
+from model.report_cache import ReportCache
+from utils.liveness import LivenessTracker
+from utils.notifier import Notifier
+from utils.place_index import PlaceIndex, match_place, \
+    resolve_place
+from model import LeaderInfo, Campaign, Mission, ColumnarReport, Requirement
 from model import logger
 
 
@@ -63,13 +70,32 @@ class Commander(object):
         self.place = ""
         self.endpoint = endpoint
         self.subordinates = {}  # type:Dict[str, LeaderInfo]
-        self.sub_heart_waits = {}  # type:Dict[str, Event]
+        self.place_index = PlaceIndex()
+        # 180秒heartbeatが無ければK.I.A.
+        self.liveness = LivenessTracker(180, self._expire_subordinates)
         self.campaigns = {}  # type:Dict[str, Campaign]
-        self.report_cache = []
+        # CampaignのID -> そのMissionを割り当てた部下のID
+        self.campaign_subs = {}  # type:Dict[str, Set[str]]
+        # 部下・Campaignと上の索引の書き換えはこのロックの下で行う
+        # 部下の期限切れはLivenessTrackerのスレッドから届く
+        self.troop_lock = RLock()
+        # aggregationを持つCampaignのID -> 集約の途中経過
+        self.aggregators = {}  # type:Dict[str, WindowAggregator]
+        self.report_cache = ReportCache()
         self.recruiter_ep = ""
         self.token = ""
+        # エラーの通知はスレッドから送り，同じメッセージはまとめる
+        self.notifier = Notifier("https://slack.com/api/chat.postMessage",
+                                 self._slack_payload)
+        self.ingest = IngestQueue(lambda uri: MongoPush(uri))
+        self.ingest_timeout = 5.0
 
     def shutdown(self):
+        self.liveness.stop()
+        self.notifier.stop()
+        for cid in list(self.aggregators):
+            self._flush_aggregator(cid)
+        self.ingest.close(timeout=self.ingest_timeout)
         url = "{0}commanders/{1}".format(self.recruiter_ep, self.id)
         res, err = rest.delete(url)  # type: Response, str
         if err is not None:
@@ -114,37 +140,81 @@ class Commander(object):
         return sub_id in self.subordinates
 
     def get_sub_info(self, sub_id):
-        return self.subordinates[sub_id]
+        """
+        :return LeaderInfo: 部下の情報．期限切れなどで居なければNone
+        """
+        return self.subordinates.get(sub_id)
 
     def accept_campaign(self, campaign: Campaign):
-        # Campaignの更新であれば（=IDが同じであれば）既存のものを消す
-        if campaign.get_id() in self.campaigns:
-            self.remove_campaign(campaign.get_id())
-
-        # 部下のMissionを生成・割り当てる
-        target_subs = []
-        if campaign.place == "All":
-            target_subs = list(self.subordinates.keys())
-        m_base = Mission(author='',
-                         place='All',
-                         purpose=campaign.get_id(),
-                         requirement=campaign.requirement,
-                         trigger=campaign.trigger)
-        for t_id in target_subs:
-            mission = copy.deepcopy(m_base)
-            mission.author = t_id
-            self.subordinates[t_id].missions.append(mission)
+        with self.troop_lock:
+            # Campaignの更新であれば（=IDが同じであれば）既存のものを消す
+            if campaign.get_id() in self.campaigns:
+                self.remove_campaign(campaign.get_id())
+
+            # 部下のMissionを生成・割り当てる
+            # placeの合う部下に，
+            # その部下の配下に当たる残りをplaceとするMissionを渡す
+            self._assign_campaign(campaign,
+                                  self.place_index.match(campaign.place))
+
+            aggregator = WindowAggregator.make(campaign)
+            if aggregator is not None:
+                self.aggregators[campaign.get_id()] = aggregator
+            self.campaigns[campaign.get_id()] = campaign
 
         logger.info(">> got campaign:")
         logger.info(json.dumps(campaign.to_dict(), sort_keys=True, indent=2))
-        self.campaigns[campaign.get_id()] = campaign
         return campaign
 
+    def _assign_campaign(self, campaign, sub_ids):
+        """
+        指定された部下にCampaignのMissionを割り当て，割り当て先を記録する
+        troop_lockを取った状態で呼ぶ
+        :param Campaign campaign: 割り当てるCampaign
+        :param Set[str] sub_ids: 割り当てる部下のID
+        """
+        # requirementとtriggerは全てのMissionで同じものを共有する
+        requirement = Requirement.intern(campaign.requirement)
+        trigger = intern_value(campaign.trigger)
+        assigned = self.campaign_subs.setdefault(campaign.get_id(), set())
+        for t_id in sub_ids:
+            mission_place = resolve_place(self.subordinates[t_id].place,
+                                          campaign.place)
+            mission = Mission(author=t_id,
+                              place=mission_place,
+                              purpose=campaign.get_id(),
+                              requirement=requirement,
+                              trigger=trigger)
+            self.subordinates[t_id].add_mission(mission)
+            assigned.add(t_id)
+
     def remove_campaign(self, cid):
-        del self.campaigns[cid]
-        # 対象idに紐づくミッションを消す
-        for sub in self.subordinates.values():
-            [sub.missions.remove(m) for m in sub.missions if m.purpose == cid]
+        with self.troop_lock:
+            self._flush_aggregator(cid)
+            del self.campaigns[cid]
+            # 対象idのMissionを割り当てた部下のみを辿って消す
+            # 部下の情報の書き換えはコピーの差し替えなので，
+            # heartbeatで読み出し中のmissionsには影響しない
+            for sid in self.campaign_subs.pop(cid, ()):
+                sub = self.subordinates.get(sid)
+                if sub is not None:
+                    sub.remove_missions(cid)
+
+    def _flush_aggregator(self, cid):
+        """
+        Campaignの途中の窓の集約値を書き込み，集約をやめる
+        :param str cid: CampaignのID
+        """
+        aggregator = self.aggregators.pop(cid, None)
+        if aggregator is None:
+            return
+        push_data = aggregator.flush()
+        destination = self.campaigns[cid].destination
+        if "mongodb://" in destination and \
+                not self.ingest.put(destination, push_data,
+                                    timeout=self.ingest_timeout):
+            logger.error("aggregation: failed to queue {0} values".format(
+                len(push_data)))
 
     def accept_subordinate(self, sub_info):
         """
@@ -152,38 +222,43 @@ class Commander(object):
         :param LeaderInfo sub_info: 受け入れるLeaderの情報
         :return bool:
         """
-        if self.check_subordinate(sub_info.id):
-            return None
-        self.subordinates[sub_info.id] = sub_info
-        self.sub_heart_waits[sub_info.id] = Event()
-        Thread(target=self._heart_watch,
-               args=(sub_info.id, ), daemon=True).start()
-
-        old_campaigns = self.campaigns.values()
-        [self.accept_campaign(c) for c in old_campaigns]
-        return sub_info
-
-    def _heart_watch(self, sid):
-        while self.sub_heart_waits[sid].wait(timeout=180):
-            # timeoutまでにevent.setされたら待ち続行
-            # timeoutしたらK.I.A.
-            self.sub_heart_waits[sid].clear()
-
-        if self.remove_subordinate(sid):
-            # removeが失敗すれば（そもそも削除済であれば）実行しない
-            logger.error("へんじがない ただのしかばねのようだ :{0}".format(sid))
+        with self.troop_lock:
+            if self.check_subordinate(sub_info.id):
+                return None
+            self.subordinates[sub_info.id] = sub_info
+            self.place_index.add(sub_info.id, sub_info.place)
+            self.liveness.touch(sub_info.id)
+
+            # 既存のCampaignのうちplaceの合うものを新しい部下にだけ割り当てる
+            # 部下が持参したMissionは割り当て直すので取り除く
+            for cid, campaign in list(self.campaigns.items()):
+                sub_info.remove_missions(cid)
+                if match_place(sub_info.place, campaign.place):
+                    self._assign_campaign(campaign, [sub_info.id])
+            return sub_info
+
+    def _expire_subordinates(self, sids):
+        for sid in sids:
+            if self.remove_subordinate(sid):
+                # removeが失敗すれば（そもそも削除済であれば）実行しない
+                logger.error("へんじがない ただのしかばねのようだ :{0}".
+                             format(sid))
 
     def receive_heartbeat(self, sid):
         if not self.check_subordinate(sid):
             return False
-        self.sub_heart_waits[sid].set()
+        self.liveness.touch(sid)
 
     def remove_subordinate(self, sub_id):
-        if not self.check_subordinate(sub_id):
-            return False
-        del self.subordinates[sub_id]
-        self.sub_heart_waits[sub_id].set()
-        return True
+        with self.troop_lock:
+            if not self.check_subordinate(sub_id):
+                return False
+            sub_info = self.subordinates.pop(sub_id)
+            for m in sub_info.missions:
+                self.campaign_subs.get(m.purpose, set()).discard(sub_id)
+            self.place_index.remove(sub_id)
+            self.liveness.forget(sub_id)
+            return True
 
     def accept_report(self, sub_id, report):
         if not self.check_subordinate(sub_id):
@@ -196,54 +271,109 @@ class Commander(object):
             self.push_error("leader-{0}'s error: {1}".format(sub_id, msg))
             return True
 
-        if report.purpose in self.campaigns:
-            campaign = self.campaigns[report.purpose]
+        campaign = self.campaigns.get(report.purpose)
+        if campaign is not None:
             if "mongodb://" in campaign.destination:
-                push = MongoPush(campaign.destination)
-                push_data = []
-                for work in report.values:
-                    push_data.extend([{
-                        "purpose": campaign.purpose,
-                        "place": "{0}.{1}".format(report.place, work["place"]),
-                        "time": work["time"],
-                        "data": v
-                    } for v in work["values"]])
-                push.push_values(push_data)
-
-                logger.info("accept_report: {0}".format(push_data))
+                if isinstance(report, ColumnarReport):
+                    push_data = self._columnar_documents(campaign, report)
+                else:
+                    push_data = []
+                    for work in report.values:
+                        push_data.extend([{
+                            "purpose": campaign.purpose,
+                            "place": "{0}.{1}".format(report.place,
+                                                      work["place"]),
+                            "time": work["time"],
+                            "data": v
+                        } for v in work["values"]])
+                # 書き込みはIngestQueueのworkerが行う
+                # キューが空かなければreportは受理しない
+                def put(documents):
+                    return self.ingest.put(campaign.destination, documents,
+                                           timeout=self.ingest_timeout)
+
+                # aggregationがあれば窓ごとの集約値に置き換える
+                # 積めなければ集約も取り消し，再送されたreportを二重に数えない
+                aggregator = self.aggregators.get(report.purpose)
+                if aggregator is not None:
+                    push_data = aggregator.add(push_data, commit=put)
+                    accepted = push_data is not None
+                else:
+                    accepted = put(push_data)
+                if not accepted:
+                    logger.error("accept_report: the ingest queue is full")
+                    return False
+
+                logger.info("accept_report: {0} values are queued".format(
+                    len(push_data)))
 
             self.report_cache.append(report)
         return True
 
+    @staticmethod
+    def _columnar_documents(campaign, report):
+        """
+        ColumnarReportの列から直接MongoDBに格納するドキュメントを生成する
+        :param Campaign campaign: reportに対応するCampaign
+        :param ColumnarReport report: 受理したreport
+        :return List[Dict]: 値ごとのドキュメント
+        """
+        places = ["{0}.{1}".format(report.place, p) for p in report.places]
+        documents = []
+        for v_type, column in zip(report.types, report.columns):
+            unit = report.units.get(v_type)
+            for time, place, value in zip(report.times, places, column):
+                if value is None:
+                    continue
+                documents.append({
+                    "purpose": campaign.purpose,
+                    "place": place,
+                    "time": time,
+                    "data": {"type": v_type, "value": value, "unit": unit}
+                })
+        return documents
+
     def push_error(self, msg):
-        url = "https://slack.com/api/chat.postMessage"
-        data = {
+        """
+        エラーを通知する．送信は待たない
+        :param str msg: 通知するメッセージ
+        """
+        self.notifier.notify(msg)
+
+    def _slack_payload(self, msg):
+        return {
             "token": self.token,
             "channel": "@inomoto",
             "text": msg,
             "username": "commander",
         }
-        requests.post(url, data=data)
 
 
 class MongoPush(object):
     def __init__(self, uri):
-        import pymongo
-        import re
-        match_result = re.match(r"mongodb://(.*?)/(.*?)/(.*)", uri)
-        if match_result is None:
+        self.host = None
+        self.col = None
+        parsed = mongo.parse_uri(uri)
+        if parsed is None:
             logger.error("uri is not mongodb-uri: {0}".format(uri))
             return
-        host = match_result.group(1)
-        db_name = match_result.group(2)
-        col_name = match_result.group(3)
-        self.col = pymongo.MongoClient(host)[db_name][col_name]
+        host, db_name, col_name = parsed
+        # クライアントはホストごとに共有し，接続を使い回す
+        self.col = mongo.registry.acquire(host)[db_name][col_name]
+        self.host = host
+
+    def close(self):
+        if self.host is not None:
+            mongo.registry.release(self.host)
+            self.host = None
 
     def push_values(self, values):
-        import dateutil.parser
         if len(values) == 0:
             return
         # timeの値を文字列からdatetime型に変換する
-        [v.update({"time": dateutil.parser.parse(v["time"])}) for v in values]
+        # 同じWorkの値は同じ文字列を持つので，変換結果を使い回す
+        # 失敗したときにスプールへ退避できるよう，valuesは書き換えない
+        parse = isotime.CachedParser()
+        docs = [dict(v, time=parse(v["time"])) for v in values]
 
-        self.col.insert_many(values)
+        self.col.insert_many(docs)
@@ -0,0 +1,145 @@
+"""
+Leaderでのworkの集約（aggregateモード）
+reportの送信時に，溜まったworkの数値を(place, 値の種類)ごとの
+統計値（count, min, max, mean, std, パーセンタイル）にまとめる
+加速度などの3軸の値は3列の行列として列ごとに求める
+numpyがインストールされていれば，行数と軸の数が同じ値を
+1つの配列にまとめてnumpyで一度に計算する
+"""
+import math
+from collections import OrderedDict
+from typing import Dict, List
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_PERCENTILES = (50, 90)
+
+
+def uses_numpy():
+    """
+    :return bool: numpyで計算するのであればTrue
+    """
+    return numpy is not None
+
+
+def _row(value):
+    """
+    値を行に変換する
+    :return: 数値のタプル．数値でなければNone
+    """
+    if isinstance(value, (list, tuple)):
+        if len(value) == 0:
+            return None
+        for v in value:
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                return None
+        return tuple(value)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value,
+
+
+def _numpy_stats(blocks, percentiles):
+    """
+    行数と軸の数が同じ値をまとめて1つの3次元配列にし，一度に計算する
+    :param blocks: 値の種類ごとの行のリスト
+    :return: blocksと同じ順の，統計値ごとの列の値
+    """
+    result = [None] * len(blocks)
+    shapes = OrderedDict()
+    for i, rows in enumerate(blocks):
+        shapes.setdefault((len(rows), len(rows[0])), []).append(i)
+    for indexes in shapes.values():
+        # (値の種類, 行, 軸)
+        arr = numpy.array([blocks[i] for i in indexes], dtype=float)
+        columns = [("min", arr.min(axis=1).tolist()),
+                   ("max", arr.max(axis=1).tolist()),
+                   ("mean", arr.mean(axis=1).tolist()),
+                   ("std", arr.std(axis=1).tolist())]
+        if len(percentiles) > 0:
+            ranks = numpy.percentile(arr, percentiles, axis=1).tolist()
+            for q, rank in zip(percentiles, ranks):
+                columns.append(("p{0:g}".format(q), rank))
+        for j, i in enumerate(indexes):
+            result[i] = OrderedDict((key, values[j])
+                                    for key, values in columns)
+    return result
+
+
+def _python_stats(blocks, percentiles):
+    return [_python_block_stats(rows, percentiles) for rows in blocks]
+
+
+def _python_block_stats(rows, percentiles):
+    count = len(rows)
+    stats = OrderedDict((key, []) for key in ["min", "max", "mean", "std"])
+    for q in percentiles:
+        stats["p{0:g}".format(q)] = []
+    for column in zip(*rows):
+        s = sorted(column)
+        mean = math.fsum(s) / count
+        stats["min"].append(float(s[0]))
+        stats["max"].append(float(s[-1]))
+        stats["mean"].append(mean)
+        stats["std"].append(
+            math.sqrt(math.fsum((x - mean) ** 2 for x in s) / count))
+        for q in percentiles:
+            # numpy.percentileの既定（線形補間）と同じ
+            rank = (count - 1) * q / 100
+            lo = int(math.floor(rank))
+            hi = min(lo + 1, count - 1)
+            stats["p{0:g}".format(q)].append(
+                s[lo] + (s[hi] - s[lo]) * (rank - lo))
+    return stats
+
+
+def summarize(works, percentiles=DEFAULT_PERCENTILES) -> List[Dict]:
+    """
+    workの列をplaceごとの統計値にまとめる
+    数値でない値や，同じ種類で最初の値と軸の数が違う値は数えない
+    :param works: (time, place, values)のリスト．valuesはWork.valuesの形式
+    :param percentiles: 求めるパーセンタイル（0～100）
+    :return List[Dict]: Report.valuesの形式．placeごとに
+        {"time": 最初の時刻, "until": 最後の時刻, "place": place,
+         "values": [{"type", "unit", "count", "min", "max", "mean",
+                     "std", "p50", ...}]}
+        3軸の値の統計値は軸ごとのリスト
+    """
+    # place -> [最初の時刻, 最後の時刻, type -> [unit, 軸の数, 行のリスト]]
+    places = OrderedDict()
+    for w_time, w_place, values in works:
+        entry = places.get(w_place)
+        if entry is None:
+            entry = places[w_place] = [w_time, w_time, OrderedDict()]
+        entry[1] = w_time
+        for v in values:
+            row = _row(v.get("value"))
+            if row is None:
+                continue
+            group = entry[2].get(v["type"])
+            if group is None:
+                group = entry[2][v["type"]] = [v.get("unit"), len(row), []]
+            if len(row) == group[1]:
+                group[2].append(row)
+
+    blocks = [rows for _, _, groups in places.values()
+              for _, _, rows in groups.values()]
+    if numpy is not None:
+        stats = iter(_numpy_stats(blocks, percentiles))
+    else:
+        stats = iter(_python_stats(blocks, percentiles))
+    result = []
+    for place, (first, last, groups) in places.items():
+        values = []
+        for v_type, (unit, width, rows) in groups.items():
+            value = {"type": v_type, "unit": unit, "count": len(rows)}
+            for key, columns in next(stats).items():
+                # スカラーの値の統計値はスカラーにする
+                value[key] = columns if width > 1 else columns[0]
+            values.append(value)
+        result.append({"time": first, "until": last, "place": place,
+                       "values": values})
+    return result
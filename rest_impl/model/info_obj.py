@@ -1,33 +1,93 @@
+import copy
 import hashlib
+import inspect
+import threading
+import uuid
+import weakref
 from typing import List, Dict
 
+# 型注釈がこれらの型であるフィールドは変換せずにそのまま出力する
+_PRIMITIVE_TYPES = (str, int, float, bool)
+
+# 子要素のhashの合成用
+_DIGEST_MOD = 2 ** 128
+_children_lock = threading.Lock()
+
+# 差分取得用に保持する子要素の変更履歴の最大数
+_JOURNAL_SIZE = 256
+
+
+def _convert(value):
+    """
+    to_dictの値変換．InformationObjectはdictに，そのリストはdictのリストに
+    変換し，リストはソート可能であればソートする
+    """
+    if isinstance(value, InformationObject):
+        return value.to_dict()
+    if isinstance(value, list):
+        first = value[0] if len(value) > 0 else None
+        if isinstance(first, InformationObject):
+            value = [v.to_dict() for v in value]
+        try:
+            value = sorted(value)
+        except TypeError:
+            pass
+    return value
+
+
+def _child_digest(item):
+    return int(item.hash(), 16)
+
+
+def _field_names(cls):
+    """
+    クラスのフィールド名一覧を__slots__もしくは__init__の引数から求める
+    :param type cls: 対象のクラス
+    :return List[str]: アルファベット順のフィールド名
+    """
+    slots = cls.__dict__.get('__slots__')
+    if slots is not None:
+        names = [slots] if isinstance(slots, str) else list(slots)
+    else:
+        params = inspect.signature(cls.__init__).parameters.values()
+        names = [p.name for p in params
+                 if p.name != 'self' and
+                 p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD)]
+    return sorted(n for n in names if n[0] != '_')
+
+
+def _compile_to_dict(cls, fields):
+    """
+    フィールド一覧からクラス専用のto_dictを生成する
+    """
+    hints = getattr(cls.__init__, '__annotations__', {})
+    lines = ["def to_dict(self):", "    return {"]
+    for key in fields:
+        if hints.get(key) in _PRIMITIVE_TYPES:
+            lines.append("        {0!r}: self.{0},".format(key))
+        else:
+            lines.append("        {0!r}: _convert(self.{0}),".format(key))
+    lines.append("    }")
+    namespace = {'_convert': _convert}
+    exec("\n".join(lines), namespace)
+    return namespace['to_dict']
+
 
 class InformationObject(object):
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        # フィールド一覧とto_dictはクラス定義時に一度だけ求める
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(_field_names(cls))
+        if 'to_dict' not in cls.__dict__:
+            cls.to_dict = _compile_to_dict(cls, cls._fields)
+
     def _props(self):
-        return filter(lambda key:
-                      key[0] != '.' and
-                      key[0] != '_' and
-                      not callable(getattr(self, key)),
-                      dir(self))
+        return self._fields
 
     def to_dict(self):
-        res_dict = {}
-        for key in self._props():
-            value = getattr(self, key)
-            if isinstance(value, InformationObject):
-                value = value.to_dict()
-            if isinstance(value, list):
-                first = value[0] if len(value) > 0 else None
-                if isinstance(first, InformationObject):
-                    value = [v.to_dict() for v in value]
-            if isinstance(value, list):
-                try:
-                    value = sorted(value)
-                except TypeError:
-                    pass
-
-            res_dict[key] = value
-        return res_dict
+        return {key: _convert(getattr(self, key)) for key in self._props()}
 
     def hash(self):
         m = hashlib.md5()
@@ -40,16 +100,289 @@ class InformationObject(object):
     def __eq__(self, other):
         if self.__class__ != other.__class__:
             return False
-        for key in self._props():
-            if isinstance(getattr(self, key), list):
-                if set(getattr(self, key)) != set(getattr(other, key)):
+        for key in self._fields:
+            value = getattr(self, key)
+            if isinstance(value, list):
+                if set(value) != set(getattr(other, key)):
                     return False
                 continue
-            if getattr(self, key) != getattr(other, key):
+            if value != getattr(other, key):
                 return False
         return True
 
 
+class VersionedInformationObject(InformationObject):
+    """
+    heartbeatのたびにETagを求められる部下の情報用のInformationObject
+    内容が変わるたびにversionを進め，hashは次に変わるまでキャッシュする
+
+    _childrenに指定したリストのフィールドは要素ごとのhashを順序によらず
+    合成（128bitの和）してhashに含めるので，_add_child・_remove_childrenに
+    よる要素の追加・削除では他の要素をhashし直さない
+    要素の変更には気付けないので，要素は加えた時点で変更不可にする
+    （入れ子のRequirement・dict・listも含む）．変えるときは作り直して差し替える
+
+    cursorを発行した後の_add_child・_remove_childrenは履歴に記録し，
+    changes_sinceでそのcursor以降の子要素の差分を返せるようにする
+    子要素以外の変更やtouchがあると履歴は破棄され，差分は返せなくなる
+    """
+    _children = None
+    _frozen = False
+    _version = 0
+    _hash_cache = (-1, None)
+    _base_digest = None
+    _children_digest = None
+    # (epoch, 履歴の開始version, [(version, 追加した要素, 削除した要素)])
+    _journal = None
+
+    def __setattr__(self, key, value):
+        if self._frozen:
+            raise TypeError("{0} is immutable once added".format(
+                self.__class__.__name__))
+        super().__setattr__(key, value)
+        if key not in self._fields:
+            return
+        if key == self._children:
+            for item in value:
+                item._freeze()
+            if self._children_digest is not None:
+                self.__dict__['_children_digest'] = None
+        elif self._base_digest is not None:
+            self.__dict__['_base_digest'] = None
+        if self._journal is not None:
+            self.__dict__['_journal'] = None
+        self._bump()
+
+    @property
+    def version(self):
+        return self._version
+
+    def _bump(self):
+        self.__dict__['_version'] = self._version + 1
+
+    def _freeze(self):
+        """
+        子要素として加えられた後は変更できないようにする
+        """
+        if self._frozen:
+            return
+        for key in self._fields:
+            value = getattr(self, key)
+            if isinstance(value, Requirement):
+                self.__dict__[key] = Requirement.intern(value)
+            elif isinstance(value, (dict, list)):
+                self.__dict__[key] = freeze(value)
+        self.__dict__['_frozen'] = True
+
+    def touch(self):
+        self.__dict__['_base_digest'] = None
+        self.__dict__['_children_digest'] = None
+        self.__dict__['_journal'] = None
+        self._bump()
+
+    def _record(self, added, removed):
+        if self._journal is None:
+            return
+        epoch, start, entries = self._journal
+        entries.append((self._version, added, removed))
+        if len(entries) > _JOURNAL_SIZE:
+            start = entries.pop(0)[0]
+            self.__dict__['_journal'] = (epoch, start, entries)
+
+    def _add_child(self, item):
+        item._freeze()
+        with _children_lock:
+            getattr(self, self._children).append(item)
+            if self._children_digest is not None:
+                self.__dict__['_children_digest'] = \
+                    (self._children_digest + _child_digest(item)) % _DIGEST_MOD
+            self._bump()
+            self._record(item, None)
+
+    def _remove_children(self, predicate):
+        """
+        predicateを満たす子要素を取り除く
+        :return List: 取り除いた要素
+        """
+        with _children_lock:
+            children = getattr(self, self._children)
+            removed = [c for c in children if predicate(c)]
+            if len(removed) == 0:
+                return removed
+            self.__dict__[self._children] = \
+                [c for c in children if not predicate(c)]
+            if self._children_digest is not None:
+                acc = self._children_digest
+                for item in removed:
+                    acc -= _child_digest(item)
+                self.__dict__['_children_digest'] = acc % _DIGEST_MOD
+            self._bump()
+            for item in removed:
+                self._record(None, item)
+            return removed
+
+    def cursor(self):
+        """
+        現在の状態を指すcursorを発行する．changes_sinceに渡すと
+        この時点からの子要素の差分が得られる
+        :return str: cursor
+        """
+        with _children_lock:
+            if self._journal is None:
+                self.__dict__['_journal'] = \
+                    (uuid.uuid4().hex, self._version, [])
+            return "{0}.{1}".format(self._journal[0], self._version)
+
+    def changes_since(self, cursor):
+        """
+        cursorの発行時点から現在までの子要素の差分を求める
+        削除は途中で追加されたものも含めて全て返し，追加は現在も残っている
+        要素のみ返すので，削除・追加の順に適用すればcursor以降の変更を
+        重複して適用しても結果は変わらない
+        :param str cursor: cursorで発行したcursor
+        :return: (追加された要素のリスト, 削除された要素のIDのリスト)
+                 cursorが不正もしくは履歴が残っていなければNone
+        """
+        epoch, _, version = str(cursor).partition(".")
+        with _children_lock:
+            if self._journal is None or not version.isdigit():
+                return None
+            journal_epoch, start, entries = self._journal
+            version = int(version)
+            if epoch != journal_epoch or \
+                    not start <= version <= self._version:
+                return None
+            current = {id(c) for c in getattr(self, self._children)}
+            added = []
+            removed = []
+            for v, add, rem in entries:
+                if v <= version:
+                    continue
+                if add is not None and id(add) in current:
+                    added.append(add)
+                elif rem is not None and rem.get_id() not in removed:
+                    removed.append(rem.get_id())
+        return added, removed
+
+    def hash(self):
+        version, digest = self._hash_cache
+        if version == self._version:
+            return digest
+        version = self._version
+        if self._children is None:
+            digest = super().hash()
+        else:
+            digest = self._merkle_hash()
+        self.__dict__['_hash_cache'] = (version, digest)
+        return digest
+
+    def _merkle_hash(self):
+        base = self._base_digest
+        if base is None:
+            m = hashlib.md5()
+            m.update(str({key: _convert(getattr(self, key))
+                          for key in self._fields
+                          if key != self._children}).encode())
+            base = self.__dict__['_base_digest'] = m.hexdigest()
+        acc = self._children_digest
+        if acc is None:
+            acc = sum(_child_digest(c)
+                      for c in getattr(self, self._children)) % _DIGEST_MOD
+            self.__dict__['_children_digest'] = acc
+        m = hashlib.md5()
+        m.update("{0}:{1:032x}".format(base, acc).encode())
+        return m.hexdigest()
+
+
+class FrozenDict(dict):
+    """
+    変更できないdict．部下の間で共有するtriggerなどに使う
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("{0} is immutable".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+class FrozenList(list):
+    """
+    変更できないlist．部下の間で共有するvaluesなどに使う
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("{0} is immutable".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = clear = _immutable
+    sort = reverse = _immutable
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+
+def freeze(value):
+    """
+    dictとlistを再帰的にFrozenDictとFrozenListに置き換える
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def _intern_key(value):
+    # 10と10.0のように等しくても型の違うものは区別する
+    if isinstance(value, dict):
+        return dict, tuple(sorted((k, _intern_key(v))
+                                  for k, v in value.items()))
+    if isinstance(value, list):
+        return list, tuple(_intern_key(v) for v in value)
+    return type(value), value
+
+
+_interned_values = weakref.WeakValueDictionary()
+_intern_lock = threading.Lock()
+
+
+def intern_value(value):
+    """
+    dictかlistを変更不可にし，等しいものが既にあればそれを返す
+    どこからも参照されなくなったものは自動的に破棄される
+    """
+    frozen = freeze(value)
+    try:
+        key = _intern_key(value)
+        with _intern_lock:
+            return _interned_values.setdefault(key, frozen)
+    except TypeError:
+        # キーにできない値を含む場合は共有しない
+        return frozen
+
+
 definitions = dict()
 
 definitions['Requirement'] = {
@@ -62,12 +395,56 @@ definitions['Requirement'] = {
 
 
 class Requirement(InformationObject):
+    _frozen = False
+    _interned = weakref.WeakValueDictionary()
+
     def __init__(self,
                  values: List[str],
                  trigger: Dict):
         self.values = values
         self.trigger = trigger
 
+    def __setattr__(self, key, value):
+        if self._frozen:
+            raise TypeError("interned Requirement is immutable")
+        super().__setattr__(key, value)
+
+    def __copy__(self):
+        if self._frozen:
+            return self
+        return Requirement(self.values, self.trigger)
+
+    def __deepcopy__(self, memo):
+        if self._frozen:
+            return self
+        return Requirement(copy.deepcopy(self.values, memo),
+                           copy.deepcopy(self.trigger, memo))
+
+    @classmethod
+    def intern(cls, requirement):
+        """
+        等しいRequirementを変更不可な1つのインスタンスにまとめる
+        :param Requirement requirement: 対象のRequirement
+        :return Requirement: 共有される変更不可なRequirement
+        """
+        if requirement._frozen:
+            return requirement
+        try:
+            key = (_intern_key(requirement.values),
+                   _intern_key(requirement.trigger))
+        except TypeError:
+            key = None
+        values = intern_value(requirement.values)
+        trigger = intern_value(requirement.trigger)
+        with _intern_lock:
+            shared = cls._interned.get(key) if key is not None else None
+            if shared is None:
+                shared = cls(values, trigger)
+                shared.__dict__['_frozen'] = True
+                if key is not None:
+                    cls._interned[key] = shared
+        return shared
+
     @classmethod
     def make(cls, source: dict):
         try:
@@ -86,7 +463,11 @@ definitions['Campaign'] = {
         'trigger': {'type': 'object'},
         'place': {'type': 'string'},
         'purpose': {'type': 'string'},
-        'destination': {'type': 'string'}
+        'destination': {'type': 'string'},
+        'aggregation': {'description': "optional. e.g. {'window': 60, "
+                                       "'functions': ['min', 'max', 'mean'], "
+                                       "'sample': false}",
+                        'type': 'object'},
     }
 }
 
@@ -98,13 +479,15 @@ class Campaign(InformationObject):
                  trigger: Dict,
                  place: str,
                  purpose: str,
-                 destination: str):
+                 destination: str,
+                 aggregation: Dict = None):
         self.author = author
         self.requirement = requirement
         self.trigger = trigger
         self.place = place
         self.purpose = purpose
         self.destination = destination
+        self.aggregation = aggregation
 
     def get_id(self):
         source = self.purpose + self.place
@@ -122,6 +505,7 @@ class Campaign(InformationObject):
                 source['place'],
                 source['purpose'],
                 source['destination'],
+                source.get('aggregation'),
             )
         except KeyError:
             raise TypeError
@@ -139,7 +523,7 @@ definitions['Mission'] = {
 }
 
 
-class Mission(InformationObject):
+class Mission(VersionedInformationObject):
     def __init__(self,
                  author: str,
                  requirement: Requirement,
@@ -183,7 +567,7 @@ definitions['Order'] = {
 }
 
 
-class Order(InformationObject):
+class Order(VersionedInformationObject):
     def __init__(self,
                  author: str,
                  values: List[str],
@@ -246,6 +630,95 @@ class Report(InformationObject):
         except KeyError:
             raise TypeError
 
+definitions['ColumnarReport'] = {
+    'type': 'object',
+    'properties': {
+        'time': {'type': 'string'},
+        'place': {'type': 'string'},
+        'purpose': {'type': 'string'},
+        'times': {'type': 'array', 'items': {'type': 'string'}},
+        'places': {'type': 'array', 'items': {'type': 'string'}},
+        'types': {'type': 'array', 'items': {'type': 'string'}},
+        'units': {'type': 'object'},
+        'columns': {'type': 'array', 'items': {'type': 'array'}},
+    }
+}
+
+
+class ColumnarReport(InformationObject):
+    """
+    Reportの列指向版
+    i番目のworkの時刻・場所はtimes[i]・places[i]，
+    types[j]の値はcolumns[j][i]（無ければNone），その単位はunits[types[j]]
+    """
+    def __init__(self,
+                 time: str,
+                 place: str,
+                 purpose: str,
+                 times: List[str],
+                 places: List[str],
+                 types: List[str],
+                 units: Dict[str, str],
+                 columns: List[List]):
+        self.time = time
+        self.place = place
+        self.purpose = purpose
+        self.times = times
+        self.places = places
+        self.types = types
+        self.units = units
+        self.columns = columns
+
+    @classmethod
+    def make(cls, source: dict):
+        try:
+            return cls(
+                source['time'],
+                source['place'],
+                source['purpose'],
+                source['times'],
+                source['places'],
+                source['types'],
+                source['units'],
+                source['columns'],
+            )
+        except KeyError:
+            raise TypeError
+
+    @classmethod
+    def build(cls, time, place, purpose, works):
+        """
+        workの列からColumnarReportを組み立てる
+        :param works: (time, place, values)のリスト．valuesはWork.valuesの形式
+        """
+        times = []
+        places = []
+        units = {}
+        columns = {}
+        for i, (w_time, w_place, values) in enumerate(works):
+            times.append(w_time)
+            places.append(w_place)
+            for v in values:
+                col = columns.get(v["type"])
+                if col is None:
+                    col = columns[v["type"]] = [None] * i
+                    units[v["type"]] = v["unit"]
+                col.append(v["value"])
+            for col in columns.values():
+                if len(col) == i:
+                    col.append(None)
+        types = list(columns.keys())
+        return cls(time, place, purpose, times, places, types, units,
+                   [columns[t] for t in types])
+
+    def to_dict(self):
+        # 列の並びに意味があるのでリストはソートしない
+        return {key: getattr(self, key) for key in self._fields}
+
+    def __eq__(self, other):
+        return self.__class__ == other.__class__ and \
+            self.to_dict() == other.to_dict()
+
 definitions['Work'] = {
     'type': 'object',
     'properties': {
@@ -0,0 +1,268 @@
+import time
+from threading import Thread, Condition
+from typing import Callable, Dict, List
+from model import logger
+
+
+class IngestQueue(object):
+    """
+    reportから生成したドキュメントを格納先ごとにまとめて書き込むキュー
+    putはキューに積むだけで，バックグラウンドのworkerが
+    batch_size件たまるか，最も古いドキュメントがflush_interval秒待つと
+    格納先ごとにまとめて書き込む
+    キューにmax_depth件を超えるドキュメントは積めず，putは空きを待つ
+
+    attach_spoolでスプールを設定すると，書き込めなかったバッチはスプールに
+    退避し，retry_interval秒ごとに古い順に再送する．順序を保つため，
+    スプールに未再送のバッチがある間は新しいバッチもスプールに追記する
+    """
+
+    def __init__(self, writer_factory: Callable, workers=1, batch_size=500,
+                 flush_interval=1.0, max_depth=10000):
+        """
+        :param Callable writer_factory: 格納先のURIからpush_valuesを持つ
+                                        オブジェクトを生成する関数
+        :param int workers: 書き込みを行うworkerの数
+        :param int batch_size: 一度に書き込むドキュメントの最大数
+        :param float flush_interval: ドキュメントを待たせる最大の秒数
+        :param int max_depth: キューに積めるドキュメントの最大数
+        """
+        self.writer_factory = writer_factory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_depth = max_depth
+
+        self.cond = Condition()
+        self.pending = {}  # type: Dict[str, List[Dict]]
+        self.since = {}  # type: Dict[str, float]
+        self.writers = {}  # type: Dict[str, object]
+        self.depth = 0
+        self.in_flight = 0
+        self.threads = []  # type: List[Thread]
+        self.closed = False
+        self.flushing = False
+        self.spool = None
+        self.retry_interval = 5.0
+
+        self.batches = 0
+        self.documents = 0
+        self.errors = 0
+        self.rejected = 0
+        self.spooled = 0
+        self.last_batch_size = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+
+    def put(self, destination, documents, timeout=None):
+        """
+        ドキュメントをキューに積む．キューに空きが無ければ空くのを待つ
+        :param str destination: 格納先のURI
+        :param List[Dict] documents: 格納するドキュメント
+        :param float timeout: 空きを待つ最大の秒数．Noneであれば無期限
+        :return bool: 積めればTrue，待っても空かなければFalse
+        """
+        if len(documents) == 0:
+            return True
+        size = len(documents)
+        with self.cond:
+            if self.closed:
+                return False
+            if len(self.threads) == 0:
+                self._start()
+            # 上限より大きなreportは，キューが空であれば受け付ける
+            room = self.cond.wait_for(
+                lambda: self.depth == 0 or
+                self.depth + size <= self.max_depth,
+                timeout=timeout)
+            if not room or self.closed:
+                self.rejected += 1
+                return False
+            self.pending.setdefault(destination, []).extend(documents)
+            self.since.setdefault(destination, time.monotonic())
+            self.depth += size
+            self.cond.notify_all()
+        return True
+
+    def attach_spool(self, spool, retry_interval=5.0):
+        """
+        書き込めなかったバッチを退避するスプールを設定する
+        スプールに残っているバッチはすぐに再送を始める
+        :param Spool spool: 退避先のスプール
+        :param float retry_interval: 再送を試みる間隔 [sec]
+        """
+        with self.cond:
+            self.spool = spool
+            self.retry_interval = retry_interval
+            if len(self.threads) == 0:
+                self._start()
+            else:
+                self._start_replay()
+
+    def flush(self, timeout=None):
+        """
+        キューに積まれた全てのドキュメントが書き込まれるのを待つ
+        :param float timeout: 待つ最大の秒数．Noneであれば無期限
+        :return bool: 全て書き込まれればTrue
+        """
+        with self.cond:
+            self.flushing = True
+            self.cond.notify_all()
+            done = self.cond.wait_for(
+                lambda: self.depth == 0 and self.in_flight == 0,
+                timeout=timeout)
+            self.flushing = False
+            return done
+
+    def close(self, timeout=None):
+        """
+        残りのドキュメントを書き込んでworkerを止める
+        書き込み先がcloseを持っていれば呼ぶ
+        """
+        self.flush(timeout)
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+            writers = list(self.writers.values())
+            self.writers.clear()
+        for writer in writers:
+            if hasattr(writer, "close"):
+                writer.close()
+
+    def stats(self):
+        """
+        キューの状態と書き込みの統計
+        :return Dict: キューの深さ，バッチの大きさ，書き込みにかかった秒数など
+        """
+        with self.cond:
+            stats = {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "in_flight": self.in_flight,
+                "batches": self.batches,
+                "documents": self.documents,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "last_batch_size": self.last_batch_size,
+                "avg_batch_size": self.documents / self.batches
+                if self.batches > 0 else 0,
+                "last_latency": self.last_latency,
+                "avg_latency": self.total_latency / self.batches
+                if self.batches > 0 else 0,
+                "spooled": self.spooled,
+            }
+        if self.spool is not None:
+            stats["spool"] = self.spool.stats()
+        return stats
+
+    def _start(self):
+        for _ in range(self.workers):
+            th = Thread(target=self._work, daemon=True)
+            th.start()
+            self.threads.append(th)
+        self._start_replay()
+
+    def _start_replay(self):
+        if self.spool is None:
+            return
+        th = Thread(target=self._replay, daemon=True)
+        th.start()
+        self.threads.append(th)
+
+    def _ready(self, now):
+        """
+        書き込むべき格納先を返す．無ければ次に書き込むまでの秒数を返す
+        """
+        wait = None
+        for dest, docs in self.pending.items():
+            elapsed = now - self.since[dest]
+            if len(docs) >= self.batch_size or self.flushing or \
+                    elapsed >= self.flush_interval:
+                return dest, None
+            remaining = self.flush_interval - elapsed
+            wait = remaining if wait is None else min(wait, remaining)
+        return None, wait
+
+    def _take(self):
+        """
+        書き込むバッチをキューから取り出す．closeされればNoneを返す
+        :return: (格納先, ドキュメントのリスト)
+        """
+        with self.cond:
+            while True:
+                if self.closed:
+                    return None
+                dest, wait = self._ready(time.monotonic())
+                if dest is not None:
+                    break
+                self.cond.wait(timeout=wait)
+            docs = self.pending[dest]
+            batch = docs[:self.batch_size]
+            remaining = docs[self.batch_size:]
+            if len(remaining) == 0:
+                del self.pending[dest]
+                del self.since[dest]
+            else:
+                self.pending[dest] = remaining
+            self.depth -= len(batch)
+            self.in_flight += len(batch)
+            self.cond.notify_all()
+            return dest, batch
+
+    def _work(self):
+        while True:
+            taken = self._take()
+            if taken is None:
+                return
+            dest, batch = taken
+            start = time.monotonic()
+            success = spooled = False
+            try:
+                if self.spool is not None and len(self.spool) > 0:
+                    # 再送待ちのバッチより先に書き込まないようスプールに続ける
+                    self.spool.append(dest, batch)
+                    spooled = True
+                else:
+                    self._write(dest, batch)
+                success = True
+            except Exception as e:
+                logger.error("ingest to {0} failed: {1}".format(dest, e))
+                if self.spool is not None and not spooled:
+                    spooled = success = self._append_spool(dest, batch)
+            latency = time.monotonic() - start
+            with self.cond:
+                self.in_flight -= len(batch)
+                if spooled and success:
+                    self.spooled += 1
+                elif success:
+                    self.batches += 1
+                    self.documents += len(batch)
+                    self.last_batch_size = len(batch)
+                    self.last_latency = latency
+                    self.total_latency += latency
+                else:
+                    self.errors += 1
+                self.cond.notify_all()
+
+    def _append_spool(self, dest, batch):
+        try:
+            self.spool.append(dest, batch)
+            return True
+        except Exception as e:
+            logger.error("spool for {0} failed: {1}".format(dest, e))
+            return False
+
+    def _write(self, dest, batch):
+        writer = self.writers.get(dest)
+        if writer is None:
+            writer = self.writers.setdefault(dest, self.writer_factory(dest))
+        writer.push_values(batch)
+
+    def _replay(self):
+        while True:
+            with self.cond:
+                if self.cond.wait_for(lambda: self.closed,
+                                      timeout=self.retry_interval):
+                    return
+            if len(self.spool) > 0:
+                self.spool.replay(self._write)
@@ -1,11 +1,19 @@
 import datetime
-from threading import Event, Thread
-from typing import List, Dict
+from collections import deque
+from threading import Event, Lock, RLock, Thread
+from typing import List, Dict, Set
 
+import model.edge_aggregation as edge_aggregation
 import utils.rest as rest
-from model import SoldierInfo, Mission, Order, Report, Work
+import utils.wire as wire
+from model import SoldierInfo, Requirement, Mission, Order, Report, \
+    ColumnarReport, Work
 from model import logger
-from model.info_obj import InformationObject
+from model.info_obj import VersionedInformationObject, intern_value
+from model.outbox import Outbox
+from utils.liveness import LivenessTracker
+from utils.place_index import PlaceIndex, match_place
+from utils.scheduler import Scheduler
 
 definition = {
     'type': 'object',
@@ -24,7 +32,9 @@ definition = {
 }
 
 
-class LeaderInfo(InformationObject):
+class LeaderInfo(VersionedInformationObject):
+    _children = 'missions'
+
     def __init__(self,
                  id: str,
                  name: str,
@@ -53,6 +63,16 @@ class LeaderInfo(InformationObject):
         except KeyError:
             raise TypeError
 
+    def add_mission(self, mission: Mission):
+        self._add_child(mission)
+
+    def remove_missions(self, purpose: str):
+        """
+        指定されたpurposeを持つmissionを全て取り除く
+        :param str purpose: 取り除くmissionのpurpose(=CampaignのID)
+        """
+        self._remove_children(lambda m: m.purpose == purpose)
+
 
 class Leader(object):
     def __init__(self, leader_id, name, endpoint):
@@ -61,16 +81,38 @@ class Leader(object):
         self.place = ""
         self.endpoint = endpoint
         self.subordinates = {}  # type:Dict[str, SoldierInfo]
-        self.sub_heart_waits = {}  # type:Dict[str, Event]
+        self.place_index = PlaceIndex()
+        # 120秒heartbeatが無ければK.I.A.
+        self.liveness = LivenessTracker(120, self._expire_subordinates)
         self.missions = {}  # type:Dict[str, Mission]
-        self.work_cache = []  # type:List[(str, Work)]
+        # MissionのID -> そのOrderを割り当てた部下のID
+        self.mission_subs = {}  # type:Dict[str, Set[str]]
+        # 部下・Missionと上の索引の書き換えはこのロックの下で行う
+        # 部下の期限切れはLivenessTrackerのスレッドから届く
+        self.troop_lock = RLock()
+        # MissionのIDごとに受理したworkを溜めるバッファ
+        # report送信時には対象のMissionのバッファだけを空のものと差し替える
+        self.work_lock = Lock()
+        self.work_buffers = {}  # type:Dict[str, deque]
+        # passthroughモードで受理したwork (place, mimetype, body)
+        self.raw_work_buffers = {}  # type:Dict[str, deque]
+        # "rows", "columnar", "passthrough" or "aggregate"
+        self.report_format = "rows"
+        # aggregateモードで求めるパーセンタイル
+        self.percentiles = edge_aggregation.DEFAULT_PERCENTILES
         self.superior_ep = ""
         self.heartbeat_thread = HeartBeat(self, 0)
-        self.working_threads = []  # type: List[WorkingThread]
+        # 全てのMissionのtimerを1つのスレッドで扱う
+        # 同時にtimerを迎えたMissionのreportは1回のPOSTにまとめる
+        self.scheduler = Scheduler(self._fire_missions, slack=0.05)
+        # 送れなかったreportの送信待ち．既定ではメモリに溜める
+        self.outbox = Outbox()
 
     def shutdown(self):
+        self.liveness.stop()
         self.heartbeat_thread.lock.set()
-        [w.lock.set() for w in self.working_threads]
+        self.scheduler.stop()
+        self.outbox.stop()
 
         if self.superior_ep == "":
             return True
@@ -131,44 +173,80 @@ class Leader(object):
         self.heartbeat_thread.start()
 
     def accept_mission(self, mission: Mission) -> Mission:
-        # Missionの更新であれば（=IDが同じであれば）既存のものを消す
-        if mission.get_id() in self.missions:
-            self.remove_mission(mission.get_id())
-
-        # 部下のOrderを生成・割り当てる
-        target_subs = []
-        if mission.place == "All":
-            target_subs = list(self.subordinates.values())
-        for sol in target_subs:
-            m_req = mission.requirement
-            values = list(set(m_req.values).intersection(sol.weapons))
+        with self.troop_lock:
+            # Missionの更新であれば（=IDが同じであれば）既存のものを消す
+            # 受理済みのworkは新しいスレッドが送信する
+            if mission.get_id() in self.missions:
+                self._retire_mission(mission.get_id())
+
+            # 部下のOrderを生成・割り当てる
+            # Soldierは配下を持たないのでplaceの合う部下を選ぶだけでよい
+            self._assign_mission(mission,
+                                 self.place_index.match(mission.place))
+
+            self.missions[mission.get_id()] = mission
+
+            # reportの送信をスケジューラに登録する
+            interval = mission.trigger.get('timer')
+            if interval is not None:
+                try:
+                    self.scheduler.add(mission.get_id(), interval)
+                except ValueError as e:
+                    logger.error("invalid mission timer: {0}".format(e))
+            return mission
+
+    def _assign_mission(self, mission, sub_ids):
+        """
+        指定された部下にMissionのOrderを割り当て，割り当て先を記録する
+        troop_lockを取った状態で呼ぶ
+        :param Mission mission: 割り当てるMission
+        :param Set[str] sub_ids: 割り当てる部下のID
+        """
+        # requirementとtrigger，同じweaponを持つ部下のvaluesは共有する
+        m_req = Requirement.intern(mission.requirement)
+        assigned = self.mission_subs.setdefault(mission.get_id(), set())
+        for sid in sub_ids:
+            sol = self.subordinates[sid]
+            values = intern_value(
+                sorted(set(m_req.values).intersection(sol.weapons)))
             order = Order(author=sol.id,
                           values=values,
                           trigger=m_req.trigger,
                           purpose=mission.get_id())
-            sol.orders.append(order)
-
-        # 自身のデータ送信スレッドを生成する
-        th = WorkingThread(self, mission)
-        self.working_threads.append(th)
-        th.start()
-
-        self.missions[mission.get_id()] = mission
-        return mission
+            sol.add_order(order)
+            assigned.add(sid)
 
     def remove_mission(self, mid):
+        with self.troop_lock:
+            mission = self.missions.get(mid)
+            self._retire_mission(mid)
+        # 受理済みのworkは最後のreportとして送る（送れなければoutboxに溜まる）
+        if mission is not None and self._has_works(mid):
+            self._submit_reports([mission])
+        # その後に届いたworkは送り先のMissionが無いので捨てる
+        self.take_works(mid)
+        self.take_works(mid, raw=True)
+
+    def _retire_mission(self, mid):
+        """
+        MissionのOrderとreportの送信を取り除く．バッファは残す
+        :param str mid: MissionのID
+        """
         del self.missions[mid]
 
-        for sub in self.subordinates.values():
-            [sub.orders.remove(o) for o in sub.orders if o.purpose == mid]
+        # 対象idのOrderを割り当てた部下のみを辿って消す
+        for sid in self.mission_subs.pop(mid, ()):
+            sub = self.subordinates.get(sid)
+            if sub is not None:
+                sub.remove_orders(mid)
 
-        for th in self.working_threads:
-            if mid == th.mission.get_id():
-                th.lock.set()
-                self.working_threads.remove(th)
+        self.scheduler.remove(mid)
 
     def get_sub_info(self, sub_id):
-        return self.subordinates[sub_id]
+        """
+        :return SoldierInfo: 部下の情報．期限切れなどで居なければNone
+        """
+        return self.subordinates.get(sub_id)
 
     def accept_subordinate(self, sub_info):
         """
@@ -178,55 +256,193 @@ class Leader(object):
         """
         logger.debug('In accept_subordinate:')
         logger.debug('> sub_info:{0}'.format(sub_info))
-        if self.check_subordinate(sub_info.id):
-            # return False
-            pass
-            # （少なくともSensorTagの）Soldierはしょっちゅう再接続するので
-            # 重複接続はスルー
-
-        self.subordinates[sub_info.id] = sub_info
-
-        # heartbeat_watcherがすでに存在すれば使い回す
-        if sub_info.id not in self.sub_heart_waits:
-            self.sub_heart_waits[sub_info.id] = Event()
-            Thread(target=self._heart_watch,
-                   args=(sub_info.id, ), daemon=True).start()
-        self.sub_heart_waits[sub_info.id].set()
-
-        old_missions = self.missions.values()
-        [self.accept_mission(c) for c in old_missions]
-        return True
-
-    def _heart_watch(self, sid):
-        while self.sub_heart_waits[sid].wait(timeout=120):
-            # timeoutまでにevent.setされたら待ち続行
-            # timeoutしたらK.I.A.
-            self.sub_heart_waits[sid].clear()
+        with self.troop_lock:
+            if self.check_subordinate(sub_info.id):
+                # return False
+                pass
+                # （少なくともSensorTagの）Soldierはしょっちゅう再接続するので
+                # 重複接続はスルー
+
+            self.subordinates[sub_info.id] = sub_info
+            self.place_index.add(sub_info.id, sub_info.place)
+            self.liveness.touch(sub_info.id)
+
+            # 既存のMissionのうちplaceの合うものを新しい部下にだけ割り当てる
+            # 部下が持参したOrderは割り当て直すので取り除く
+            for mid, mission in list(self.missions.items()):
+                sub_info.remove_orders(mid)
+                self.mission_subs.get(mid, set()).discard(sub_info.id)
+                if match_place(sub_info.place, mission.place):
+                    self._assign_mission(mission, [sub_info.id])
+            return True
 
-        if self.remove_subordinate(sid):
-            # removeが失敗すれば（そもそも削除済であれば）実行しない
-            logger.error("へんじがない ただのしかばねのようだ :{0}".format(sid))
+    def _expire_subordinates(self, sids):
+        for sid in sids:
+            if self.remove_subordinate(sid):
+                # removeが失敗すれば（そもそも削除済であれば）実行しない
+                logger.error("へんじがない ただのしかばねのようだ :{0}".
+                             format(sid))
 
     def receive_heartbeat(self, sid):
         if not self.check_subordinate(sid):
             return False
-        self.sub_heart_waits[sid].set()
+        self.liveness.touch(sid)
 
     def remove_subordinate(self, sub_id):
-        if not self.check_subordinate(sub_id):
+        with self.troop_lock:
+            if not self.check_subordinate(sub_id):
+                return False
+            sub_info = self.subordinates.pop(sub_id)
+            for o in sub_info.orders:
+                self.mission_subs.get(o.purpose, set()).discard(sub_id)
+            self.place_index.remove(sub_id)
+            self.liveness.forget(sub_id)
+            return True
+
+    def accept_work(self, sub_id, work):
+        if self.report_format == "passthrough":
+            return self.accept_raw_work(sub_id, work.purpose, wire.JSON,
+                                        wire.encode(work.to_dict()))
+        # 確認と読み出しの間に期限切れで除かれないよう，一度だけ引く
+        sub = self.subordinates.get(sub_id)
+        if sub is None:
             return False
-        del self.subordinates[sub_id]
-        # FIXME: イベントをセットするだけだとスレッドが残る．timeout後にKIA確定
-        self.sub_heart_waits[sub_id].set()
-        del self.sub_heart_waits[sub_id]
+        self._buffer_work(self.work_buffers, work.purpose, (sub.place, work))
         return True
 
-    def accept_work(self, sub_id, work):
-        if not self.check_subordinate(sub_id):
+    def accept_raw_work(self, sub_id, purpose, mimetype, body):
+        """
+        エンコードされたままのworkを受理する（passthroughモード用）
+        bodyはデコードせず，reportを組み立てる際にそのまま埋め込む
+        :param str sub_id: workを送ってきた部下のID
+        :param str purpose: workのpurpose(=MissionのID)
+        :param str mimetype: bodyのエンコード形式
+        :param bytes body: 部下から送られたworkそのもの
+        :return bool: 受理できればTrue
+        """
+        sub = self.subordinates.get(sub_id)
+        if sub is None:
+            return False
+        if not wire.supports(mimetype) or not wire.is_object(body, mimetype):
             return False
-        self.work_cache.append((sub_id, work))
+        self._buffer_work(self.raw_work_buffers, purpose,
+                          (sub.place, mimetype, body))
         return True
 
+    def _buffer_work(self, buffers, purpose, item):
+        with self.work_lock:
+            buffer = buffers.get(purpose)
+            if buffer is None:
+                buffer = buffers[purpose] = deque()
+            buffer.append(item)
+
+    def take_works(self, mid, raw=False):
+        """
+        Missionのバッファを取り出し，溜まっていたworkを返す
+        取り出した後に受理したworkは新しいバッファに溜まる
+        :param str mid: MissionのID
+        :param bool raw: passthroughモードで受理したworkを取り出す
+        :return: (place, Work)，rawであれば(place, mimetype, body)の列
+        """
+        buffers = self.raw_work_buffers if raw else self.work_buffers
+        with self.work_lock:
+            return buffers.pop(mid, ())
+
+    def _has_works(self, mid):
+        """
+        :return bool: report_formatに応じたバッファにworkが溜まっていればTrue
+        """
+        raw = self.report_format == "passthrough"
+        buffers = self.raw_work_buffers if raw else self.work_buffers
+        with self.work_lock:
+            return len(buffers.get(mid, ())) > 0
+
+    def _fire_missions(self, mids):
+        """
+        同時にtimerを迎えたMissionのreportを組み立てて送信する
+        :param List[str] mids: MissionのID
+        """
+        missions = [self.missions.get(mid) for mid in mids]
+        # 発火の直後に削除されたものは除く
+        self._submit_reports([m for m in missions if m is not None])
+
+    def _submit_reports(self, missions):
+        """
+        Missionのreportを組み立てて送信する
+        複数のreportは{"reports": [...]}として1回のPOSTにまとめる
+        :param List[Mission] missions: 対象のMission
+        """
+        if len(missions) == 0:
+            return
+        time = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        url = "{0}subordinates/{1}/report".format(self.superior_ep, self.id)
+        if self.report_format == "passthrough":
+            self.submit_raw_reports(missions, time, url)
+            return
+
+        reports = [self.build_report(mission, time).to_dict()
+                   for mission in missions]
+        # 送れなければoutboxに溜めて，上官の復帰後に順に再送する
+        self.outbox.send(url, reports)
+
+    def build_report(self, mission, time):
+        """
+        Missionのバッファに溜まったworkからreportを組み立てる
+        :param Mission mission: 対象のMission
+        :param str time: reportの時刻
+        :return: report_formatに応じたReportかColumnarReport
+        """
+        works = [(w.time, place, w.values)
+                 for place, w in self.take_works(mission.get_id())]
+        if self.report_format == "columnar":
+            return ColumnarReport.build(time,
+                                        self.place,
+                                        mission.purpose,
+                                        works)
+        if self.report_format == "aggregate":
+            # 生の値の代わりにplace・種類ごとの統計値を送る
+            return Report(time,
+                          self.place,
+                          mission.purpose,
+                          edge_aggregation.summarize(works, self.percentiles))
+        return Report(time,
+                      self.place,
+                      mission.purpose,
+                      [{"time": t, "place": p, "values": v}
+                       for t, p, v in works])
+
+    def submit_raw_reports(self, missions, time, url):
+        """
+        passthroughモードのreport送信
+        受理したworkのバイト列をそのままつなぎ合わせてreportのボディにする
+        workのエンコード形式が混在していれば形式ごとにreportを分けて送る
+        同じ形式のreportが複数あれば1回のPOSTにまとめる
+        """
+        bodies = {}
+        for mission in missions:
+            groups = {}
+            for place, mimetype, body in self.take_works(mission.get_id(),
+                                                         raw=True):
+                groups.setdefault(mimetype, []).append(("place", place, body))
+            if len(groups) == 0:
+                groups[wire.JSON] = []
+
+            head = {"time": time,
+                    "place": self.place,
+                    "purpose": mission.purpose}
+            for mimetype, rows in groups.items():
+                bodies.setdefault(mimetype, []).append(
+                    wire.splice_rows(head, "values", rows, mimetype))
+
+        for mimetype, reports in bodies.items():
+            if len(reports) == 1:
+                body = reports[0]
+            else:
+                body = wire.splice_rows({}, "reports",
+                                        [(None, None, r) for r in reports],
+                                        mimetype)
+            self.outbox.send(url, encoded=(mimetype, body))
+
     def submit_error(self, msg):
         time = datetime.datetime.now(datetime.timezone.utc).isoformat()
         report = Report(time=time,
@@ -238,47 +454,6 @@ class Leader(object):
         rest.post(url, json=report.to_dict())
 
 
-class WorkingThread(Thread):
-    def __init__(self, leader: Leader, mission: Mission):
-        super(WorkingThread, self).__init__(daemon=True)
-        self.mission = mission
-        self.leader = leader
-        self.lock = Event()
-
-    def run(self):
-        if 'timer' in self.mission.trigger.keys():
-            interval = self.mission.trigger['timer']
-            while not self.lock.wait(timeout=interval):
-                m_id = self.mission.get_id()
-                time = datetime.datetime.now(datetime.timezone.utc).isoformat()
-                works = []
-                for sid, w in self.leader.work_cache:
-                    if w.purpose != m_id:
-                        continue
-                    works.append({"time": w.time,
-                                  "place": self.leader.subordinates[sid].place,
-                                  "values": w.values})
-                report = Report(time,
-                                self.leader.place,
-                                self.mission.purpose,
-                                works)
-
-                url = "{0}subordinates/{1}/report".\
-                    format(self.leader.superior_ep, self.leader.id)
-                res, err = rest.post(url, json=report.to_dict())
-                if err is not None:
-                    # TODO: エラー処理ちゃんとやる
-                    # 本当に接続先がダウンしてる場合、ただのDoSになってしまう
-                    logger.error('In WorkingThread, failed to post report')
-                    logger.error('> err: {0}', err)
-
-                self.leader.work_cache = \
-                    [(sid, w) for sid, w in self.leader.work_cache
-                     if w.purpose != m_id]
-        else:
-            pass
-
-
 class HeartBeat(Thread):
     def __init__(self, leader: Leader, interval: int):
         super(HeartBeat, self).__init__(daemon=True)
@@ -286,11 +461,13 @@ class HeartBeat(Thread):
         self.leader = leader
         self.interval = interval
         self.etag = None
+        self.cursor = ""  # 空のcursorで最初のcursorを要求する
 
     def run(self):
         while not self.lock.wait(timeout=self.interval):
             url = self.leader.superior_ep + "subordinates/" + self.leader.id
-            res, err = rest.get(url, etag=self.etag)
+            res, err = rest.get(url, params={"since": self.cursor},
+                                etag=self.etag)
             if err is not None:
                 # TODO: エラー処理ちゃんとやる
                 logger.error('In HeartBeat, failed to post report')
@@ -299,16 +476,38 @@ class HeartBeat(Thread):
             if res.status_code == 304:
                 continue
             self.etag = res.headers['ETag']
-            info = LeaderInfo.make(res.json()['info'])
+            body = res.json()
+            self.cursor = body.get('cursor', "")
+            if 'delta' in body:
+                self.apply_delta(body['delta'])
+                continue
+            info = LeaderInfo.make(body['info'])
 
             logger.info([str(m) for m in info.missions])
 
             # 以前に受理されているmissionにはあるが新規のmissionリストには無い
             # （消された）missionを消す
             mid_list = [m.get_id() for m in info.missions]
-            for old_mid in self.leader.missions.keys():
+            for old_mid in list(self.leader.missions.keys()):
                 if old_mid not in mid_list:
                     self.leader.remove_mission(old_mid)
 
             for m in info.missions:
                 self.leader.accept_mission(m)
+
+    def apply_delta(self, delta):
+        """
+        前回のheartbeatからのmissionの差分を適用する
+        :param Dict delta: 追加されたmissionと削除されたmissionのID
+        """
+        logger.info('delta: +{0} -{1}'.format(len(delta['added']),
+                                              len(delta['removed'])))
+        added = [Mission.make(m) for m in delta['added']]
+        # 差し替えられたMissionは消さずにaccept_missionに任せる
+        # （受理済みのworkは新しいMissionのreportで送る）
+        replaced = {m.get_id() for m in added}
+        for mid in delta['removed']:
+            if mid in self.leader.missions and mid not in replaced:
+                self.leader.remove_mission(mid)
+        for m in added:
+            self.leader.accept_mission(m)
@@ -0,0 +1,321 @@
+"""
+上官に送れなかったreportの送信待ち箱
+送信に失敗したreportを古い順に溜め，指数バックオフ（ジッタ付き）で
+再送する．送信待ちがある間に生成されたreportは直接送らずに後ろに積むので，
+上官が落ちている間もPOSTを重ねず，復帰後は元の順序で届く
+
+Spoolを渡せばreportはディスクに溜め（上限はSpoolのmax_bytes），
+渡さなければメモリにmax_reports件まで溜める．上限を超えれば古いものから捨てる
+"""
+import random
+import time
+from collections import deque
+from threading import Condition, Thread
+from typing import Callable
+import utils.rest as rest
+import utils.wire as wire
+from model import logger
+
+# 5xxの他に再送するステータスコード
+# それ以外の4xxは送り直しても受理されないので再送しない
+_RETRY_CODES = (408, 429)
+
+
+def retryable(res, err):
+    """
+    :return bool: 送信の失敗が一時的なもので，再送すべきであればTrue
+    """
+    if err is None:
+        return False
+    if res is None:  # 接続できなかった
+        return True
+    return res.status_code in _RETRY_CODES or res.status_code >= 500
+
+
+def _accepted_count(res):
+    """
+    複数のreportのうち受理された数（503と共に返される）
+    """
+    try:
+        accepted = rest.decode_body(res).get("accepted")
+    except (ValueError, AttributeError):
+        return 0
+    if isinstance(accepted, bool) or not isinstance(accepted, int):
+        return 0
+    return accepted
+
+
+def _retry_after(res):
+    try:
+        return float(res.headers.get('Retry-After', 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+def report_body(reports):
+    """
+    :param List[Dict] reports: 送信するreport
+    :return Dict: reportが複数であれば{"reports": [...]}にまとめたボディ
+    """
+    return reports[0] if len(reports) == 1 else {"reports": reports}
+
+
+def split_body(body):
+    """
+    report_bodyの逆
+    :return List[Dict]: ボディに含まれるreport
+    """
+    if isinstance(body, dict) and isinstance(body.get("reports"), list):
+        return body["reports"]
+    return [body]
+
+
+class _Retry(Exception):
+    pass
+
+
+class Outbox(object):
+    def __init__(self, post: Callable = None, spool=None, max_reports=1000,
+                 base_delay=1.0, max_delay=300.0, rand=random.random):
+        """
+        :param Callable post: rest.postと同じ引数を取る送信関数．
+            Noneであれば送信のたびにrest.postを使う
+        :param Spool spool: reportを溜めるスプール．Noneであればメモリに溜める
+        :param int max_reports: メモリに溜めるreportの最大数
+        :param float base_delay: 最初の再送までの秒数
+        :param float max_delay: 再送の間隔の上限 [sec]
+        :param Callable rand: 0以上1未満の乱数を返す関数（ジッタ用）
+        """
+        self.post = post
+        self.spool = spool
+        self.max_reports = max_reports
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rand = rand
+
+        self.cond = Condition()
+        self.queue = deque()  # (url, reports)
+        self.queued_reports = 0
+        self.failures = 0
+        self.next_retry = 0.0
+        # 先頭のレコードのうち受理済みのreportの数
+        # スプールのレコードは書き換えられないので再送時に読み飛ばす
+        self.partial = 0
+        self.thread = None
+        self.stopped = False
+
+        self.deferred = 0
+        self.resent = 0
+        self.dropped = 0
+        self.rejected = 0
+
+        if spool is not None and len(spool) > 0:
+            # 前回送れなかった分をすぐに送り始める
+            with self.cond:
+                self._start()
+
+    def __len__(self):
+        """
+        :return int: 送信待ちのレコードの数
+        """
+        if self.spool is not None:
+            return len(self.spool)
+        with self.cond:
+            return len(self.queue)
+
+    def send(self, url, reports=None, encoded=None):
+        """
+        reportを送信する．送信待ちがあれば送らずに後ろに積む
+        :param str url: 送信先
+        :param List[Dict] reports: 送信するreport
+        :param encoded: reportsの代わりに送るエンコード済みのボディ
+            (mimetype, body)．送れなかった場合にだけデコードして積む
+        :return bool: 送信できればTrue，送信待ちに積んだか捨てればFalse
+        """
+        pending = len(self) > 0
+        res = err = None
+        if not pending:
+            if encoded is None:
+                res, err = self._post(url, reports)
+            else:
+                res, err = self._post_function()(url, encoded=encoded)
+            if err is None:
+                return True
+        if reports is None:
+            reports = split_body(wire.decode(encoded[1], encoded[0]))
+        if pending:
+            self.put(url, reports)
+        else:
+            self._failed(url, reports, res, err)
+        return False
+
+    def put(self, url, reports):
+        """
+        reportを送信待ちの末尾に積む
+        :param str url: 送信先
+        :param List[Dict] reports: 送信するreport
+        """
+        if len(reports) == 0:
+            return
+        with self.cond:
+            if self.stopped:
+                return
+            self.deferred += len(reports)
+        if self.spool is not None:
+            try:
+                self.spool.append(url, reports)
+            except Exception as e:
+                logger.error("outbox: failed to spool reports: {0}".format(e))
+                with self.cond:
+                    self.dropped += len(reports)
+                return
+        with self.cond:
+            if self.spool is None:
+                self.queue.append((url, reports))
+                self.queued_reports += len(reports)
+                self._enforce_budget()
+            self._start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            stats = {
+                "pending": len(self.queue),
+                "failures": self.failures,
+                "next_retry": max(self.next_retry - time.monotonic(), 0)
+                if self.failures > 0 else 0,
+                "deferred": self.deferred,
+                "resent": self.resent,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+            }
+        if self.spool is not None:
+            stats["pending"] = len(self.spool)
+            stats["spool"] = self.spool.stats()
+        return stats
+
+    def _post_function(self):
+        return self.post if self.post is not None else rest.post
+
+    def _post(self, url, reports):
+        return self._post_function()(url, json=report_body(reports),
+                                     binary=True)
+
+    def _failed(self, url, reports, res, err):
+        """
+        直接の送信に失敗したreportを，受理された分を除いて送信待ちに積む
+        """
+        if not retryable(res, err):
+            self._reject(url, reports, err)
+            return
+        remaining = reports[_accepted_count(res):]
+        with self.cond:
+            self._backoff(res)
+        logger.error("outbox: failed to post {0} reports, retry after "
+                     "{1:.1f} sec: {2}".format(len(remaining),
+                                               self._delay(), err))
+        self.put(url, remaining)
+
+    def _reject(self, url, reports, err):
+        with self.cond:
+            self.rejected += len(reports)
+        logger.error("outbox: {0} rejected {1} reports: {2}".format(
+            url, len(reports), err))
+
+    def _delay(self):
+        with self.cond:
+            return max(self.next_retry - time.monotonic(), 0)
+
+    def _backoff(self, res):
+        """
+        次の再送時刻を決める．失敗が続くほど間隔を倍にする
+        同時に復帰したleaderが一斉に再送しないよう，間隔の半分までの幅で
+        ずらす．Retry-Afterが指定されていればそれより早くはしない
+        """
+        self.failures += 1
+        delay = min(self.base_delay * 2 ** (self.failures - 1),
+                    self.max_delay)
+        delay = delay / 2 + delay / 2 * self.rand()
+        if res is not None:
+            delay = max(delay, _retry_after(res))
+        self.next_retry = time.monotonic() + delay
+
+    def _enforce_budget(self):
+        while self.queued_reports > self.max_reports and len(self.queue) > 1:
+            url, reports = self.queue.popleft()
+            self.queued_reports -= len(reports)
+            self.dropped += len(reports)
+            self.partial = 0
+            logger.error("outbox: dropped {0} reports for {1}".format(
+                len(reports), url))
+
+    def _start(self):
+        if self.thread is None:
+            self.thread = Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.cond.notify_all()
+
+    def _resend(self, url, reports):
+        """
+        送信待ちの先頭のレコードを送る
+        :raise _Retry: 再送すべき失敗．受理された分はpartialに記録する
+        """
+        res, err = self._post(url, reports[self.partial:])
+        if err is None:
+            with self.cond:
+                self.resent += len(reports) - self.partial
+                self.failures = 0
+                self.partial = 0
+            return
+        if not retryable(res, err):
+            self._reject(url, reports[self.partial:], err)
+            with self.cond:
+                self.partial = 0
+            return
+        with self.cond:
+            self.partial += _accepted_count(res)
+            self._backoff(res)
+        raise _Retry(err)
+
+    def _drain_memory(self):
+        while True:
+            with self.cond:
+                if len(self.queue) == 0 or self.stopped:
+                    return True
+                url, reports = self.queue[0]
+            try:
+                self._resend(url, reports)
+            except _Retry:
+                with self.cond:
+                    if len(self.queue) == 0 or \
+                            self.queue[0][1] is not reports:
+                        self.partial = 0
+                return False
+            with self.cond:
+                # 送信中に予算超過で捨てられていなければ取り除く
+                if len(self.queue) > 0 and self.queue[0][1] is reports:
+                    self.queue.popleft()
+                    self.queued_reports -= len(reports)
+
+    def _drain(self):
+        if self.spool is None:
+            return self._drain_memory()
+        # _resendが_Retryを送出すればreplayはそのレコードで止まる
+        return self.spool.replay(self._resend)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.stopped:
+                        return
+                    now = time.monotonic()
+                    if len(self) > 0 and self.next_retry <= now:
+                        break
+                    self.cond.wait(None if len(self) == 0
+                                   else self.next_retry - now)
+            self._drain()
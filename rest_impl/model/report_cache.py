@@ -0,0 +1,114 @@
+import datetime
+import time
+from collections import deque
+from threading import Lock
+from typing import Dict, List
+import utils.isotime as isotime
+
+
+def parse_time(value):
+    """
+    ISO8601の文字列をdatetimeに変換する．タイムゾーンが無ければUTCとみなす
+    :param str value: 時刻の文字列
+    :return datetime: 変換結果．変換できなければNone
+    """
+    try:
+        parsed = isotime.parse(value)
+    except (ValueError, TypeError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+class ReportCache(object):
+    """
+    受理したreportを直近の一定数・一定時間だけ保持するリングバッファ
+    purposeとplaceごとの索引を持ち，queryでそれらと時刻範囲で絞り込む
+    """
+
+    def __init__(self, max_count=1000, max_age=3600):
+        """
+        :param int max_count: 保持するreportの最大数
+        :param float max_age: reportを保持する秒数．Noneであれば無期限
+        """
+        self.max_count = max_count
+        self.max_age = max_age
+        self.lock = Lock()
+        # (受理した時刻, reportの時刻, report)
+        self.entries = deque()
+        self.by_purpose = {}  # type: Dict[str, deque]
+        self.by_place = {}  # type: Dict[str, deque]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, report):
+        """
+        reportを追加し，上限を超えた古いreportを捨てる
+        :param report: ReportかColumnarReport
+        """
+        entry = (time.monotonic(), parse_time(report.time), report)
+        with self.lock:
+            self.entries.append(entry)
+            self.by_purpose.setdefault(report.purpose, deque()).append(entry)
+            self.by_place.setdefault(report.place, deque()).append(entry)
+            while len(self.entries) > self.max_count:
+                self._pop_oldest()
+            self._expire(entry[0])
+
+    def query(self, purpose=None, place=None, start=None, end=None,
+              limit=None) -> List:
+        """
+        条件に合うreportを新しい順に返す
+        :param str purpose: reportのpurpose
+        :param str place: reportのplace
+        :param datetime start: reportの時刻の下限（この時刻を含む）
+        :param datetime end: reportの時刻の上限（この時刻を含む）
+        :param int limit: 返すreportの最大数
+        :return List: reportのリスト
+        """
+        with self.lock:
+            self._expire(time.monotonic())
+            # 索引のうち小さい方を走査する
+            candidates = [self.entries]
+            if purpose is not None:
+                candidates.append(self.by_purpose.get(purpose, ()))
+            if place is not None:
+                candidates.append(self.by_place.get(place, ()))
+            entries = list(min(candidates, key=len))
+
+        result = []
+        for _, r_time, report in reversed(entries):
+            if purpose is not None and report.purpose != purpose:
+                continue
+            if place is not None and report.place != place:
+                continue
+            if start is not None or end is not None:
+                if r_time is None:
+                    continue
+                if start is not None and r_time < start:
+                    continue
+                if end is not None and r_time > end:
+                    continue
+            result.append(report)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def _pop_oldest(self):
+        report = self.entries.popleft()[2]
+        # 追加順に捨てるので，索引でも先頭にある
+        for index, key in [(self.by_purpose, report.purpose),
+                           (self.by_place, report.place)]:
+            bucket = index[key]
+            bucket.popleft()
+            if len(bucket) == 0:
+                del index[key]
+
+    def _expire(self, now):
+        if self.max_age is None:
+            return
+        while len(self.entries) > 0 and \
+                now - self.entries[0][0] > self.max_age:
+            self._pop_oldest()
@@ -5,7 +5,7 @@ import utils.rest as rest
 from model import Order, Work, logger
 from typing import List, Dict
 from threading import Event, Thread
-from model.info_obj import InformationObject
+from model.info_obj import VersionedInformationObject
 
 
 definition = {
@@ -17,14 +17,16 @@ definition = {
         'place': {'type': 'string'},
         'weapons': {'description': "A list of weapon",
                     'type': 'array',
-                    'items': {'type': 'object'}},
+                    'items': {'type': 'string'}},
         'orders': {'type': 'array',
                    'items': {'$ref': '#/definitions/Order'}},
     }
 }
 
 
-class SoldierInfo(InformationObject):
+class SoldierInfo(VersionedInformationObject):
+    _children = 'orders'
+
     def __init__(self,
                  id: str,
                  name: str,
@@ -50,6 +52,16 @@ class SoldierInfo(InformationObject):
         except KeyError:
             raise TypeError
 
+    def add_order(self, order: Order):
+        self._add_child(order)
+
+    def remove_orders(self, purpose: str):
+        """
+        指定されたpurposeを持つorderを全て取り除く
+        :param str purpose: 取り除くorderのpurpose(=MissionのID)
+        """
+        self._remove_children(lambda o: o.purpose == purpose)
+
 
 class Soldier(object):
     def __init__(self, sol_id, name):
@@ -152,7 +164,8 @@ class WorkingThread(Thread):
 
                 url = "{0}subordinates/{1}/work".format(
                     self.soldier.superior_ep, self.soldier.id)
-                res, err = rest.post(url, json=work.to_dict())
+                res, err = rest.post(url, json=work.to_dict(), binary=True,
+                                     params={"purpose": work.purpose})
                 if err is not None:
                     self.soldier.shutdown()
                     logger.fatal('in WorkingThread, failed to post work: {0}', err)
@@ -168,11 +181,13 @@ class HeartBeat(Thread):
         self.soldier = soldier
         self.interval = interval
         self.etag = None
+        self.cursor = ""  # 空のcursorで最初のcursorを要求する
 
     def run(self):
         while not self.lock.wait(timeout=self.interval):
             url = self.soldier.superior_ep + "subordinates/" + self.soldier.id
-            res, err = rest.get(url, etag=self.etag)
+            res, err = rest.get(url, params={"since": self.cursor},
+                                etag=self.etag)
             if err is not None:
                 # TODO: エラー処理ちゃんとやる
                 logger.error('In HeartBeat, failed to post report')
@@ -181,7 +196,12 @@ class HeartBeat(Thread):
             if res.status_code == 304:
                 continue
             self.etag = res.headers['ETag']
-            info = SoldierInfo.make(res.json()['info'])
+            body = res.json()
+            self.cursor = body.get('cursor', "")
+            if 'delta' in body:
+                self.apply_delta(body['delta'])
+                continue
+            info = SoldierInfo.make(body['info'])
 
             logger.info([str(m) for m in info.orders])
 
@@ -195,3 +215,19 @@ class HeartBeat(Thread):
             for m in info.orders:
                 self.soldier.accept_order(m)
         self.soldier.shutdown()
+
+    def apply_delta(self, delta):
+        """
+        前回のheartbeatからのorderの差分を適用する
+        :param Dict delta: 追加されたorderと削除されたorderのID
+        """
+        logger.info('delta: +{0} -{1}'.format(len(delta['added']),
+                                              len(delta['removed'])))
+        added = [Order.make(o) for o in delta['added']]
+        # 差し替えられたorderはaccept_orderが入れ替える
+        replaced = {o.get_id() for o in added}
+        for oid in delta['removed']:
+            if oid in self.soldier.orders and oid not in replaced:
+                self.soldier.remove_order(oid)
+        for o in added:
+            self.soldier.accept_order(o)
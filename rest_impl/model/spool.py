@@ -0,0 +1,288 @@
+"""
+書き込めなかったドキュメントを一時的に保存する追記専用のスプール
+
+ディレクトリ内のセグメントファイル（spool-00000001.log, ...）に
+レコードを追記していき，segment_sizeを超えたら次のセグメントに移る
+レコードは (ボディの長さ, ボディのcrc32) の8バイトのヘッダとJSONのボディ
+msgpackのボディから来たbytesの値は{"$bytes": base64}として格納する
+（MongoDBのフィールド名は$で始められないのでドキュメントとは衝突しない）
+読み出しはmmapで行い，再送できたところまでをpositionファイルに記録する
+セグメントの合計がmax_bytesを超えれば古いセグメントから捨てる
+"""
+import base64
+import json
+import mmap
+import os
+import re
+import struct
+import zlib
+from threading import Lock
+from model import logger
+
+_HEADER = struct.Struct('>II')
+_SEGMENT_PATTERN = re.compile(r'spool-(\d{8})\.log$')
+_POSITION_FILE = 'position'
+_BYTES_KEY = '$bytes'
+
+
+def _encode_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {_BYTES_KEY: base64.b64encode(value).decode('ascii')}
+    raise TypeError("{0!r} is not JSON serializable".format(value))
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and isinstance(obj.get(_BYTES_KEY), str):
+        return base64.b64decode(obj[_BYTES_KEY])
+    return obj
+
+
+def _encode_record(record):
+    return json.dumps(record, default=_encode_value).encode()
+
+
+def _decode_record(body):
+    return json.loads(body.decode(), object_hook=_decode_object)
+
+
+class Spool(object):
+    def __init__(self, directory, segment_size=4 * 1024 * 1024,
+                 max_bytes=256 * 1024 * 1024, sync=True):
+        """
+        :param str directory: セグメントを置くディレクトリ
+        :param int segment_size: 1セグメントの大きさの目安 [byte]
+        :param int max_bytes: セグメントの合計の上限 [byte]
+        :param bool sync: 追記のたびにfsyncする
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.sync = sync
+        self.lock = Lock()
+
+        self.appended = 0
+        self.replayed = 0
+        self.dropped_records = 0
+        self.dropped_bytes = 0
+        self.dropped_segments = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.head, self.offset = self._load_position()
+        # セグメント番号 -> [大きさ, 未再送のレコード数]
+        self.segments = {}
+        for name in sorted(os.listdir(directory)):
+            match = _SEGMENT_PATTERN.match(name)
+            if match is None:
+                continue
+            number = int(match.group(1))
+            if number < self.head:  # 再送済み
+                os.remove(self._path(number))
+                continue
+            segment = self.segments[number] = [0, 0]
+            for _, _, end in self._records(number, 0):
+                segment[0] = end
+                if number > self.head or end > self.offset:
+                    segment[1] += 1
+        if len(self.segments) > 0:
+            self.head = max(self.head, min(self.segments))
+            self.tail = max(self.segments)
+            # 書き込み途中で止まった末尾のレコードは切り捨てる
+            with open(self._path(self.tail), 'r+b') as f:
+                f.truncate(self.segments[self.tail][0])
+        else:
+            self.tail = self.head
+        self.writer = None
+
+    def __len__(self):
+        """
+        :return int: まだ再送していないレコードの数（概数）
+        """
+        with self.lock:
+            return sum(count for _, count in self.segments.values())
+
+    def _path(self, number):
+        return os.path.join(self.directory, 'spool-{0:08d}.log'.format(number))
+
+    def _load_position(self):
+        try:
+            with open(os.path.join(self.directory, _POSITION_FILE)) as f:
+                position = json.load(f)
+            return position['segment'], position['offset']
+        except (OSError, ValueError, KeyError):
+            return 1, 0
+
+    def _save_position(self):
+        path = os.path.join(self.directory, _POSITION_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'segment': self.head, 'offset': self.offset}, f)
+        os.replace(path + '.tmp', path)
+
+    def _records(self, number, offset):
+        """
+        セグメントのoffset以降のレコードをmmapで読み出す
+        書き込み途中で途切れたり壊れたりしたレコード以降は読まない
+        :return: (ボディ, 開始位置, 終了位置)のイテレータ
+        """
+        try:
+            f = open(self._path(number), 'rb')
+        except OSError:
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                return
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as m:
+                while offset + _HEADER.size <= size:
+                    length, crc = _HEADER.unpack_from(m, offset)
+                    start = offset + _HEADER.size
+                    if start + length > size:
+                        break
+                    body = m[start:start + length]
+                    if zlib.crc32(body) & 0xffffffff != crc:
+                        logger.error("spool: broken record in {0} at {1}".
+                                     format(self._path(number), offset))
+                        break
+                    yield body, offset, start + length
+                    offset = start + length
+
+    def append(self, destination, documents):
+        """
+        書き込めなかったドキュメントをスプールに追記する
+        :param str destination: 格納先のURI
+        :param List[Dict] documents: ドキュメント
+        """
+        body = _encode_record({'destination': destination,
+                               'documents': documents})
+        record = _HEADER.pack(len(body), zlib.crc32(body) & 0xffffffff) + body
+        with self.lock:
+            size = self.segments.get(self.tail, [0, 0])[0]
+            if size > 0 and size + len(record) > self.segment_size:
+                self._close_writer()
+                self.tail += 1
+            if self.writer is None:
+                self.writer = open(self._path(self.tail), 'ab')
+            try:
+                self.writer.write(record)
+                self.writer.flush()
+                if self.sync:
+                    os.fsync(self.writer.fileno())
+            except OSError:
+                self._discard_partial()
+                raise
+            segment = self.segments.setdefault(self.tail, [0, 0])
+            segment[0] += len(record)
+            segment[1] += 1
+            self.appended += 1
+            self._enforce_budget()
+
+    def _discard_partial(self):
+        """
+        書き込みに失敗したレコードの断片を切り捨てる
+        切り捨てられなければ次のセグメントに移り，断片の後ろには追記しない
+        """
+        writer, self.writer = self.writer, None
+        try:
+            writer.close()
+        except OSError:
+            pass
+        size = self.segments.get(self.tail, [0, 0])[0]
+        try:
+            os.truncate(self._path(self.tail), size)
+        except OSError as e:
+            logger.error("spool: failed to truncate {0}: {1}".format(
+                self._path(self.tail), e))
+            if self.tail in self.segments:
+                self.tail += 1
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def _enforce_budget(self):
+        """
+        合計がmax_bytesを超えていれば古いセグメントから捨てる
+        """
+        while sum(size for size, _ in self.segments.values()) > \
+                self.max_bytes and len(self.segments) > 0:
+            number = min(self.segments)
+            if number == self.tail:
+                # 書き込み中のセグメントしか無ければ次のセグメントに移る
+                self._close_writer()
+                self.tail += 1
+            size, count = self.segments.pop(number)
+            if number == self.head:
+                size -= self.offset
+                self.head, self.offset = number + 1, 0
+                self._save_position()
+            self.dropped_segments += 1
+            self.dropped_records += count
+            self.dropped_bytes += size
+            logger.error("spool: dropped {0} records in {1}".format(
+                count, self._path(number)))
+            os.remove(self._path(number))
+
+    def replay(self, write):
+        """
+        スプールのレコードを古い順にwriteに渡す
+        writeが例外を送出すれば，そのレコードから次回に再開する
+        :param Callable write: (格納先, ドキュメントのリスト)を受け取る関数
+        :return bool: 全てのレコードを再送できればTrue
+        """
+        while True:
+            with self.lock:
+                if len(self.segments) == 0:
+                    return True
+                number = max(self.head, min(self.segments))
+                if number != self.head:
+                    self.head, self.offset = number, 0
+                offset = self.offset
+                read_size = self.segments[number][0]
+            for body, _, end in self._records(number, offset):
+                record = _decode_record(body)
+                try:
+                    write(record['destination'], record['documents'])
+                except Exception as e:
+                    logger.error("spool: replay failed: {0}".format(e))
+                    return False
+                with self.lock:
+                    if self.head != number:
+                        # 再送中に予算超過で捨てられた
+                        break
+                    self.offset = end
+                    self.segments[number][1] -= 1
+                    self.replayed += 1
+                    self._save_position()
+            with self.lock:
+                if self.head != number:
+                    continue
+                size, count = self.segments[number]
+                if number == self.tail:
+                    if self.offset < size and size > read_size:
+                        continue  # 読んでいる間に追記された
+                    # 書き込み中のセグメントを読み切ったか，
+                    # 壊れたレコードで止まった
+                    self._close_writer()
+                    self.tail += 1
+                if count > 0:
+                    # 壊れたレコード以降は読めないので捨てる
+                    self.dropped_records += count
+                    self.dropped_bytes += size - self.offset
+                self.segments.pop(number, None)
+                os.remove(self._path(number))
+                self.head, self.offset = number + 1, 0
+                self._save_position()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "segments": len(self.segments),
+                "bytes": sum(size for size, _ in self.segments.values()),
+                "max_bytes": self.max_bytes,
+                "pending": sum(count for _, count in self.segments.values()),
+                "appended": self.appended,
+                "replayed": self.replayed,
+                "dropped_records": self.dropped_records,
+                "dropped_bytes": self.dropped_bytes,
+                "dropped_segments": self.dropped_segments,
+            }
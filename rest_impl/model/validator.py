@@ -0,0 +1,122 @@
+"""
+model.definitionsから型ごとの検査・生成関数を生成する
+
+生成した関数はdictを受け取り，(生成したオブジェクト, None)か
+(None, エラーメッセージ)を返す．エラーメッセージには不正な値の位置が入る
+  e.g. "Campaign.requirement.values[1]: string required"
+"""
+import inspect
+from typing import Callable, Dict
+
+_TYPES = {
+    'string': str,
+    'boolean': bool,
+    'object': dict,
+    'array': list,
+    'number': (int, float),
+    'integer': int,
+}
+
+
+def _identity(value):
+    return value, None
+
+
+def _compile_property(schema, resolve):
+    """
+    プロパティのスキーマから検査関数を生成する
+    検査関数は値を受け取り(変換後の値, エラー)を返す
+    エラーは".key"や"[i]"で始まる相対位置か，": "で始まるメッセージ
+    """
+    if '$ref' in schema:
+        name = schema['$ref'].split('/')[-1]
+        return lambda value: resolve(name)(value)
+
+    type_name = schema.get('type')
+    expected = _TYPES.get(type_name)
+    if expected is None:
+        return _identity
+    type_err = ": {0} required".format(type_name)
+
+    if type_name == 'array' and 'items' in schema:
+        check_item = _compile_property(schema['items'], resolve)
+        if check_item is _identity:
+            return lambda value: (value, None) if isinstance(value, list) \
+                else (None, type_err)
+
+        def check_array(value):
+            if not isinstance(value, list):
+                return None, type_err
+            result = []
+            for i, item in enumerate(value):
+                item, err = check_item(item)
+                if err is not None:
+                    return None, "[{0}]{1}".format(i, err)
+                result.append(item)
+            return result, None
+        return check_array
+
+    def check_type(value):
+        if not isinstance(value, expected) or \
+                (expected is not bool and isinstance(value, bool)):
+            return None, type_err
+        return value, None
+    return check_type
+
+
+def _compile_object(definition, cls, resolve):
+    """
+    オブジェクトの定義とクラスから検査・生成関数を生成する
+    検査対象はクラスのフィールド（=コンストラクタの引数）で，
+    既定値の無いものは必須とする．既定値がNoneのものはnullも受け付ける
+    """
+    properties = definition.get('properties', {})
+    params = inspect.signature(cls.__init__).parameters
+    fields = [(key, _compile_property(properties.get(key, {}), resolve))
+              for key in cls._fields]
+    optional = {key for key, _ in fields
+                if key in params and
+                params[key].default is not inspect.Parameter.empty}
+
+    def check_and_make(source):
+        if not isinstance(source, dict):
+            return None, ": object required"
+        kwargs = {}
+        for key, check in fields:
+            if key not in source:
+                if key in optional:
+                    continue
+                return None, ".{0}: required".format(key)
+            if source[key] is None and key in optional and \
+                    params[key].default is None:
+                kwargs[key] = None
+                continue
+            value, err = check(source[key])
+            if err is not None:
+                return None, ".{0}{1}".format(key, err)
+            kwargs[key] = value
+        return cls(**kwargs), None
+    return check_and_make
+
+
+def compile_validators(definitions, classes) -> Dict[str, Callable]:
+    """
+    definitionsのうちクラスの対応するものについて検査・生成関数を生成する
+    :param Dict definitions: swagger形式の型定義
+    :param Dict[str, type] classes: 型名と対応するInformationObjectのクラス
+    :return Dict[str, Callable]: 型名と検査・生成関数
+    """
+    compiled = {}
+    for name, cls in classes.items():
+        compiled[name] = _compile_object(definitions[name], cls,
+                                         compiled.__getitem__)
+
+    def top_level(name, check):
+        def validate(source):
+            obj, err = check(source)
+            if err is not None:
+                return None, name + err
+            return obj, None
+        return validate
+
+    return {name: top_level(name, check) for name, check in compiled.items()}
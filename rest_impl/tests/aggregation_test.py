@@ -0,0 +1,108 @@
+import unittest
+from model.aggregation import WindowAggregator, parse_aggregation
+
+
+def doc(second, value, place="desk.left", v_type="temperature"):
+    return {"purpose": "room",
+            "place": place,
+            "time": "2016-11-01T12:{0:02d}:{1:02d}+00:00".format(
+                second // 60, second % 60),
+            "data": {"type": v_type, "value": value, "unit": "C"}}
+
+
+class AggregationTestCase(unittest.TestCase):
+
+    def test_parse_aggregation(self):
+        self.assertEqual(parse_aggregation({"window": 60}),
+                         ((60, ["min", "max", "mean"], False), None))
+        self.assertEqual(parse_aggregation({"window": 10,
+                                            "functions": ["count"],
+                                            "sample": True}),
+                         ((10, ["count"], True), None))
+        for spec, err in [
+                ([], "aggregation: object required"),
+                ({"window": 0}, "aggregation.window: positive number"),
+                ({"window": True}, "aggregation.window: positive number"),
+                ({"window": 1, "functions": []}, "aggregation.functions:"),
+                ({"window": 1, "functions": ["sum", "avg"]},
+                 "aggregation.functions[1]: one of"),
+                ({"window": 1, "sample": "yes"}, "aggregation.sample:")]:
+            result, actual = parse_aggregation(spec)
+            self.assertIsNone(result)
+            self.assertTrue(actual.startswith(err), actual)
+
+    def test_window(self):
+        agg = WindowAggregator("room", 10, list(
+            ["count", "sum", "min", "max", "mean", "first", "last"]))
+        self.assertEqual(agg.add([doc(i, i % 7) for i in range(10)]), [])
+        out = agg.add([doc(10, 1)])
+        self.assertEqual(out, [{
+            "purpose": "room", "place": "desk.left",
+            "time": "2016-11-01T12:00:00+00:00",
+            "data": {"type": "temperature", "unit": "C", "window": 10,
+                     "count": 10, "sum": 24, "min": 0, "max": 6,
+                     "mean": 2.4, "first": 0, "last": 2}}])
+        self.assertEqual(agg.stats()["received"], 11)
+
+    def test_keys_and_passthrough(self):
+        agg = WindowAggregator("room", 10, ["mean"], sample=True)
+        raw = [doc(0, "open", v_type="door"), doc(0, True, v_type="door")]
+        self.assertEqual(agg.add(raw + [doc(1, 1.0),
+                                        doc(2, 3.0, place="desk.right")]),
+                         raw)
+        out = agg.add([doc(11, 2.0), doc(3, 5.0)])
+        # 窓ごとの集約値と最後の生の値，遅れて届いた値はそのまま
+        self.assertEqual([(d["place"], d["time"], d["data"])
+                          for d in out], [
+            ("desk.left", "2016-11-01T12:00:00+00:00",
+             {"type": "temperature", "unit": "C", "window": 10,
+              "mean": 1.0}),
+            ("desk.left", "2016-11-01T12:00:01+00:00",
+             {"type": "temperature", "value": 1.0, "unit": "C"}),
+            ("desk.left", "2016-11-01T12:00:03+00:00",
+             {"type": "temperature", "value": 5.0, "unit": "C"}),
+        ])
+        # 他の値が2つ先の窓に進めば，止まった値の窓も出力する
+        out = agg.add([doc(25, 2.0)])
+        self.assertEqual([(d["place"], d["data"].get("mean")) for d in out],
+                         [("desk.left", 2.0), ("desk.left", None),
+                          ("desk.right", 3.0), ("desk.right", None)])
+        self.assertEqual(len(agg.flush()), 2)
+        self.assertEqual(agg.flush(), [])
+
+    def test_commit(self):
+        agg = WindowAggregator("room", 10, ["count"])
+        agg.add([doc(0, 1.0), doc(1, 2.0)])
+
+        # commitはロックを放してから呼ぶ
+        def put(output):
+            self.assertTrue(agg.lock.acquire(blocking=False))
+            agg.lock.release()
+            return True
+        self.assertEqual(agg.add([doc(2, 3.0)], commit=put), [])
+
+        # 格納できなければ取り消す
+        self.assertIsNone(agg.add([doc(10, 4.0)], commit=lambda o: False))
+        self.assertEqual(agg.stats()["received"], 3)
+        out = agg.add([doc(10, 4.0)], commit=lambda o: True)
+        self.assertEqual([d["data"]["count"] for d in out], [3])
+
+    def test_commit_interleaved(self):
+        agg = WindowAggregator("room", 10, ["count"])
+        agg.add([doc(0, 1.0)])
+
+        # 格納を待つ間に他のreportが集約を進めれば取り消さずに出力を次回に回す
+        def put(output):
+            self.assertEqual(agg.add([doc(11, 5.0)]), [])
+            return False
+        self.assertEqual(agg.add([doc(10, 4.0)], commit=put), [])
+        self.assertEqual(agg.stats()["received"], 3)
+        self.assertEqual(agg.stats()["pending"], 1)
+        out = agg.add([doc(20, 6.0)])
+        self.assertEqual([(d["time"], d["data"]["count"]) for d in out],
+                         [("2016-11-01T12:00:00+00:00", 1),
+                          ("2016-11-01T12:00:10+00:00", 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
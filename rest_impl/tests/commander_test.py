@@ -1,12 +1,15 @@
 import unittest
 import json
 import copy
+import sys
+import threading
 import traceback
 from controller import CommanderServer
 from datetime import datetime
 from logging import getLogger, StreamHandler, DEBUG, ERROR
+from unittest.mock import patch
 from model import LeaderInfo, Commander, CommanderInfo,\
-    Requirement, Report, Campaign
+    Requirement, Report, ColumnarReport, Campaign
 
 logger = getLogger(__name__)
 handler = StreamHandler()
@@ -22,6 +25,7 @@ class CommanderTestCase(unittest.TestCase):
     def setUp(self):
         self.maxDiff = None
         commander = Commander("cxxx0", "cmd_http", "http://localhost:50000")
+        self.commander_obj = commander
         CommanderServer.set_model(commander)
         server = CommanderServer.generate_server("/commander")
 
@@ -231,6 +235,41 @@ class CommanderTestCase(unittest.TestCase):
                 self.fail('{0} is not found.'.format(exp))
         pass
 
+    def test_get_subordinates_paginated(self):
+        leader_base = LeaderInfo(id='lxxx0',
+                                 name='cmd_http',
+                                 place="desk",
+                                 endpoint='http://localhost:50000',
+                                 subordinates=[],
+                                 missions=[])
+        leader_list = []
+        for l_id in ['lxxx3', 'lxxx0', 'lxxx2', 'lxxx1', 'lxxx4']:
+            l = copy.deepcopy(leader_base)
+            l.id = l_id
+            leader_list.append(l)
+            self.app.post('/commander/subordinates',
+                          data=json.dumps(l.to_dict()),
+                          content_type='application/json')
+
+        # ID順に2件ずつ取得する
+        pages = []
+        params = {'limit': 2}
+        while True:
+            response = self.app.get('/commander/subordinates',
+                                    query_string=params)
+            self.assertEqual(response.status_code, 200)
+            actual = json.loads(response.data.decode("utf-8"))
+            pages.append([l['id'] for l in actual['subordinates']])
+            if actual['next'] is None:
+                break
+            params['after'] = actual['next']
+        self.assertEqual(pages, [['lxxx0', 'lxxx1'], ['lxxx2', 'lxxx3'],
+                                 ['lxxx4']])
+
+        response = self.app.get('/commander/subordinates',
+                                query_string={'limit': 'all'})
+        self.assertEqual(response.status_code, 400)
+
 # [POST] /subordinates
     def test_add_subordinate(self):
         leader = LeaderInfo(id='lxxx0',
@@ -306,7 +345,9 @@ class CommanderTestCase(unittest.TestCase):
         report = Report(purpose="some app",
                         time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                         place="desk",
-                        values="some values")
+                        values=[{"time": "2016-11-01T12:00:00",
+                                 "place": "left",
+                                 "values": []}])
         response = self.app.post('/commander/subordinates/lxxx0/report',
                                  data=json.dumps(report.to_dict()),
                                  content_type='application/json')
@@ -320,6 +361,487 @@ class CommanderTestCase(unittest.TestCase):
         }
         self.assertEqual(actual, expected)
 
+    def test_submit_columnar_report(self):
+        # add leader
+        leader = LeaderInfo(id='lxxx0',
+                            name='lea_http',
+                            place="desk",
+                            endpoint='http://localhost:50000',
+                            subordinates=[],
+                            missions=[])
+        self.app.post('/commander/subordinates',
+                      data=json.dumps(leader.to_dict()),
+                      content_type='application/json')
+        campaign = Campaign(author='cxxx0',
+                            destination='mongodb://localhost/troops/test',
+                            place='All',
+                            purpose='A great app',
+                            requirement=Requirement(
+                                values=["zero", "random"],
+                                trigger={"timer": 10}
+                            ),
+                            trigger={"timer": 30})
+        self.commander_obj.accept_campaign(campaign)
+
+        # submit a report
+        report = ColumnarReport.build(
+            time="2016-11-01T12:00:10", place="desk",
+            purpose=campaign.get_id(),
+            works=[("2016-11-01T12:00:00", "left",
+                    [{"type": "zero", "value": 0, "unit": "-"},
+                     {"type": "random", "value": 0.5, "unit": "-"}]),
+                   ("2016-11-01T12:00:01", "right",
+                    [{"type": "random", "value": 0.2, "unit": "-"}])])
+        with patch("model.commander.MongoPush") as m:
+            response = self.app.post('/commander/subordinates/lxxx0/report',
+                                     data=json.dumps(report.to_dict()),
+                                     content_type='application/json')
+            self.assertTrue(self.commander_obj.ingest.flush(timeout=1))
+        self.assertEqual(response.status_code, 200)
+        actual = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(actual["accepted"], report.to_dict())
+
+        pushed = m.return_value.push_values.call_args[0][0]
+        expected = [
+            {"purpose": "A great app", "place": "desk.left",
+             "time": "2016-11-01T12:00:00",
+             "data": {"type": "zero", "value": 0, "unit": "-"}},
+            {"purpose": "A great app", "place": "desk.left",
+             "time": "2016-11-01T12:00:00",
+             "data": {"type": "random", "value": 0.5, "unit": "-"}},
+            {"purpose": "A great app", "place": "desk.right",
+             "time": "2016-11-01T12:00:01",
+             "data": {"type": "random", "value": 0.2, "unit": "-"}},
+        ]
+        self.assertEqual(len(pushed), len(expected))
+        for exp in expected:
+            self.assertIn(exp, pushed)
+
+    def test_submit_report_aggregated(self):
+        leader = LeaderInfo(id='lxxx0',
+                            name='lea_http',
+                            place="desk",
+                            endpoint='http://localhost:50000',
+                            subordinates=[],
+                            missions=[])
+        self.commander_obj.accept_subordinate(leader)
+        campaign = Campaign(author='cxxx0',
+                            destination='mongodb://localhost/troops/test',
+                            place='All',
+                            purpose='A great app',
+                            requirement=Requirement(
+                                values=["zero"],
+                                trigger={"timer": 1}
+                            ),
+                            trigger={"timer": 30},
+                            aggregation={"window": 60,
+                                         "functions": ["min", "max", "mean"]})
+        self.commander_obj.accept_campaign(campaign)
+
+        # 12:00:00から12:01:29まで1秒ごとの値
+        works = [{"time": "2016-11-01T12:{0:02d}:{1:02d}+00:00".format(
+                      i // 60, i % 60),
+                  "place": "left",
+                  "values": [{"type": "zero", "value": i, "unit": "-"}]}
+                 for i in range(90)]
+        report = Report(time="2016-11-01T12:01:30+00:00", place="desk",
+                        purpose=campaign.get_id(), values=works)
+        with patch("model.commander.MongoPush") as m:
+            self.assertTrue(
+                self.commander_obj.accept_report('lxxx0', report))
+            self.assertTrue(self.commander_obj.ingest.flush(timeout=1))
+            pushed = m.return_value.push_values.call_args[0][0]
+            self.assertEqual(pushed, [
+                {"purpose": "A great app", "place": "desk.left",
+                 "time": "2016-11-01T12:00:00+00:00",
+                 "data": {"type": "zero", "unit": "-", "window": 60,
+                          "min": 0, "max": 59, "mean": 29.5}}])
+
+            # 途中の窓はCampaignの削除時に書き込む
+            self.commander_obj.remove_campaign(campaign.get_id())
+            self.assertTrue(self.commander_obj.ingest.flush(timeout=1))
+            pushed = m.return_value.push_values.call_args[0][0]
+            self.assertEqual(pushed[0]["data"]["mean"], 74.5)
+            self.assertEqual(pushed[0]["time"], "2016-11-01T12:01:00+00:00")
+
+    def test_submit_report_aggregated_rejected(self):
+        leader = LeaderInfo(id='lxxx0',
+                            name='lea_http',
+                            place="desk",
+                            endpoint='http://localhost:50000',
+                            subordinates=[],
+                            missions=[])
+        self.commander_obj.accept_subordinate(leader)
+        campaign = Campaign(author='cxxx0',
+                            destination='mongodb://localhost/troops/test',
+                            place='All',
+                            purpose='A great app',
+                            requirement=Requirement(
+                                values=["zero"],
+                                trigger={"timer": 1}
+                            ),
+                            trigger={"timer": 30},
+                            aggregation={"window": 60,
+                                         "functions": ["count", "mean"]})
+        self.commander_obj.accept_campaign(campaign)
+        aggregator = self.commander_obj.aggregators[campaign.get_id()]
+
+        def report(start, count):
+            works = [{"time": "2016-11-01T12:{0:02d}:{1:02d}+00:00".format(
+                          i // 60, i % 60),
+                      "place": "left",
+                      "values": [{"type": "zero", "value": i, "unit": "-"}]}
+                     for i in range(start, start + count)]
+            return Report(time="2016-11-01T12:02:00+00:00", place="desk",
+                          purpose=campaign.get_id(), values=works)
+
+        with patch("model.commander.MongoPush") as m:
+            self.assertTrue(
+                self.commander_obj.accept_report('lxxx0', report(0, 30)))
+            self.assertEqual(aggregator.stats()["received"], 30)
+
+            # キューに積めなければ集約も取り消され，窓の集約値も失われない
+            with patch.object(self.commander_obj.ingest, "put",
+                              return_value=False):
+                self.assertFalse(
+                    self.commander_obj.accept_report('lxxx0', report(30, 60)))
+            stats = aggregator.stats()
+            self.assertEqual(stats["received"], 30)
+            self.assertEqual(stats["emitted"], 0)
+
+            # 再送されたreportは一度だけ数えられる
+            self.assertTrue(
+                self.commander_obj.accept_report('lxxx0', report(30, 60)))
+            self.assertTrue(self.commander_obj.ingest.flush(timeout=1))
+            pushed = m.return_value.push_values.call_args[0][0]
+            self.assertEqual(pushed, [
+                {"purpose": "A great app", "place": "desk.left",
+                 "time": "2016-11-01T12:00:00+00:00",
+                 "data": {"type": "zero", "unit": "-", "window": 60,
+                          "count": 60, "mean": 29.5}}])
+            self.assertEqual(aggregator.stats()["received"], 90)
+
+    def test_submit_report_batch(self):
+        leader = LeaderInfo(id='lxxx0',
+                            name='lea_http',
+                            place="desk",
+                            endpoint='http://localhost:50000',
+                            subordinates=[],
+                            missions=[])
+        self.commander_obj.accept_subordinate(leader)
+        reports = [Report(purpose="app {0}".format(i),
+                          time="2016-11-01T12:00:00",
+                          place="desk",
+                          values=[]).to_dict() for i in range(2)]
+        reports.append(ColumnarReport.build(
+            time="2016-11-01T12:00:00", place="desk", purpose="app 2",
+            works=[]).to_dict())
+        response = self.app.post('/commander/subordinates/lxxx0/report',
+                                 data=json.dumps({"reports": reports}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        actual = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(actual["accepted"], reports)
+
+        # 1つでも不正なreportがあれば全て受理しない
+        del reports[1]["place"]
+        response = self.app.post('/commander/subordinates/lxxx0/report',
+                                 data=json.dumps({"reports": reports}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        actual = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(actual["_status"]["msg"],
+                         "reports[1].Report.place: required")
+
+    def test_get_reports(self):
+        reports = [Report(time="2016-11-01T12:00:0{0}+00:00".format(i),
+                          place="desk" if i % 2 == 0 else "left",
+                          purpose="some purpose",
+                          values=[])
+                   for i in range(4)]
+        for r in reports:
+            self.commander_obj.report_cache.append(r)
+
+        response = self.app.get('/commander/reports',
+                                query_string={
+                                    'place': 'desk',
+                                    'start': '2016-11-01T12:00:01Z'})
+        self.assertEqual(response.status_code, 200)
+        actual = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(actual['reports'], [reports[2].to_dict()])
+
+        response = self.app.get('/commander/reports',
+                                query_string={'purpose': 'some purpose',
+                                              'limit': 2})
+        actual = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(actual['reports'],
+                         [reports[3].to_dict(), reports[2].to_dict()])
+
+        response = self.app.get('/commander/reports',
+                                query_string={'end': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_submit_invalid_report(self):
+        # add leader
+        leader = LeaderInfo(id='lxxx0',
+                            name='lea_http',
+                            place="desk",
+                            endpoint='http://localhost:50000',
+                            subordinates=[],
+                            missions=[])
+        self.app.post('/commander/subordinates',
+                      data=json.dumps(leader.to_dict()),
+                      content_type='application/json')
+
+        # submit an invalid report
+        report = {"purpose": "some app",
+                  "time": "2016-11-01T12:00:00",
+                  "place": "desk",
+                  "values": "some values"}
+        response = self.app.post('/commander/subordinates/lxxx0/report',
+                                 data=json.dumps(report),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        actual = json.loads(response.data.decode("utf-8"))
+        expected = {
+            "_status": {'success': False,
+                        'msg': "Report.values: array required"},
+        }
+        self.assertEqual(actual, expected)
+
+    def test_add_invalid_campaign(self):
+        campaign = Campaign(author='cxxx0',
+                            destination='mongoserv',
+                            place='S101',
+                            purpose='A great app',
+                            requirement=Requirement(
+                                values=["zero", 0],
+                                trigger={"timer": 10}
+                            ),
+                            trigger={"timer": 30}).to_dict()
+        response = self.app.post('/commander/campaigns',
+                                 data=json.dumps(campaign),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        actual = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(actual["_status"]["msg"],
+                         "Campaign.requirement.values[1]: string required")
+
+        del campaign["destination"]
+        response = self.app.post('/commander/campaigns',
+                                 data=json.dumps(campaign),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        actual = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(actual["_status"]["msg"],
+                         "Campaign.destination: required")
+
+        # aggregationは省略でき，不正であれば受理しない
+        campaign["destination"] = "mongoserv"
+        campaign["requirement"]["values"] = ["zero"]
+        campaign["aggregation"] = {"window": 60, "functions": ["median"]}
+        response = self.app.post('/commander/campaigns',
+                                 data=json.dumps(campaign),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        actual = json.loads(response.data.decode("utf-8"))
+        self.assertTrue(actual["_status"]["msg"].startswith(
+            "Campaign.aggregation.functions[0]: one of"))
+
+        campaign["aggregation"] = None
+        response = self.app.post('/commander/campaigns',
+                                 data=json.dumps(campaign),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_campaign_shares_requirement(self):
+        for l_id in ['lxxx0', 'lxxx1']:
+            leader = LeaderInfo(id=l_id,
+                                name='lea_http',
+                                place="desk",
+                                endpoint='http://localhost:50000',
+                                subordinates=[],
+                                missions=[])
+            self.commander_obj.accept_subordinate(leader)
+        campaign = Campaign(author='cxxx0',
+                            destination='mongoserv',
+                            place='All',
+                            purpose='A great app',
+                            requirement=Requirement(
+                                values=["zero", "random"],
+                                trigger={"timer": 10}
+                            ),
+                            trigger={"timer": 30})
+        self.commander_obj.accept_campaign(campaign)
+
+        m0 = self.commander_obj.get_sub_info('lxxx0').missions[0]
+        m1 = self.commander_obj.get_sub_info('lxxx1').missions[0]
+        self.assertEqual(m0.author, 'lxxx0')
+        self.assertEqual(m1.author, 'lxxx1')
+        self.assertIs(m0.requirement, m1.requirement)
+        self.assertIs(m0.trigger, m1.trigger)
+        self.assertEqual(m0.requirement, campaign.requirement)
+
+    def test_campaign_targets_place(self):
+        places = {'lxxx0': 'Floor-1', 'lxxx1': 'Floor-3',
+                  'lxxx2': 'Floor-3', 'lxxx3': 'S101',
+                  'lxxx4': 'room1.desk1', 'lxxx5': 'room1.desk2'}
+        for l_id, place in places.items():
+            leader = LeaderInfo(id=l_id,
+                                name='lea_http',
+                                place=place,
+                                endpoint='http://localhost:50000',
+                                subordinates=[],
+                                missions=[])
+            self.commander_obj.accept_subordinate(leader)
+
+        def targets(place):
+            campaign = Campaign(author='cxxx0',
+                                destination='mongoserv',
+                                place=place,
+                                purpose='purpose of ' + place,
+                                requirement=Requirement(
+                                    values=["zero"],
+                                    trigger={"timer": 10}
+                                ),
+                                trigger={"timer": 30})
+            self.commander_obj.accept_campaign(campaign)
+            result = {}
+            for l_id in self.commander_obj.subordinates:
+                for m in self.commander_obj.get_sub_info(l_id).missions:
+                    if m.purpose == campaign.get_id():
+                        result[l_id] = m.place
+            return result
+
+        self.assertEqual(targets('Floor-3'),
+                         {'lxxx1': 'All', 'lxxx2': 'All'})
+        # 残りの階層はMissionのplaceとしてLeaderに渡す
+        self.assertEqual(targets('Floor-3.west-side'),
+                         {'lxxx1': 'west-side', 'lxxx2': 'west-side'})
+        self.assertEqual(targets('Floor-*'),
+                         {'lxxx0': 'All', 'lxxx1': 'All', 'lxxx2': 'All'})
+        self.assertEqual(targets('Floor-2'), {})
+        # 階層を持つplaceのLeaderは上位の階層で対象にできる
+        self.assertEqual(targets('room1'),
+                         {'lxxx4': 'All', 'lxxx5': 'All'})
+        self.assertEqual(targets('room1.*.left'),
+                         {'lxxx4': 'left', 'lxxx5': 'left'})
+        self.assertEqual(targets('room1.desk2.left'), {'lxxx5': 'left'})
+
+        # 部下が離脱すれば索引からも取り除かれる
+        self.commander_obj.remove_subordinate('lxxx2')
+        self.assertEqual(targets('Floor-3.east-side'),
+                         {'lxxx1': 'east-side'})
+
+    def test_campaign_index(self):
+        for i, place in enumerate(['Floor-1', 'Floor-1', 'Floor-2']):
+            self.commander_obj.accept_subordinate(
+                LeaderInfo(id='lxxx{0}'.format(i),
+                           name='lea_http',
+                           place=place,
+                           endpoint='http://localhost:50000',
+                           subordinates=[],
+                           missions=[]))
+        campaign = Campaign(author='cxxx0',
+                            destination='mongoserv',
+                            place='Floor-1.desk',
+                            purpose='some purpose hoge',
+                            requirement=Requirement(
+                                values=["zero"],
+                                trigger={"timer": 10}
+                            ),
+                            trigger={"timer": 30})
+        self.commander_obj.accept_campaign(campaign)
+        cid = campaign.get_id()
+        self.assertEqual(self.commander_obj.campaign_subs[cid],
+                         {'lxxx0', 'lxxx1'})
+
+        # 新しい部下の入隊では既存の部下のMissionは作り直さない
+        versions = {sid: sub.version
+                    for sid, sub in self.commander_obj.subordinates.items()}
+        self.commander_obj.accept_subordinate(
+            LeaderInfo(id='lxxx3',
+                       name='lea_http',
+                       place='Floor-1',
+                       endpoint='http://localhost:50000',
+                       subordinates=[],
+                       missions=[]))
+        for sid, version in versions.items():
+            self.assertEqual(self.commander_obj.get_sub_info(sid).version,
+                             version)
+        missions = self.commander_obj.get_sub_info('lxxx3').missions
+        self.assertEqual([(m.purpose, m.place) for m in missions],
+                         [(cid, 'desk')])
+
+        self.commander_obj.remove_subordinate('lxxx1')
+        self.assertEqual(self.commander_obj.campaign_subs[cid],
+                         {'lxxx0', 'lxxx3'})
+
+        # Campaignの削除は割り当て先の部下のみに及ぶ
+        self.commander_obj.remove_campaign(cid)
+        self.assertNotIn(cid, self.commander_obj.campaign_subs)
+        self.assertEqual(self.commander_obj.get_sub_info('lxxx2').version,
+                         versions['lxxx2'])
+        for sid in ['lxxx0', 'lxxx3']:
+            self.assertEqual(
+                self.commander_obj.get_sub_info(sid).missions, [])
+
+    def test_campaign_index_concurrent(self):
+        commander = self.commander_obj
+        sids = ['lxxx{0}'.format(i) for i in range(8)]
+
+        def make_campaign(n):
+            return Campaign(author='cxxx0',
+                            destination='mongoserv',
+                            place='Floor-1',
+                            purpose='purpose{0}'.format(n),
+                            requirement=Requirement(
+                                values=["zero"],
+                                trigger={"timer": 10}
+                            ),
+                            trigger={"timer": 30})
+
+        # Campaignの受理と並行して部下の入隊・期限切れを繰り返す
+        def churn_campaigns():
+            for n in range(200):
+                commander.accept_campaign(make_campaign(n % 4))
+                if n % 3 == 0:
+                    cid = make_campaign((n + 1) % 4).get_id()
+                    if cid in commander.campaigns:
+                        commander.remove_campaign(cid)
+
+        def churn_subordinates():
+            for n in range(200):
+                sid = sids[n % len(sids)]
+                commander.accept_subordinate(
+                    LeaderInfo(id=sid,
+                               name='lea_http',
+                               place='Floor-1',
+                               endpoint='http://localhost:50000',
+                               subordinates=[],
+                               missions=[]))
+                commander._expire_subordinates([sids[(n + 3) % len(sids)]])
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        threads = [threading.Thread(target=churn_campaigns),
+                   threading.Thread(target=churn_subordinates)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # 索引は部下の持つMissionと一致する
+        for cid in commander.campaigns:
+            holders = {sid for sid, sub in commander.subordinates.items()
+                       if cid in [m.purpose for m in sub.missions]}
+            self.assertEqual(commander.campaign_subs[cid], holders)
+        self.assertEqual(set(commander.campaign_subs),
+                         set(commander.campaigns))
+        self.assertEqual(commander.place_index.match('Floor-1'),
+                         set(commander.subordinates))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,186 @@
+import unittest
+from json import dumps
+from flask import Flask, jsonify, request
+import utils.rest as rest
+import utils.wire as wire
+from utils.helpers import json_input, request_body, ResponseStatus
+
+
+def gen_server(received):
+    """
+    受け取ったボディとContent-Encodingを記録して返すサーバ
+    /rejectは圧縮されたボディを受け付けないサーバ，
+    /json_onlyはmsgpackを扱えないサーバの代わり
+    """
+    server = Flask(__name__)
+
+    @server.route('/echo', methods=['POST'])
+    @json_input
+    def echo():
+        received.append(request.headers.get('Content-Encoding'))
+        return jsonify(_status=ResponseStatus.Success, body=request_body())
+
+    @server.route('/reject', methods=['POST'])
+    def reject():
+        received.append(request.headers.get('Content-Encoding'))
+        if 'Content-Encoding' in request.headers:
+            response = jsonify(_status=ResponseStatus.Failed)
+            response.headers['Accept-Encoding'] = 'identity'
+            return response, 415
+        return jsonify(_status=ResponseStatus.Success, body=request.json)
+
+    @json_input
+    def accept_json():
+        return jsonify(_status=ResponseStatus.Success, body=request_body())
+
+    @server.route('/json_only', methods=['POST'])
+    def json_only():
+        received.append((request.headers.get('Content-Encoding'),
+                         request.mimetype))
+        if request.mimetype == wire.MSGPACK:
+            return jsonify(_status=ResponseStatus.make_error(
+                'application/json required')), 415
+        return accept_json()
+
+    return server
+
+
+class CompressTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.received = []
+        self.app = gen_server(self.received).test_client()
+        self.large = {"values": [{"type": "temperature", "value": i / 7}
+                                 for i in range(200)]}
+        self.small = {"values": []}
+
+    def tearDown(self):
+        rest.set_compression(None, 1024)
+        rest.identity_only_hosts.clear()
+        rest.test_clients.clear()
+
+    def test_compress(self):
+        data = wire.encode(self.large)
+        compressed = wire.compress(data, wire.GZIP)
+        self.assertLess(len(compressed), len(data) / 2)
+        self.assertEqual(wire.decompress(compressed, wire.GZIP), data)
+        self.assertEqual(wire.decompress(data, wire.IDENTITY), data)
+
+        # 壊れたデータ，途中で切れたデータ，上限を超えるデータ
+        with self.assertRaises(ValueError):
+            wire.decompress(data, wire.GZIP)
+        with self.assertRaises(ValueError):
+            wire.decompress(compressed[:-8], wire.GZIP)
+        with self.assertRaises(ValueError):
+            wire.decompress(compressed, wire.GZIP, max_size=len(data) - 1)
+
+    def test_compress_zstd(self):
+        if not wire.supports_coding(wire.ZSTD):
+            self.skipTest("zstandard is not installed")
+        data = wire.encode(self.large)
+        compressed = wire.compress(data, wire.ZSTD)
+        self.assertLess(len(compressed), len(data) / 2)
+        self.assertEqual(wire.decompress(compressed, wire.ZSTD), data)
+        with self.assertRaises(ValueError):
+            wire.decompress(compressed, wire.ZSTD, max_size=len(data) - 1)
+
+    def test_json_input(self):
+        data = wire.compress(wire.encode(self.large), wire.GZIP)
+        res = self.app.post('/echo', data=data,
+                            content_type='application/json',
+                            headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["body"], self.large)
+
+        # 壊れたボディ
+        res = self.app.post('/echo', data=data[:-8],
+                            content_type='application/json',
+                            headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(res.status_code, 400)
+
+        # 扱えない圧縮形式
+        res = self.app.post('/echo', data=data,
+                            content_type='application/json',
+                            headers={'Content-Encoding': 'br'})
+        self.assertEqual(res.status_code, 415)
+
+        # 圧縮されていないボディは従来通り
+        res = self.app.post('/echo', data=dumps(self.small),
+                            content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["body"], self.small)
+
+    def test_json_input_msgpack(self):
+        if not wire.supports(wire.MSGPACK):
+            self.skipTest("msgpack is not installed")
+        data = wire.compress(wire.encode(self.large, wire.MSGPACK),
+                             wire.GZIP)
+        res = self.app.post('/echo', data=data, content_type=wire.MSGPACK,
+                            headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["body"], self.large)
+
+    def test_post(self):
+        rest.test_clients["echo"] = self.app
+        rest.set_compression(wire.GZIP, 1024)
+
+        # 閾値未満のボディは圧縮しない
+        res, err = rest.post("test://echo/echo", json=self.small)
+        self.assertIsNone(err)
+        res, err = rest.post("test://echo/echo", json=self.large)
+        self.assertIsNone(err)
+        self.assertEqual(res.json()["body"], self.large)
+        res, err = rest.post("test://echo/echo", json=self.large,
+                             binary=True)
+        self.assertIsNone(err)
+        self.assertEqual(rest.decode_body(res)["body"], self.large)
+        self.assertEqual(self.received, [None, 'gzip', 'gzip'])
+
+        rest.set_compression(None)
+        res, err = rest.post("test://echo/echo", json=self.large)
+        self.assertIsNone(err)
+        self.assertEqual(self.received[-1], None)
+
+        with self.assertRaises(ValueError):
+            rest.set_compression('br')
+
+    def test_post_fallback(self):
+        rest.test_clients["echo"] = self.app
+        rest.set_compression(wire.GZIP, 1024)
+
+        # 圧縮が受け付けられなければ圧縮せずに送り直し，以降は圧縮しない
+        res, err = rest.post("test://echo/reject", json=self.large)
+        self.assertIsNone(err)
+        self.assertEqual(res.json()["body"], self.large)
+        res, err = rest.post("test://echo/reject", json=self.large)
+        self.assertIsNone(err)
+        self.assertEqual(self.received, ['gzip', None, None])
+        self.assertIn("echo", rest.identity_only_hosts)
+
+    def test_post_fallback_msgpack(self):
+        if not wire.supports(wire.MSGPACK):
+            self.skipTest("msgpack is not installed")
+        rest.test_clients["old"] = self.app
+        rest.set_compression(wire.GZIP, 1024)
+        self.addCleanup(rest.json_only_hosts.clear)
+
+        # msgpackによる415では圧縮をやめず，jsonを圧縮して送り直す
+        res, err = rest.post("test://old/json_only", json=self.large,
+                             binary=True)
+        self.assertIsNone(err)
+        self.assertEqual(res.json()["body"], self.large)
+        self.assertEqual(self.received, [('gzip', wire.MSGPACK),
+                                         ('gzip', wire.JSON)])
+        self.assertIn("old", rest.json_only_hosts)
+        self.assertNotIn("old", rest.identity_only_hosts)
+
+        # 扱えない圧縮形式の415にはAccept-Encodingが付く
+        res = self.app.post('/echo', data=b'{}',
+                            content_type='application/json',
+                            headers={'Content-Encoding': 'br'})
+        self.assertEqual(res.status_code, 415)
+        self.assertIn('gzip', res.headers['Accept-Encoding'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import patch
+import model.edge_aggregation as edge_aggregation
+from model.edge_aggregation import summarize
+
+
+def works():
+    return [("2016-11-01T12:00:0{0}".format(i), "left",
+             [{"type": "temperature", "value": 20 + i, "unit": "degC"},
+              {"type": "accelerometer", "value": [i, -i, 1.0], "unit": "g"},
+              {"type": "battery", "value": None, "unit": "%"}])
+            for i in range(5)] + \
+        [("2016-11-01T12:00:02", "right",
+          [{"type": "temperature", "value": 30, "unit": "degC"},
+           {"type": "temperature", "value": [1, 2], "unit": "degC"}])]
+
+
+class EdgeAggregationTestCase(unittest.TestCase):
+
+    def assertStats(self, actual):
+        self.assertEqual(len(actual), 2)
+        left, right = actual
+        self.assertEqual((left["time"], left["until"], left["place"]),
+                         ("2016-11-01T12:00:00", "2016-11-01T12:00:04",
+                          "left"))
+        temp, acc = left["values"]
+        self.assertEqual(temp["type"], "temperature")
+        self.assertEqual(temp["unit"], "degC")
+        self.assertEqual(temp["count"], 5)
+        self.assertEqual((temp["min"], temp["max"], temp["mean"]),
+                         (20, 24, 22))
+        self.assertAlmostEqual(temp["std"], 2 ** 0.5)
+        self.assertEqual(temp["p50"], 22)
+        self.assertAlmostEqual(temp["p90"], 23.6)
+
+        # 3軸の値は軸ごとに求める
+        self.assertEqual(acc["count"], 5)
+        self.assertEqual(acc["min"], [0, -4, 1])
+        self.assertEqual(acc["max"], [4, 0, 1])
+        self.assertEqual(acc["mean"], [2, -2, 1])
+        self.assertEqual(acc["std"][2], 0)
+        for a, b in zip(acc["p90"], [3.6, -0.4, 1]):
+            self.assertAlmostEqual(a, b)
+
+        # 軸の数が違う値は数えない
+        self.assertEqual(right["values"][0]["count"], 1)
+        self.assertEqual(right["values"][0]["p90"], 30)
+
+    def test_summarize(self):
+        self.assertStats(summarize(works()))
+
+    def test_summarize_without_numpy(self):
+        with patch.object(edge_aggregation, "numpy", None):
+            self.assertStats(summarize(works()))
+
+    def test_same_as_numpy(self):
+        if not edge_aggregation.uses_numpy():
+            self.skipTest("numpy is not installed")
+        expected = summarize(works(), percentiles=(0, 25, 99.5))
+        with patch.object(edge_aggregation, "numpy", None):
+            actual = summarize(works(), percentiles=(0, 25, 99.5))
+        self.assertEqual([r["values"][0].keys() for r in actual],
+                         [r["values"][0].keys() for r in expected])
+        for a, e in zip(actual, expected):
+            for av, ev in zip(a["values"], e["values"]):
+                for key in ev:
+                    if isinstance(ev[key], list):
+                        for x, y in zip(av[key], ev[key]):
+                            self.assertAlmostEqual(x, y)
+                    elif isinstance(ev[key], float):
+                        self.assertAlmostEqual(av[key], ev[key])
+                    else:
+                        self.assertEqual(av[key], ev[key])
+
+    def test_empty(self):
+        self.assertEqual(summarize([]), [])
+        self.assertEqual(summarize([("t", "left", [])]),
+                         [{"time": "t", "until": "t", "place": "left",
+                           "values": []}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+import unittest
+from model import Requirement, Campaign, Mission, Order, Report, Work,\
+    ColumnarReport,\
+    SoldierInfo, LeaderInfo, CommanderInfo
+from model.info_obj import InformationObject, intern_value
+
+
+class InfoObjTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.requirement = Requirement(values=["zero", "random"],
+                                       trigger={"timer": 10})
+
+    def test_fields(self):
+        self.assertEqual(Campaign._fields, ('aggregation', 'author',
+                                            'destination', 'place',
+                                            'purpose', 'requirement',
+                                            'trigger'))
+        self.assertEqual(Work._fields, ('purpose', 'time', 'values'))
+        self.assertEqual(SoldierInfo._fields, ('id', 'name', 'orders',
+                                               'place', 'weapons'))
+
+    def test_fields_from_slots(self):
+        class Slotted(InformationObject):
+            __slots__ = ('b', 'a')
+
+            def __init__(self, a, b):
+                self.a = a
+                self.b = b
+
+        self.assertEqual(Slotted._fields, ('a', 'b'))
+        self.assertEqual(Slotted(1, [3, 2]).to_dict(), {'a': 1, 'b': [2, 3]})
+
+    def test_to_dict_nested(self):
+        mission = Mission(author="lxxx0",
+                          requirement=self.requirement,
+                          trigger={"timer": 30},
+                          place="All",
+                          purpose="some purpose")
+        leader = LeaderInfo(id="lxxx0", name="lea", place="desk",
+                            endpoint="http://localhost:50000",
+                            subordinates=["sxxx1", "sxxx0"],
+                            missions=[mission])
+        expected = {
+            "id": "lxxx0",
+            "name": "lea",
+            "place": "desk",
+            "endpoint": "http://localhost:50000",
+            "subordinates": ["sxxx0", "sxxx1"],
+            "missions": [{
+                "author": "lxxx0",
+                "requirement": {"values": ["random", "zero"],
+                                "trigger": {"timer": 10}},
+                "trigger": {"timer": 30},
+                "place": "All",
+                "purpose": "some purpose",
+            }]
+        }
+        self.assertEqual(leader.to_dict(), expected)
+        self.assertEqual(list(leader.to_dict().keys()),
+                         sorted(expected.keys()))
+
+    def test_make_round_trip(self):
+        campaign = Campaign(author="cxxx0",
+                            requirement=self.requirement,
+                            trigger={"timer": 30},
+                            place="All",
+                            purpose="some purpose",
+                            destination="mongodb://localhost/troops/test")
+        order = Order(author="sxxx0", values=["zero"],
+                      trigger={"timer": 10}, purpose="some purpose")
+        report = Report(time="2016-11-01T12:00:00", place="desk",
+                        purpose="some purpose", values=[])
+        soldier = SoldierInfo(id="sxxx0", name="sol", place="left",
+                              weapons=["zero"], orders=[])
+        commander = CommanderInfo(id="cxxx0", name="com", place="S101",
+                                  endpoint="http://localhost:50000",
+                                  subordinates=[], campaigns=[])
+        for obj in [campaign, order, report, soldier, commander]:
+            made = obj.__class__.make(obj.to_dict())
+            self.assertEqual(made, obj)
+            self.assertEqual(made.hash(), obj.hash())
+
+    def test_versioned_hash(self):
+        order = Order(author="sxxx0", values=["zero"],
+                      trigger={"timer": 10}, purpose="some purpose")
+        soldier = SoldierInfo(id="sxxx0", name="sol", place="left",
+                              weapons=["zero"], orders=[])
+        digest = soldier.hash()
+        version = soldier.version
+        self.assertEqual(soldier.hash(), digest)
+
+        soldier.add_order(order)
+        self.assertGreater(soldier.version, version)
+        self.assertNotEqual(soldier.hash(), digest)
+
+        soldier.remove_orders("some purpose")
+        self.assertEqual(soldier.hash(), digest)
+
+        soldier.place = "right"
+        self.assertNotEqual(soldier.hash(), digest)
+
+    def test_merkle_hash(self):
+        orders = [Order(author="sxxx0", values=["zero"],
+                        trigger={"timer": 10}, purpose="purpose-{0}".format(i))
+                  for i in range(3)]
+
+        def soldier(order_list):
+            return SoldierInfo(id="sxxx0", name="sol", place="left",
+                               weapons=["zero"], orders=order_list)
+
+        # 順序によらず同じhashになる
+        self.assertEqual(soldier(orders).hash(),
+                         soldier(list(reversed(orders))).hash())
+
+        # 追加・削除を反映したhashは作り直したものと一致する
+        incremental = soldier(orders[:1])
+        incremental.hash()
+        incremental.add_order(orders[1])
+        incremental.add_order(orders[2])
+        self.assertEqual(incremental.hash(), soldier(orders).hash())
+        incremental.remove_orders("purpose-1")
+        self.assertEqual(incremental.hash(),
+                         soldier([orders[0], orders[2]]).hash())
+
+        # 加えたorderは中身を変えられないので，差し替えればhashが変わる
+        before = incremental.hash()
+        with self.assertRaises(TypeError):
+            incremental.orders[0].values = ["random"]
+        with self.assertRaises(TypeError):
+            incremental.orders[0].values.append("random")
+        with self.assertRaises(TypeError):
+            incremental.orders[0].trigger["timer"] = 20
+        self.assertEqual(incremental.hash(), before)
+        incremental.remove_orders("purpose-0")
+        incremental.add_order(Order(author="sxxx0", values=["random"],
+                                    trigger={"timer": 10},
+                                    purpose="purpose-0"))
+        self.assertNotEqual(incremental.hash(), before)
+
+    def test_changes_since(self):
+        orders = [Order(author="sxxx0", values=["zero"],
+                        trigger={"timer": 10}, purpose="purpose-{0}".format(i))
+                  for i in range(3)]
+        info = SoldierInfo(id="sxxx0", name="sol", place="left",
+                           weapons=["zero"], orders=orders[:1])
+        self.assertIsNone(info.changes_since(""))
+
+        cursor = info.cursor()
+        self.assertEqual(info.changes_since(cursor), ([], []))
+        info.add_order(orders[1])
+        info.add_order(orders[2])
+        info.remove_orders("purpose-0")
+        info.remove_orders("purpose-2")
+        added, removed = info.changes_since(cursor)
+        self.assertEqual(added, [orders[1]])
+        self.assertEqual(removed, [orders[0].get_id(), orders[2].get_id()])
+
+        # 子要素以外が変われば差分は返せない
+        cursor = info.cursor()
+        info.place = "right"
+        self.assertIsNone(info.changes_since(cursor))
+        self.assertIsNone(info.changes_since("unknown." + cursor))
+
+    def test_intern_requirement(self):
+        shared = Requirement.intern(self.requirement)
+        other = Requirement.intern(Requirement(values=["zero", "random"],
+                                               trigger={"timer": 10}))
+        self.assertIs(shared, other)
+        self.assertEqual(shared, self.requirement)
+        self.assertEqual(shared.to_dict(), self.requirement.to_dict())
+        self.assertIsNot(Requirement.intern(Requirement(
+            values=["zero", "random"], trigger={"timer": 10.0})), shared)
+
+        # 共有されたものは変更できない
+        with self.assertRaises(TypeError):
+            shared.values = ["zero"]
+        with self.assertRaises(TypeError):
+            shared.values.append("zero")
+        with self.assertRaises(TypeError):
+            shared.trigger["timer"] = 1
+
+    def test_intern_value(self):
+        trigger = intern_value({"timer": 10})
+        self.assertIs(intern_value({"timer": 10}), trigger)
+        self.assertEqual(trigger, {"timer": 10})
+        self.assertEqual(str(trigger), str({"timer": 10}))
+
+    def test_columnar_report_build(self):
+        report = ColumnarReport.build(
+            time="2016-11-01T12:00:10", place="desk", purpose="some purpose",
+            works=[("2016-11-01T12:00:01", "right",
+                    [{"type": "random", "value": 0.5, "unit": "-"}]),
+                   ("2016-11-01T12:00:00", "left",
+                    [{"type": "zero", "value": 0, "unit": "-"},
+                     {"type": "accelerometer", "value": [0.1, 0.0, 1.0],
+                      "unit": "g"}])])
+        expected = {
+            "time": "2016-11-01T12:00:10",
+            "place": "desk",
+            "purpose": "some purpose",
+            "times": ["2016-11-01T12:00:01", "2016-11-01T12:00:00"],
+            "places": ["right", "left"],
+            "types": ["random", "zero", "accelerometer"],
+            "units": {"random": "-", "zero": "-", "accelerometer": "g"},
+            "columns": [[0.5, None], [None, 0], [None, [0.1, 0.0, 1.0]]],
+        }
+        self.assertEqual(report.to_dict(), expected)
+        self.assertEqual(ColumnarReport.make(expected), report)
+
+
+if __name__ == "__main__":
+    unittest.main()
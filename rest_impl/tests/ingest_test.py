@@ -0,0 +1,127 @@
+import shutil
+import tempfile
+import time
+import unittest
+from threading import Event
+from model.ingest import IngestQueue
+from model.spool import Spool
+
+
+class RecordingWriter(object):
+    def __init__(self, uri, batches, gate=None):
+        self.uri = uri
+        self.batches = batches
+        self.gate = gate
+
+    def push_values(self, values):
+        if self.gate is not None:
+            self.gate.wait()
+        self.batches.append((self.uri, list(values)))
+
+
+class FlakyWriter(object):
+    def __init__(self, batches, down):
+        self.batches = batches
+        self.down = down
+
+    def push_values(self, values):
+        if self.down.is_set():
+            raise ConnectionError("mongodb is down")
+        self.batches.append(list(values))
+
+
+class IngestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.gate = None
+        self.queue = None
+
+    def tearDown(self):
+        if self.gate is not None:
+            self.gate.set()
+        if self.queue is not None:
+            self.queue.close(timeout=1)
+
+    def make_queue(self, **kwargs):
+        self.queue = IngestQueue(
+            lambda uri: RecordingWriter(uri, self.batches, self.gate),
+            **kwargs)
+        return self.queue
+
+    def test_batch_across_reports(self):
+        queue = self.make_queue(batch_size=4, flush_interval=10)
+        self.assertTrue(queue.put("mongodb://a/db/col", [1, 2]))
+        self.assertTrue(queue.put("mongodb://b/db/col", [10]))
+        self.assertTrue(queue.put("mongodb://a/db/col", [3, 4, 5]))
+
+        # batch_sizeに達した分は待たずに書き込まれる
+        for _ in range(100):
+            if len(self.batches) > 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.batches, [("mongodb://a/db/col", [1, 2, 3, 4])])
+
+        # 残りはflushで書き込まれる
+        self.assertTrue(queue.flush(timeout=1))
+        self.assertEqual(sorted(self.batches[1:]),
+                         [("mongodb://a/db/col", [5]),
+                          ("mongodb://b/db/col", [10])])
+
+        stats = queue.stats()
+        self.assertEqual(stats["depth"], 0)
+        self.assertEqual(stats["batches"], 3)
+        self.assertEqual(stats["documents"], 6)
+        self.assertEqual(stats["avg_batch_size"], 2)
+
+    def test_flush_interval(self):
+        queue = self.make_queue(batch_size=100, flush_interval=0.1)
+        queue.put("mongodb://a/db/col", [1])
+        time.sleep(0.5)
+        self.assertEqual(self.batches, [("mongodb://a/db/col", [1])])
+
+    def test_backpressure(self):
+        self.gate = Event()
+        queue = self.make_queue(batch_size=2, flush_interval=0,
+                                max_depth=2)
+        # 1バッチ目は書き込み中のまま止まり，2バッチ目でキューが埋まる
+        self.assertTrue(queue.put("mongodb://a/db/col", [1, 2]))
+        time.sleep(0.1)
+        self.assertTrue(queue.put("mongodb://a/db/col", [3, 4]))
+        self.assertFalse(queue.put("mongodb://a/db/col", [5], timeout=0.1))
+        self.assertEqual(queue.stats()["rejected"], 1)
+
+        self.gate.set()
+        self.assertTrue(queue.put("mongodb://a/db/col", [5], timeout=1))
+        self.assertTrue(queue.flush(timeout=1))
+        self.assertEqual([v for _, b in self.batches for v in b],
+                         [1, 2, 3, 4, 5])
+
+    def test_spool_while_down(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        down = Event()
+        down.set()
+        self.queue = IngestQueue(lambda uri: FlakyWriter(self.batches, down),
+                                 batch_size=2, flush_interval=0)
+        self.queue.attach_spool(Spool(directory, sync=False),
+                                retry_interval=0.3)
+
+        self.queue.put("mongodb://a/db/col", [1, 2])
+        self.assertTrue(self.queue.flush(timeout=1))
+        # 書き込めなかった後のバッチも順序を保つためスプールに続ける
+        down.clear()
+        self.queue.put("mongodb://a/db/col", [3])
+        self.assertTrue(self.queue.flush(timeout=1))
+        self.assertEqual(self.queue.stats()["spooled"], 2)
+
+        for _ in range(200):
+            if len(self.batches) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.batches, [[1, 2], [3]])
+        self.assertEqual(self.queue.stats()["spool"]["pending"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -65,6 +65,10 @@ class IntegrationTestCase(unittest.TestCase):
         for m in self.models.values():
             if hasattr(m, "__del__"):
                 m.__del__()
+            if isinstance(m, Leader):
+                # reportの送信が後続のテストのモックに届かないようにする
+                m.heartbeat_thread.lock.set()
+                m.scheduler.stop()
 
     def start_single_without_awake(self):
         self.models["recruiter"], clients["recruiter"] = gen_recruiter()
@@ -0,0 +1,51 @@
+import datetime
+import unittest
+import dateutil.parser
+import utils.isotime as isotime
+
+
+class IsoTimeTestCase(unittest.TestCase):
+
+    def test_parse_isoformat(self):
+        now = datetime.datetime(2016, 11, 1, 12, 0, 0, 123456)
+        tz = datetime.timezone(datetime.timedelta(hours=9))
+        for value in [now, now.replace(microsecond=0),
+                      now.replace(tzinfo=tz),
+                      now.replace(tzinfo=datetime.timezone.utc)]:
+            self.assertEqual(isotime.parse(value.isoformat()), value)
+            self.assertEqual(isotime.parse(value.isoformat()).utcoffset(),
+                             value.utcoffset())
+
+    def test_same_as_dateutil(self):
+        for value in ["2016-11-01T12:00:00",
+                      "2016-11-01 12:00:00",
+                      "2016-11-01T12:00",
+                      "2016-11-01T12:00:00.5",
+                      "2016-11-01T12:00:00Z",
+                      "2016-11-01T12:00:00-0530",
+                      "2016-11-01T12:00:00+00:00",
+                      "2016-11-01",
+                      "Tue Nov  1 12:00:00 2016",
+                      "20161101T120000"]:
+            expected = dateutil.parser.parse(value)
+            actual = isotime.parse(value)
+            self.assertEqual(actual, expected, value)
+            self.assertEqual(actual.utcoffset(), expected.utcoffset(), value)
+
+    def test_invalid(self):
+        for value in ["", "not a time", "2016-13-01T12:00:00"]:
+            with self.assertRaises(ValueError):
+                isotime.parse(value)
+
+    def test_cached_parser(self):
+        parse = isotime.CachedParser(max_size=2)
+        first = parse("2016-11-01T12:00:00")
+        self.assertIs(parse("2016-11-01T12:00:00"), first)
+        parse("2016-11-01T12:00:01")
+        parse("2016-11-01T12:00:02")
+        self.assertLessEqual(len(parse.cache), 2)
+        self.assertEqual(parse("2016-11-01T12:00:00"), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,9 @@ from unittest.mock import patch
 from controller import LeaderServer
 from datetime import datetime
 from logging import getLogger, StreamHandler, DEBUG, ERROR
-from model import Leader, LeaderInfo, SoldierInfo, Requirement, Work, Mission
+from model.leader import HeartBeat
+from model import Leader, LeaderInfo, SoldierInfo, Requirement, Work, Mission, \
+    Order
 
 logger = getLogger(__name__)
 handler = StreamHandler()
@@ -243,6 +245,238 @@ class LeaderTestCase(unittest.TestCase):
         }
         self.assertEqual(actual, expected)
 
+    def test_get_subordinate_info_not_modified(self):
+        # add soldier
+        soldier = SoldierInfo(id='sxxx0',
+                              name='sol_http',
+                              place="left",
+                              weapons=["zero"],
+                              orders=[])
+        self.app.post('/leader/subordinates',
+                      data=dumps(soldier.to_dict()),
+                      content_type='application/json')
+
+        response = self.app.get('/leader/subordinates/sxxx0')
+        etag = response.headers['ETag']
+        response = self.app.get('/leader/subordinates/sxxx0',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # missionが追加されたらETagが変わる
+        mission = Mission(author='lxxx0',
+                          place='All',
+                          purpose='A great app',
+                          requirement=Requirement(
+                              values=["zero", "random"],
+                              trigger={"timer": 10}
+                          ),
+                          trigger={"timer": 30})
+        self.leader_obj.accept_mission(mission)
+        response = self.app.get('/leader/subordinates/sxxx0',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        actual = loads(response.data.decode("utf-8"))
+        self.assertEqual(len(actual['info']['orders']), 1)
+
+        # missionが消されたら元のETagに戻る
+        self.leader_obj.remove_mission(mission.get_id())
+        response = self.app.get('/leader/subordinates/sxxx0',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_get_subordinate_info_delta(self):
+        # add soldier
+        soldier = SoldierInfo(id='sxxx0',
+                              name='sol_http',
+                              place="left",
+                              weapons=["zero"],
+                              orders=[])
+        self.app.post('/leader/subordinates',
+                      data=dumps(soldier.to_dict()),
+                      content_type='application/json')
+
+        # 空のsinceでは全体とcursorが返る
+        response = self.app.get('/leader/subordinates/sxxx0',
+                                query_string={'since': ''})
+        self.assertEqual(response.status_code, 200)
+        actual = loads(response.data.decode("utf-8"))
+        self.assertEqual(actual['info'], soldier.to_dict())
+        cursor = actual['cursor']
+
+        missions = [Mission(author='lxxx0',
+                            place='All',
+                            purpose='A great app {0}'.format(i),
+                            requirement=Requirement(
+                                values=["zero", "random"],
+                                trigger={"timer": 10}
+                            ),
+                            trigger={"timer": 30})
+                    for i in range(2)]
+        self.leader_obj.accept_mission(missions[0])
+        response = self.app.get('/leader/subordinates/sxxx0',
+                                query_string={'since': cursor})
+        actual = loads(response.data.decode("utf-8"))
+        self.assertNotIn('info', actual)
+        self.assertEqual(actual['delta']['removed'], [])
+        self.assertEqual(len(actual['delta']['added']), 1)
+        order = Order.make(actual['delta']['added'][0])
+        self.assertEqual(order.purpose, missions[0].get_id())
+        cursor = actual['cursor']
+
+        # 追加と削除が差分として返る
+        self.leader_obj.accept_mission(missions[1])
+        self.leader_obj.remove_mission(missions[0].get_id())
+        response = self.app.get('/leader/subordinates/sxxx0',
+                                query_string={'since': cursor})
+        actual = loads(response.data.decode("utf-8"))
+        self.assertEqual(actual['delta']['removed'], [order.get_id()])
+        self.assertEqual([o['purpose'] for o in actual['delta']['added']],
+                         [missions[1].get_id()])
+
+        # 不明なcursorであれば全体が返る
+        response = self.app.get('/leader/subordinates/sxxx0',
+                                query_string={'since': 'unknown.0'})
+        actual = loads(response.data.decode("utf-8"))
+        self.assertEqual(len(actual['info']['orders']), 1)
+        self.assertIn('cursor', actual)
+
+    def test_mission_index(self):
+        for i, place in enumerate(["left", "left", "right"]):
+            self.leader_obj.accept_subordinate(
+                SoldierInfo(id='sxxx{0}'.format(i),
+                            name='sol_http',
+                            place=place,
+                            weapons=["zero"],
+                            orders=[]))
+        mission = Mission(author='lxxx0',
+                          place='left',
+                          purpose='A great app',
+                          requirement=Requirement(
+                              values=["zero"],
+                              trigger={"timer": 10}
+                          ),
+                          trigger={"timer": 30})
+        self.leader_obj.accept_mission(mission)
+        mid = mission.get_id()
+        self.assertEqual(self.leader_obj.mission_subs[mid],
+                         {'sxxx0', 'sxxx1'})
+
+        # 新しい部下の入隊では既存の部下のOrderは作り直さない
+        versions = {sid: sub.version
+                    for sid, sub in self.leader_obj.subordinates.items()}
+        self.leader_obj.accept_subordinate(
+            SoldierInfo(id='sxxx3',
+                        name='sol_http',
+                        place="left",
+                        weapons=["zero"],
+                        orders=[Order(author='sxxx3',
+                                      values=["zero"],
+                                      trigger={"timer": 10},
+                                      purpose=mid)]))
+        for sid, version in versions.items():
+            self.assertEqual(self.leader_obj.subordinates[sid].version,
+                             version)
+        self.assertEqual(len(self.leader_obj.get_sub_info('sxxx3').orders),
+                         1)
+
+        # 離脱した部下は索引からも取り除かれる
+        self.leader_obj.remove_subordinate('sxxx1')
+        self.assertEqual(self.leader_obj.mission_subs[mid],
+                         {'sxxx0', 'sxxx3'})
+
+        # Missionの削除は割り当て先の部下のみに及ぶ
+        self.leader_obj.remove_mission(mid)
+        self.assertNotIn(mid, self.leader_obj.mission_subs)
+        self.assertEqual(self.leader_obj.get_sub_info('sxxx2').version,
+                         versions['sxxx2'])
+        for sid in ['sxxx0', 'sxxx3']:
+            self.assertEqual(self.leader_obj.get_sub_info(sid).orders, [])
+        self.assertNotIn(mid, self.leader_obj.scheduler)
+
+    def test_apply_delta_replace(self):
+        soldier = SoldierInfo(id="sxxx0", name="sol-test", place="left",
+                              weapons=["zero"], orders=[])
+        self.leader_obj.accept_subordinate(soldier)
+        mission = Mission(author='lxxx0',
+                          place='All',
+                          purpose='A great app',
+                          requirement=Requirement(
+                              values=["zero"],
+                              trigger={"timer": 10}
+                          ),
+                          trigger={"timer": 30})
+        self.leader_obj.accept_mission(mission)
+        mid = mission.get_id()
+        work = Work(time=datetime.utcnow().isoformat(),
+                    purpose=mid,
+                    values=[0, 0.5])
+        self.leader_obj.accept_work("sxxx0", work)
+
+        # 同じIDのMissionの差し替えでは受理済みのworkを捨てない
+        replaced = copy.deepcopy(mission)
+        replaced.trigger = {"timer": 60}
+        HeartBeat(self.leader_obj, 0).apply_delta(
+            {'added': [replaced.to_dict()], 'removed': [mid]})
+        self.assertEqual(self.leader_obj.missions[mid].trigger,
+                         {"timer": 60})
+        self.assertEqual([w for _, w in self.leader_obj.take_works(mid)],
+                         [work])
+
+    def test_remove_mission_flushes_works(self):
+        self.leader_obj.superior_ep = "test://cxxx0/commander/"
+        soldier = SoldierInfo(id="sxxx0", name="sol-test", place="left",
+                              weapons=["zero"], orders=[])
+        self.leader_obj.accept_subordinate(soldier)
+        mission = Mission(author='lxxx0',
+                          place='All',
+                          purpose='A great app',
+                          requirement=Requirement(
+                              values=["zero"],
+                              trigger={"timer": 10}
+                          ),
+                          trigger={"timer": 30})
+        self.leader_obj.accept_mission(mission)
+        mid = mission.get_id()
+        work = Work(time=datetime.utcnow().isoformat(),
+                    purpose=mid,
+                    values=[0, 0.5])
+        self.leader_obj.accept_work("sxxx0", work)
+
+        # 受理済みのworkは捨てずに最後のreportとして送る
+        with patch.object(self.leader_obj.outbox, "send") as m:
+            self.leader_obj.remove_mission(mid)
+            self.assertEqual(m.call_count, 1)
+            url, reports = m.call_args[0]
+            self.assertEqual(
+                url, "test://cxxx0/commander/subordinates/lxxx0/report")
+            self.assertEqual([r["purpose"] for r in reports], ['A great app'])
+            self.assertEqual(reports[0]["values"][0]["values"], [0, 0.5])
+        self.assertEqual(list(self.leader_obj.take_works(mid)), [])
+
+        # workが無ければ送らない
+        self.leader_obj.accept_mission(mission)
+        with patch.object(self.leader_obj.outbox, "send") as m:
+            self.leader_obj.remove_mission(mid)
+            self.assertEqual(m.call_count, 0)
+        self.leader_obj.superior_ep = ""  # shutdownでDELETEを送信するのを阻止
+
+    def test_accept_work_expired(self):
+        soldier = SoldierInfo(id="sxxx0", name="sol-test", place="left",
+                              weapons=["zero"], orders=[])
+        self.leader_obj.accept_subordinate(soldier)
+        work = Work(time=datetime.utcnow().isoformat(),
+                    purpose="some purpose",
+                    values=[0, 0.5])
+        self.assertTrue(self.leader_obj.accept_work("sxxx0", work))
+
+        # 期限切れで除かれた部下のworkは例外にせず受理しない
+        self.leader_obj._expire_subordinates(["sxxx0"])
+        self.assertIsNone(self.leader_obj.get_sub_info("sxxx0"))
+        self.assertFalse(self.leader_obj.accept_work("sxxx0", work))
+        self.assertFalse(self.leader_obj.accept_raw_work(
+            "sxxx0", "some purpose", "application/json", b'{}'))
+
     def test_get_subordinate_info_with_invalid_id(self):
         # get the soldier
         response = self.app.get('/leader/subordinates/bad_id')
@@ -271,7 +505,7 @@ class LeaderTestCase(unittest.TestCase):
         # submit a work
         work = Work(purpose="some app",
                     time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    values="some values")
+                    values=[{"type": "zero", "value": 0, "unit": "-"}])
         response = self.app.post('/leader/subordinates/sxxx0/work',
                                  data=dumps(work.to_dict()),
                                  content_type='application/json')
@@ -285,6 +519,91 @@ class LeaderTestCase(unittest.TestCase):
         }
         self.assertEqual(actual, expected)
 
+    def test_submit_work_msgpack(self):
+        import utils.wire as wire
+        if not wire.supports(wire.MSGPACK):
+            self.skipTest("msgpack is not installed")
+
+        # add soldier
+        soldier = SoldierInfo(id='sxxx0',
+                              name='sol_http',
+                              place="left",
+                              weapons=[],
+                              orders=[])
+        self.app.post('/leader/subordinates',
+                      data=dumps(soldier.to_dict()),
+                      content_type='application/json')
+
+        # submit a work
+        work = Work(purpose="some app",
+                    time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    values=[{"type": "zero", "value": 0, "unit": "-"}])
+        response = self.app.post('/leader/subordinates/sxxx0/work',
+                                 data=wire.encode(work.to_dict(),
+                                                  wire.MSGPACK),
+                                 content_type=wire.MSGPACK,
+                                 headers={'Accept': wire.accept_header()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, wire.MSGPACK)
+        actual = wire.decode(response.data, wire.MSGPACK)
+
+        # assert
+        expected = {
+            "_status": {'success': True, 'msg': "status is ok"},
+            "accepted": work.to_dict()
+        }
+        self.assertEqual(actual, expected)
+        place, accepted = self.leader_obj.work_buffers[work.purpose][0]
+        self.assertEqual(place, "left")
+        self.assertEqual(accepted.to_dict(), work.to_dict())
+
+    def test_work_buffers(self):
+        from threading import Thread
+        soldier = SoldierInfo(id='sxxx0',
+                              name='sol_http',
+                              place="left",
+                              weapons=[],
+                              orders=[])
+        self.leader_obj.accept_subordinate(soldier)
+
+        # 受理と取り出しが並行してもworkは失われない
+        def submit(purpose):
+            for i in range(2000):
+                self.leader_obj.accept_work(
+                    'sxxx0', Work(purpose=purpose, time=str(i), values=[]))
+        threads = [Thread(target=submit, args=(p,)) for p in ["m0", "m1"]]
+        [th.start() for th in threads]
+        taken = {"m0": [], "m1": []}
+        while any(th.is_alive() for th in threads):
+            taken["m0"].extend(self.leader_obj.take_works("m0"))
+        [th.join() for th in threads]
+        taken["m0"].extend(self.leader_obj.take_works("m0"))
+        taken["m1"].extend(self.leader_obj.take_works("m1"))
+
+        for purpose, works in taken.items():
+            self.assertEqual([w.time for _, w in works],
+                             [str(i) for i in range(2000)])
+            self.assertTrue(all(w.purpose == purpose for _, w in works))
+        self.assertEqual(self.leader_obj.work_buffers, {})
+
+    def test_submit_work_bad_msgpack(self):
+        import utils.wire as wire
+        if not wire.supports(wire.MSGPACK):
+            self.skipTest("msgpack is not installed")
+
+        soldier = SoldierInfo(id='sxxx0',
+                              name='sol_http',
+                              place="left",
+                              weapons=[],
+                              orders=[])
+        self.app.post('/leader/subordinates',
+                      data=dumps(soldier.to_dict()),
+                      content_type='application/json')
+        response = self.app.post('/leader/subordinates/sxxx0/work',
+                                 data=b'\xc1',
+                                 content_type=wire.MSGPACK)
+        self.assertEqual(response.status_code, 400)
+
 # internal logic test ----------------------------------------------------------
 
     def test_missoin_do(self):
@@ -351,6 +670,172 @@ class LeaderTestCase(unittest.TestCase):
 
         self.leader_obj.superior_ep = ""  # shutdownでDELETEを送信するのを阻止
 
+    def test_missoin_do_coalesced(self):
+        def post_report(url, data=None, json=None, etag=None, **kwargs):
+            res = requests.Response()
+            res.status_code = 200
+            res._content = dumps({"_status": {"msg": "ok", "success": True},
+                                  "accepted": json["reports"]}).encode()
+            return res, None
+
+        self.leader_obj.superior_ep = "test://cxxx0/commander/"
+        soldier = SoldierInfo(id="sxxx0", name="sol-test", place="left",
+                              weapons=[], orders=[])
+        self.leader_obj.accept_subordinate(soldier)
+        missions = [Mission(author="sxxx0",
+                            requirement=Requirement(
+                                values=["zero"],
+                                trigger={"timer": 0.4}
+                            ),
+                            trigger={"timer": 0.7},
+                            place="All",
+                            purpose="some purpose {0}".format(i))
+                    for i in range(3)]
+        for m in missions:
+            self.leader_obj.accept_work(
+                "sxxx0", Work(time=datetime.utcnow().isoformat(),
+                              purpose=m.get_id(),
+                              values=[{"type": "zero", "value": 0,
+                                       "unit": "-"}]))
+
+        # 同時にtimerを迎えたMissionのreportは1回のPOSTで送る
+        with patch("utils.rest.post", side_effect=post_report) as m:
+            for mission in missions:
+                self.leader_obj.accept_mission(mission)
+            time.sleep(1)
+            self.assertEqual(m.call_count, 1)
+            actual = m.call_args[1]["json"]["reports"]
+            self.assertEqual(sorted(r["purpose"] for r in actual),
+                             ["some purpose 0", "some purpose 1",
+                              "some purpose 2"])
+            for report in actual:
+                self.assertEqual(len(report["values"]), 1)
+
+        self.leader_obj.superior_ep = ""  # shutdownでDELETEを送信するのを阻止
+
+    def test_missoin_do_columnar(self):
+        def post_report(url, data=None, json=None, etag=None, **kwargs):
+            res = requests.Response()
+            res.status_code = 200
+            res_dict = {
+                "_status": {"msg": "ok", "success": True},
+                "accepted": json
+            }
+            res._content = dumps(res_dict).encode()
+            return res, None
+
+        self.leader_obj.superior_ep = "test://cxxx0/commander/"
+        self.leader_obj.report_format = "columnar"
+        soldier = SoldierInfo(id="sxxx0", name="sol-test", place="left",
+                              weapons=[], orders=[])
+        self.leader_obj.accept_subordinate(soldier)
+
+        mission = Mission(author="sxxx0",
+                          requirement=Requirement(
+                              values=["zero", "random"],
+                              trigger={"timer": 0.4}
+                          ),
+                          trigger={"timer": 0.7},
+                          place="All",
+                          purpose="some purpose hash")
+        work_1 = Work(time="2016-11-01T12:00:00",
+                      purpose=mission.get_id(),
+                      values=[{"type": "zero", "value": 0, "unit": "-"}])
+        work_2 = Work(time="2016-11-01T12:00:01",
+                      purpose=mission.get_id(),
+                      values=[{"type": "zero", "value": 0, "unit": "-"},
+                              {"type": "random", "value": 0.5, "unit": "-"}])
+        self.leader_obj.accept_work("sxxx0", work_1)
+        self.leader_obj.accept_work("sxxx0", work_2)
+
+        with patch("utils.rest.post", side_effect=post_report) as m:
+            self.leader_obj.accept_mission(mission)
+            time.sleep(1)
+            self.assertEqual(m.call_count, 1)
+
+            actual = m.call_args[1]["json"]
+            self.assertEqual(actual["purpose"], "some purpose hash")
+            self.assertEqual(actual["times"],
+                             ["2016-11-01T12:00:00", "2016-11-01T12:00:01"])
+            self.assertEqual(actual["places"], ["left", "left"])
+            self.assertEqual(actual["types"], ["zero", "random"])
+            self.assertEqual(actual["units"], {"zero": "-", "random": "-"})
+            self.assertEqual(actual["columns"], [[0, 0], [None, 0.5]])
+
+        self.leader_obj.superior_ep = ""  # shutdownでDELETEを送信するのを阻止
+
+    def test_missoin_do_passthrough(self):
+        import utils.wire as wire
+
+        def post_report(url, data=None, json=None, etag=None, **kwargs):
+            res = requests.Response()
+            res.status_code = 200
+            res._content = dumps({
+                "_status": {"msg": "ok", "success": True}
+            }).encode()
+            return res, None
+
+        self.leader_obj.superior_ep = "test://cxxx0/commander/"
+        self.leader_obj.report_format = "passthrough"
+        soldier = SoldierInfo(id="sxxx0", name="sol-test", place="left",
+                              weapons=[], orders=[])
+        self.app.post('/leader/subordinates',
+                      data=dumps(soldier.to_dict()),
+                      content_type='application/json')
+
+        mission = Mission(author="sxxx0",
+                          requirement=Requirement(
+                              values=["zero", "random"],
+                              trigger={"timer": 0.4}
+                          ),
+                          trigger={"timer": 0.7},
+                          place="All",
+                          purpose="some purpose hash")
+        works = [Work(time="2016-11-01T12:00:0{0}".format(i),
+                      purpose=mission.get_id(),
+                      values=[{"type": "zero", "value": 0, "unit": "-"}])
+                 for i in range(2)]
+        for w in works:
+            response = self.app.post('/leader/subordinates/sxxx0/work',
+                                     data=dumps(w.to_dict()),
+                                     content_type='application/json',
+                                     query_string={"purpose": w.purpose})
+            self.assertEqual(response.status_code, 200)
+        response = self.app.post('/leader/subordinates/sxxx0/work',
+                                 data=dumps([1, 2]),
+                                 content_type='application/json',
+                                 query_string={"purpose": mission.get_id()})
+        self.assertEqual(response.status_code, 400)
+        # 壊れたworkや不正なworkを埋め込めばreport全体が不正になる
+        invalid = ['{"place": }',
+                   dumps({"purpose": mission.get_id(), "values": []}),
+                   dumps(dict(works[0].to_dict(), purpose="other"))]
+        for data in invalid:
+            response = self.app.post(
+                '/leader/subordinates/sxxx0/work',
+                data=data,
+                content_type='application/json',
+                query_string={"purpose": mission.get_id()})
+            self.assertEqual(response.status_code, 400)
+
+        with patch("utils.rest.post", side_effect=post_report) as m:
+            self.leader_obj.accept_mission(mission)
+            time.sleep(1)
+            self.assertEqual(m.call_count, 1)
+
+            mimetype, body = m.call_args[1]["encoded"]
+            self.assertEqual(mimetype, wire.JSON)
+            actual = wire.decode(body, mimetype)
+            self.assertEqual(actual["purpose"], "some purpose hash")
+            self.assertEqual(len(actual["values"]), 2)
+            for w in works:
+                expected = w.to_dict()
+                expected["place"] = "left"
+                self.assertIn(expected, actual["values"])
+
+        self.assertEqual(self.leader_obj.raw_work_buffers, {})
+        self.leader_obj.superior_ep = ""  # shutdownでDELETEを送信するのを阻止
+
 
 if __name__ == "__main__":
     unittest.main()
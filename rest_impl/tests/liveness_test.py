@@ -0,0 +1,55 @@
+import unittest
+from utils.liveness import LivenessTracker
+
+
+class LivenessTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.expired = []
+        self.tracker = LivenessTracker(10, self.expired.extend, tick=1,
+                                       clock=lambda: self.now,
+                                       background=False)
+
+    def test_expire(self):
+        self.tracker.touch("s0")
+        self.tracker.touch("s1")
+        self.now = 5
+        self.tracker.touch("s1")
+        self.assertEqual(self.tracker.expire(9), [])
+
+        # 最後のheartbeatからtimeout秒経ったものだけ期限切れになる
+        self.assertEqual(self.tracker.expire(11), ["s0"])
+        self.assertNotIn("s0", self.tracker)
+        self.assertIn("s1", self.tracker)
+        self.assertEqual(self.tracker.expire(14), [])
+        self.assertEqual(self.tracker.expire(16), ["s1"])
+        self.assertEqual(self.expired, ["s0", "s1"])
+        self.assertEqual(len(self.tracker), 0)
+
+    def test_forget(self):
+        self.tracker.touch("s0")
+        self.tracker.forget("s0")
+        self.assertEqual(self.tracker.expire(20), [])
+
+        # 削除後に再度登録されれば，新しい時刻から見張る
+        self.now = 20
+        self.tracker.touch("s0")
+        self.assertEqual(self.tracker.expire(25), [])
+        self.assertEqual(self.tracker.expire(31), ["s0"])
+
+    def test_batch_expire(self):
+        for i in range(10000):
+            self.tracker.touch("s{0}".format(i))
+        self.now = 3
+        for i in range(0, 10000, 2):
+            self.tracker.touch("s{0}".format(i))
+        # 長時間処理されなくても1周分の処理でまとめて期限切れにする
+        expired = self.tracker.expire(12)
+        self.assertEqual(len(expired), 5000)
+        self.assertTrue(all(int(sid[1:]) % 2 == 1 for sid in expired))
+        self.assertEqual(len(self.tracker.expire(1000)), 5000)
+
+
+if __name__ == "__main__":
+    unittest.main()
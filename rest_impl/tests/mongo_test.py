@@ -0,0 +1,66 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from utils.mongo import MongoRegistry, parse_uri
+
+
+class MongoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+        def factory(host):
+            client = MagicMock(name=host)
+            self.created.append(host)
+            return client
+        self.registry = MongoRegistry(idle_timeout=60,
+                                      client_factory=factory)
+
+    def test_parse_uri(self):
+        self.assertEqual(parse_uri("mongodb://localhost:27017/troops/values"),
+                         ("localhost:27017", "troops", "values"))
+        self.assertIsNone(parse_uri("mongoserv"))
+
+    def test_share_client(self):
+        a = self.registry.acquire("host-a")
+        b = self.registry.acquire("host-a")
+        c = self.registry.acquire("host-b")
+        self.assertIs(a, b)
+        self.assertIsNot(a, c)
+        self.assertEqual(self.created, ["host-a", "host-b"])
+        self.assertEqual(self.registry.stats(), {"host-a": 2, "host-b": 1})
+
+    def test_idle_eviction(self):
+        with patch("utils.mongo.time.monotonic", return_value=100):
+            client = self.registry.acquire("host-a")
+            self.registry.release("host-a")
+        # idle_timeout以内であれば同じクライアントを使い回す
+        with patch("utils.mongo.time.monotonic", return_value=130):
+            self.assertIs(self.registry.acquire("host-a"), client)
+            self.registry.release("host-a")
+        with patch("utils.mongo.time.monotonic", return_value=200):
+            self.registry.evict_idle()
+        client.close.assert_called_once_with()
+        self.assertEqual(self.registry.stats(), {})
+
+        # 参照が残っていれば閉じない
+        with patch("utils.mongo.time.monotonic", return_value=300):
+            client = self.registry.acquire("host-a")
+        with patch("utils.mongo.time.monotonic", return_value=1000):
+            self.registry.evict_idle()
+        client.close.assert_not_called()
+
+    def test_mongo_push_shares_client(self):
+        from model.commander import MongoPush
+        with patch("utils.mongo.registry", self.registry):
+            a = MongoPush("mongodb://localhost/troops/a")
+            b = MongoPush("mongodb://localhost/troops/b")
+            self.assertEqual(self.created, ["localhost"])
+            a.close()
+            a.close()
+            self.assertEqual(self.registry.stats(), {"localhost": 1})
+            b.close()
+            self.assertEqual(self.registry.stats(), {"localhost": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from urllib.parse import parse_qs
+from utils.notifier import Notifier
+
+
+class FakeSlack(object):
+    """
+    通知を受け取るローカルのサーバ
+    """
+
+    def __init__(self):
+        received = self.received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers['Content-Length'])
+                body = parse_qs(self.rfile.read(length).decode())
+                received.append((time.monotonic(), body['text'][0]))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait_for(self, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while len(self.received) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return [text for _, text in self.received]
+
+
+class NotifierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.slack = FakeSlack()
+
+    def tearDown(self):
+        self.slack.close()
+
+    def make(self, **kwargs):
+        notifier = Notifier(self.slack.url, lambda msg: {"text": msg},
+                            **kwargs)
+        self.addCleanup(notifier.stop)
+        return notifier
+
+    def test_notify(self):
+        notifier = self.make(window=1.0, min_interval=0)
+        start = time.monotonic()
+        self.assertTrue(notifier.notify("error A"))
+        self.assertTrue(notifier.notify("error B"))
+        # notifyは送信を待たない
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(sorted(self.slack.wait_for(2)),
+                         ["error A", "error B"])
+
+    def test_coalesce(self):
+        notifier = self.make(window=0.5, min_interval=0)
+        notifier.notify("error A")
+        self.slack.wait_for(1)
+        for _ in range(100):
+            notifier.notify("error A")
+        texts = self.slack.wait_for(2)
+        self.assertEqual(len(texts), 2)
+        self.assertTrue(texts[1].startswith("error A (100 occurrences"))
+        self.assertGreaterEqual(
+            self.slack.received[1][0] - self.slack.received[0][0], 0.45)
+        self.assertEqual(notifier.stats()["coalesced"], 99)
+
+    def test_rate_limit(self):
+        notifier = self.make(min_interval=0.2)
+        for i in range(3):
+            notifier.notify("error {0}".format(i))
+        self.assertEqual(len(self.slack.wait_for(3)), 3)
+        times = [t for t, _ in self.slack.received]
+        self.assertGreaterEqual(times[2] - times[0], 0.35)
+
+    def test_bounded(self):
+        notifier = self.make(max_pending=2, min_interval=10)
+        results = [notifier.notify("error {0}".format(i)) for i in range(5)]
+        # 1件目は送信済みか送信待ちで，残りは2件まで積める
+        self.assertIn(results.count(True), [2, 3])
+        self.assertEqual(notifier.stats()["dropped"], results.count(False))
+
+    def test_post_failure(self):
+        notifier = Notifier("http://127.0.0.1:1/", lambda msg: {"text": msg},
+                            min_interval=0)
+        self.addCleanup(notifier.stop)
+        notifier.notify("error A")
+        deadline = time.monotonic() + 5
+        while notifier.stats()["errors"] == 0 and \
+                time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(notifier.stats()["errors"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
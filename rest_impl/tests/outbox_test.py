@@ -0,0 +1,179 @@
+import shutil
+import tempfile
+import time
+import unittest
+from json import dumps
+from logging import getLogger, ERROR
+import requests
+import utils.wire as wire
+from model.outbox import Outbox, retryable
+from model.spool import Spool
+
+getLogger("model").setLevel(ERROR)
+
+
+def response(status, accepted=None, retry_after=None):
+    res = requests.Response()
+    res.status_code = status
+    body = {"_status": {"msg": "", "success": status == 200}}
+    if accepted is not None:
+        body["accepted"] = accepted
+    res._content = dumps(body).encode()
+    if retry_after is not None:
+        res.headers['Retry-After'] = str(retry_after)
+    return res
+
+
+class FakeCommander(object):
+    """
+    受け取ったreportを記録する送信関数
+    statusを変えれば上官が落ちている状態にできる
+    """
+
+    def __init__(self):
+        self.received = []
+        self.calls = 0
+        self.status = 200
+        self.accept = None  # 503のときに受理する数
+
+    def post(self, url, json=None, encoded=None, **kwargs):
+        self.calls += 1
+        if encoded is not None:
+            json = wire.decode(encoded[1], encoded[0])
+        reports = json["reports"] if "reports" in json else [json]
+        if self.status is None:
+            return None, requests.exceptions.ConnectionError("down")
+        if self.status != 200:
+            accepted = self.accept or 0
+            self.received.extend(r["n"] for r in reports[:accepted])
+            return response(self.status, self.accept, 0), "failed"
+        self.received.extend(r["n"] for r in reports)
+        return response(200), None
+
+    def wait_for(self, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while len(self.received) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.received
+
+
+def reports(*numbers):
+    return [{"n": n} for n in numbers]
+
+
+class OutboxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.commander = FakeCommander()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make(self, **kwargs):
+        kwargs.setdefault("base_delay", 0.05)
+        outbox = Outbox(self.commander.post, rand=lambda: 0.0, **kwargs)
+        self.addCleanup(outbox.stop)
+        return outbox
+
+    def test_retryable(self):
+        self.assertFalse(retryable(response(200), None))
+        self.assertTrue(retryable(None, "connection refused"))
+        self.assertTrue(retryable(response(503), "failed"))
+        self.assertTrue(retryable(response(429), "failed"))
+        self.assertFalse(retryable(response(400), "failed"))
+        self.assertFalse(retryable(response(404), "failed"))
+
+    def test_retry_in_order(self):
+        outbox = self.make(base_delay=0.2)
+        self.commander.status = None
+        self.assertFalse(outbox.send("url", reports(0)))
+        self.assertEqual(self.commander.calls, 1)
+
+        # 送信待ちがある間は直接送らずに後ろに積む
+        for i in range(1, 5):
+            self.assertFalse(outbox.send("url", reports(i)))
+        self.assertEqual(self.commander.calls, 1)
+        self.assertEqual(len(outbox), 5)
+
+        self.commander.status = 200
+        self.assertEqual(self.commander.wait_for(5), [0, 1, 2, 3, 4])
+        time.sleep(0.05)
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(outbox.stats()["resent"], 5)
+
+        # 復帰後は直接送る
+        self.assertTrue(outbox.send("url", reports(5)))
+        self.assertEqual(self.commander.received, [0, 1, 2, 3, 4, 5])
+
+    def test_backoff(self):
+        outbox = self.make(base_delay=1.0, max_delay=5.0)
+        delays = []
+        for _ in range(5):
+            start = time.monotonic()
+            outbox._backoff(None)
+            delays.append(round(outbox.next_retry - start, 1))
+        # rand=0なので間隔の半分
+        self.assertEqual(delays, [0.5, 1.0, 2.0, 2.5, 2.5])
+
+        # Retry-Afterより早くはしない
+        outbox.failures = 0
+        start = time.monotonic()
+        outbox._backoff(response(503, retry_after=10))
+        self.assertEqual(round(outbox.next_retry - start, 1), 10.0)
+
+    def test_partial_accept(self):
+        outbox = self.make()
+        self.commander.status = 503
+        self.commander.accept = 1
+        self.assertFalse(outbox.send("url", reports(0, 1, 2)))
+        self.assertEqual(self.commander.received, [0])
+
+        # 受理された分は送り直さない
+        time.sleep(0.1)
+        self.commander.status = 200
+        self.assertEqual(self.commander.wait_for(3), [0, 1, 2])
+
+    def test_rejected(self):
+        outbox = self.make()
+        self.commander.status = 400
+        self.assertFalse(outbox.send("url", reports(0)))
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(outbox.stats()["rejected"], 1)
+
+    def test_memory_budget(self):
+        outbox = self.make(base_delay=10, max_reports=3)
+        self.commander.status = None
+        for i in range(5):
+            outbox.send("url", reports(i))
+        stats = outbox.stats()
+        self.assertEqual(stats["pending"], 3)
+        self.assertEqual(stats["dropped"], 2)
+        self.assertEqual([r[0]["n"] for _, r in outbox.queue], [2, 3, 4])
+
+    def test_encoded(self):
+        outbox = self.make(base_delay=10)
+        self.commander.status = None
+        body = wire.encode({"reports": reports(0, 1)})
+        self.assertFalse(outbox.send("url", encoded=(wire.JSON, body)))
+        self.assertEqual(list(outbox.queue), [("url", reports(0, 1))])
+
+    def test_spool(self):
+        spool = Spool(self.directory, sync=False)
+        outbox = self.make(spool=spool, base_delay=10)
+        self.commander.status = None
+        for i in range(3):
+            outbox.send("url", reports(i))
+        self.assertEqual(len(outbox), 3)
+        outbox.stop()
+
+        # 再起動後に前回送れなかった分から順に送る
+        self.commander.status = 200
+        outbox = self.make(spool=Spool(self.directory, sync=False))
+        self.assertEqual(self.commander.wait_for(3), [0, 1, 2])
+        time.sleep(0.05)
+        self.assertEqual(len(outbox), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
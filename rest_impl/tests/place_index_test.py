@@ -0,0 +1,77 @@
+import unittest
+from utils.place_index import PlaceIndex, resolve_place
+
+
+class PlaceIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PlaceIndex()
+        for sid, place in [("s0", "Floor-1"), ("s1", "Floor-3"),
+                           ("s2", "Floor-3"), ("s3", "Floor-30"),
+                           ("s4", "S101")]:
+            self.index.add(sid, place)
+
+    def test_resolve_place(self):
+        self.assertEqual(resolve_place("Floor-3", "Floor-3.west-side.door"),
+                         "west-side.door")
+        self.assertEqual(resolve_place("Floor-3", "Floor-3"), "All")
+        self.assertEqual(resolve_place("Floor-3", "All"), "All")
+        self.assertEqual(resolve_place("Floor-3", "Floor-*.door"), "door")
+        self.assertIsNone(resolve_place("Floor-30", "Floor-3.door"))
+        # 階層を持つplaceの部下は上位の階層で対象にできる
+        self.assertEqual(resolve_place("room1.desk2", "room1"), "All")
+        self.assertEqual(resolve_place("room1.desk2", "room1.*"), "All")
+        self.assertEqual(resolve_place("room1.desk2", "room1.All.left"),
+                         "left")
+        self.assertEqual(resolve_place("room1.desk2", "room*.desk2.left"),
+                         "left")
+        self.assertIsNone(resolve_place("room1.desk2", "room1.desk3"))
+        # globは要素をまたがない
+        self.assertIsNone(resolve_place("room1.desk2", "room1.d*3"))
+
+    def test_match(self):
+        self.assertEqual(self.index.match("All"),
+                         {"s0", "s1", "s2", "s3", "s4"})
+        self.assertEqual(self.index.match("Floor-3"), {"s1", "s2"})
+        self.assertEqual(self.index.match("Floor-3*"), {"s1", "s2", "s3"})
+        self.assertEqual(self.index.match("Floor-?"), {"s0", "s1", "s2"})
+        self.assertEqual(self.index.match("*1*"), {"s0", "s4"})
+        self.assertEqual(self.index.match("Floor-2"), set())
+        self.assertEqual(self.index.match("Floor-3.west-side"), {"s1", "s2"})
+        self.assertEqual(self.index.match("Floor-*.door"),
+                         {"s0", "s1", "s2", "s3"})
+
+    def test_match_prefix(self):
+        for sid, place in [("s5", "room1.desk1"), ("s6", "room1.desk2"),
+                           ("s7", "room1"), ("s8", "room10.desk2")]:
+            self.index.add(sid, place)
+        self.assertEqual(self.index.match("room1"), {"s5", "s6", "s7"})
+        self.assertEqual(self.index.match("room1.*"), {"s5", "s6", "s7"})
+        self.assertEqual(self.index.match("room1.desk2"), {"s6", "s7"})
+        self.assertEqual(self.index.match("room1.desk2.left"), {"s6", "s7"})
+        self.assertEqual(self.index.match("room*.desk2"),
+                         {"s6", "s7", "s8"})
+        self.assertEqual(self.index.match("All.desk1"), {"s5", "s7"} |
+                         {"s0", "s1", "s2", "s3", "s4"})
+
+        # 索引は全ての部下を照合した場合と同じ結果を返す
+        patterns = ["room1", "room1.All", "room?.desk*", "*.desk2",
+                    "Floor-3.x", "room10", "S1*", "room1.desk"]
+        for pattern in patterns:
+            expected = {sid for sid, place in self.index.place_of.items()
+                        if resolve_place(place, pattern) is not None}
+            self.assertEqual(self.index.match(pattern), expected, pattern)
+
+    def test_update(self):
+        self.index.add("s1", "Floor-2")
+        self.index.remove("s2")
+        self.index.remove("unknown")
+        self.assertEqual(self.index.match("Floor-3"), set())
+        self.assertEqual(self.index.match("Floor-2"), {"s1"})
+        self.assertEqual(self.index.sorted_places,
+                         ["Floor-1", "Floor-2", "Floor-30", "S101"])
+        self.assertEqual(len(self.index), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
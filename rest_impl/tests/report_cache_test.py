@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import patch
+from model import Report
+from model.report_cache import ReportCache, parse_time
+
+
+def make_report(i, purpose="p0", place="desk"):
+    return Report(time="2016-11-01T12:00:{0:02d}+00:00".format(i),
+                  place=place,
+                  purpose=purpose,
+                  values=[])
+
+
+class ReportCacheTestCase(unittest.TestCase):
+
+    def test_max_count(self):
+        cache = ReportCache(max_count=3, max_age=None)
+        reports = [make_report(i, purpose="p{0}".format(i % 2))
+                   for i in range(5)]
+        for r in reports:
+            cache.append(r)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.query(), reports[:1:-1])
+        self.assertEqual(cache.query(purpose="p0"), [reports[4], reports[2]])
+        # 捨てたreportは索引からも消える
+        self.assertEqual(sorted(cache.by_purpose), ["p0", "p1"])
+        self.assertEqual(len(cache.by_purpose["p0"]), 2)
+
+    def test_max_age(self):
+        cache = ReportCache(max_count=10, max_age=60)
+        with patch("model.report_cache.time.monotonic", return_value=100):
+            cache.append(make_report(0))
+        with patch("model.report_cache.time.monotonic", return_value=150):
+            cache.append(make_report(1))
+        with patch("model.report_cache.time.monotonic", return_value=170):
+            self.assertEqual([r.time for r in cache.query()],
+                             ["2016-11-01T12:00:01+00:00"])
+        self.assertEqual(cache.by_place["desk"][0][2].time,
+                         "2016-11-01T12:00:01+00:00")
+
+    def test_query(self):
+        cache = ReportCache(max_count=10, max_age=None)
+        reports = [make_report(i, purpose="p{0}".format(i % 2),
+                               place="pl{0}".format(i % 3))
+                   for i in range(6)]
+        for r in reports:
+            cache.append(r)
+        self.assertEqual(cache.query(purpose="p0", place="pl0"),
+                         [reports[0]])
+        self.assertEqual(cache.query(place="pl2"), [reports[5], reports[2]])
+        self.assertEqual(cache.query(purpose="unknown"), [])
+        self.assertEqual(
+            cache.query(start=parse_time("2016-11-01T12:00:02Z"),
+                        end=parse_time("2016-11-01T12:00:04Z")),
+            [reports[4], reports[3], reports[2]])
+        # タイムゾーンの無い時刻はUTCとみなす
+        self.assertEqual(
+            cache.query(start=parse_time("2016-11-01T12:00:04"), limit=1),
+            [reports[5]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,20 @@ expr "${0}" : "/.*" > /dev/null || cwd=`(cd "${cwd}" && pwd)`
 cd $cwd/..
 
 source venv/bin/activate
+echo -e "\n>> test info_obj unit" && python -m tests.info_obj_test && \
+echo -e "\n>> test ingest unit" && python -m tests.ingest_test && \
+echo -e "\n>> test liveness unit" && python -m tests.liveness_test && \
+echo -e "\n>> test scheduler unit" && python -m tests.scheduler_test && \
+echo -e "\n>> test mongo unit" && python -m tests.mongo_test && \
+echo -e "\n>> test place_index unit" && python -m tests.place_index_test && \
+echo -e "\n>> test notifier unit" && python -m tests.notifier_test && \
+echo -e "\n>> test report_cache unit" && python -m tests.report_cache_test && \
+echo -e "\n>> test isotime unit" && python -m tests.isotime_test && \
+echo -e "\n>> test compress unit" && python -m tests.compress_test && \
+echo -e "\n>> test aggregation unit" && python -m tests.aggregation_test && \
+echo -e "\n>> test edge_aggregation unit" && python -m tests.edge_aggregation_test && \
+echo -e "\n>> test spool unit" && python -m tests.spool_test && \
+echo -e "\n>> test outbox unit" && python -m tests.outbox_test && \
 echo -e "\n>> test recruiter unit" && python -m tests.recruiter_test && \
 echo -e "\n>> test commander unit" && python -m tests.commander_test && \
 echo -e "\n>> test leader unit" && python -m tests.leader_test && \
@@ -0,0 +1,74 @@
+import unittest
+from utils.scheduler import Scheduler
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.fired = []
+        self.scheduler = Scheduler(self.fired.append, slack=0.1,
+                                   clock=lambda: self.now, background=False)
+
+    def test_fire(self):
+        self.scheduler.add("m0", 10)
+        self.scheduler.add("m1", 15)
+        self.assertEqual(self.scheduler.next_due(), 10)
+        self.assertEqual(self.scheduler.fire(9.9), [])
+        self.assertEqual(self.scheduler.fire(10), [["m0"]])
+        self.assertEqual(self.scheduler.fire(15), [["m1"]])
+        self.assertEqual(self.scheduler.fire(20), [["m0"]])
+        self.assertEqual(self.scheduler.fire(30), [["m0", "m1"]])
+        self.assertEqual(self.fired, [["m0"], ["m1"], ["m0"], ["m0", "m1"]])
+
+    def test_coalesce(self):
+        self.scheduler.add("m0", 10)
+        self.now = 0.05
+        self.scheduler.add("m1", 10)
+        self.scheduler.add("m2", 5)
+        # 発火時刻の差がslack以内のものはまとめて発火する
+        self.assertEqual(self.scheduler.fire(5.05), [["m2"]])
+        self.assertEqual(self.scheduler.fire(10), [["m0", "m1", "m2"]])
+        self.assertEqual(self.scheduler.fire(15.05), [["m2"]])
+        self.assertEqual(self.scheduler.fire(20.05), [["m0", "m1", "m2"]])
+
+    def test_remove_and_replace(self):
+        self.scheduler.add("m0", 10)
+        self.scheduler.add("m1", 10)
+        self.scheduler.remove("m0")
+        self.scheduler.remove("unknown")
+        self.assertNotIn("m0", self.scheduler)
+        self.now = 5
+        self.scheduler.add("m1", 20)
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.fire(20), [])
+        self.assertEqual(self.scheduler.fire(25), [["m1"]])
+
+        # 置き換えを繰り返してもヒープは大きくなり続けない
+        for i in range(1000):
+            self.scheduler.add("m1", 10 + i)
+        self.assertLess(len(self.scheduler.heap), 100)
+
+    def test_skip_missed(self):
+        self.scheduler.add("m0", 10)
+        # 長く止まっていても1回だけ発火し，周期はずらさない
+        self.assertEqual(self.scheduler.fire(55), [["m0"]])
+        self.assertEqual(self.scheduler.next_due(), 60)
+
+    def test_invalid_interval(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.add("m0", 0)
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_background(self):
+        import threading
+        import time
+        fired = threading.Event()
+        scheduler = Scheduler(lambda keys: fired.set())
+        self.addCleanup(scheduler.stop)
+        scheduler.add("m0", 0.1)
+        self.assertTrue(fired.wait(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from model.spool import Spool
+
+
+class SpoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def segment_files(self):
+        return sorted(n for n in os.listdir(self.directory)
+                      if n.startswith("spool-"))
+
+    def test_replay_in_order(self):
+        spool = Spool(self.directory, segment_size=100, sync=False)
+        for i in range(5):
+            spool.append("mongodb://a/db/col", [{"value": i}])
+        self.assertEqual(len(spool), 5)
+        self.assertGreater(len(self.segment_files()), 1)
+
+        written = []
+        self.assertTrue(spool.replay(
+            lambda dest, docs: written.append((dest, docs))))
+        self.assertEqual(written, [("mongodb://a/db/col", [{"value": i}])
+                                   for i in range(5)])
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(self.segment_files(), [])
+
+        # 再送後も追記できる
+        spool.append("mongodb://a/db/col", [{"value": 5}])
+        self.assertEqual(len(spool), 1)
+
+    def test_resume_after_failure(self):
+        spool = Spool(self.directory, segment_size=100, sync=False)
+        for i in range(4):
+            spool.append("mongodb://a/db/col", [{"value": i}])
+
+        written = []
+
+        def write_until_two(dest, docs):
+            if len(written) == 2:
+                raise ConnectionError("down")
+            written.append(docs[0]["value"])
+        self.assertFalse(spool.replay(write_until_two))
+        self.assertEqual(written, [0, 1])
+
+        # 再送済みの位置はファイルに残り，開き直しても続きから再送する
+        spool = Spool(self.directory, segment_size=100, sync=False)
+        self.assertEqual(len(spool), 2)
+        self.assertTrue(spool.replay(
+            lambda dest, docs: written.append(docs[0]["value"])))
+        self.assertEqual(written, [0, 1, 2, 3])
+
+    def test_truncated_record(self):
+        spool = Spool(self.directory, sync=False)
+        spool.append("mongodb://a/db/col", [{"value": 0}])
+        spool.append("mongodb://a/db/col", [{"value": 1}])
+        spool._close_writer()
+        path = os.path.join(self.directory, self.segment_files()[-1])
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 3)
+
+        spool = Spool(self.directory, sync=False)
+        self.assertEqual(len(spool), 1)
+        spool.append("mongodb://a/db/col", [{"value": 2}])
+        written = []
+        spool.replay(lambda dest, docs: written.append(docs[0]["value"]))
+        self.assertEqual(written, [0, 2])
+
+    def test_broken_tail_record(self):
+        spool = Spool(self.directory, sync=False)
+        spool.append("mongodb://a/db/col", [{"value": 0}])
+        spool.append("mongodb://a/db/col", [{"value": 1}])
+        path = os.path.join(self.directory, self.segment_files()[-1])
+        with open(path, "r+b") as f:
+            f.seek(-3, os.SEEK_END)
+            f.write(b"xxx")
+
+        # 書き込み中のセグメントの壊れたレコードで止まらずに読み切る
+        written = []
+        thread = threading.Thread(target=spool.replay, args=(
+            lambda dest, docs: written.append(docs[0]["value"]),))
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(written, [0])
+        self.assertEqual(spool.stats()["dropped_records"], 1)
+        self.assertEqual(len(spool), 0)
+
+        spool.append("mongodb://a/db/col", [{"value": 2}])
+        spool.replay(lambda dest, docs: written.append(docs[0]["value"]))
+        self.assertEqual(written, [0, 2])
+
+    def test_failed_append(self):
+        spool = Spool(self.directory, sync=True)
+        spool.append("mongodb://a/db/col", [{"value": 0}])
+        with patch("os.fsync", side_effect=OSError(28, "No space left")):
+            with self.assertRaises(OSError):
+                spool.append("mongodb://a/db/col", [{"value": 1}])
+
+        # 失敗したレコードの断片は残らず，後の追記は読める
+        spool.append("mongodb://a/db/col", [{"value": 2}])
+        self.assertEqual(len(spool), 2)
+        written = []
+        self.assertTrue(spool.replay(
+            lambda dest, docs: written.append(docs[0]["value"])))
+        self.assertEqual(written, [0, 2])
+
+    def test_bytes_value(self):
+        spool = Spool(self.directory, sync=False)
+        documents = [{"value": b"\x00\xff", "nested": {"raw": b"abc"}}]
+        spool.append("mongodb://a/db/col", documents)
+
+        spool = Spool(self.directory, sync=False)
+        written = []
+        spool.replay(lambda dest, docs: written.extend(docs))
+        self.assertEqual(written, documents)
+
+    def test_disk_budget(self):
+        spool = Spool(self.directory, segment_size=100, max_bytes=300,
+                      sync=False)
+        for i in range(20):
+            spool.append("mongodb://a/db/col", [{"value": i}])
+        stats = spool.stats()
+        self.assertLessEqual(stats["bytes"], 300)
+        self.assertGreater(stats["dropped_segments"], 0)
+        self.assertEqual(stats["dropped_records"] + stats["pending"], 20)
+
+        # 古いものから捨てられ，残りは順に再送される
+        written = []
+        spool.replay(lambda dest, docs: written.append(docs[0]["value"]))
+        self.assertEqual(written, list(range(20 - len(written), 20)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,9 @@ from model import CommanderInfo, LeaderInfo, SoldierInfo, \
     Campaign, Mission, Order
 import utils.rest as rest
 
+# 部下の一覧を取得する際の1ページあたりの件数
+PAGE_SIZE = 100
+
 
 def generate_data(rec_addr):
     url = "{0}commanders".format(rec_addr)
@@ -24,6 +27,26 @@ def generate_data(rec_addr):
     return [gen_commander_data(addr) for addr in com_addr_list]
 
 
+def get_all_pages(url, key):
+    """
+    ページ分割された一覧を全ページ取得する
+    :param str url: 一覧のURL
+    :param str key: 一覧を格納しているキー
+    :return: (一覧, エラー)
+    """
+    result = []
+    params = {"limit": PAGE_SIZE}
+    while True:
+        res, err = rest.get(url, params=params)
+        if err is not None:
+            return None, err
+        body = res.json()
+        result.extend(body[key])
+        if body.get("next") is None:
+            return result, None
+        params["after"] = body["next"]
+
+
 def gen_commander_data(com_addr):
     res, err = rest.get(com_addr)
     if err is not None:
@@ -31,10 +54,9 @@ def gen_commander_data(com_addr):
     info = CommanderInfo.make(res.json()["info"])
 
     url = "{0}subordinates".format(com_addr)
-    res, err = rest.get(url)
+    subs, err = get_all_pages(url, "subordinates")
     if err is not None:
         return {}
-    subs = res.json()["subordinates"]
     sub_addr_list = [sub["endpoint"] for sub in subs]
 
     leaders = [gen_leader_data(addr) for addr in sub_addr_list]
@@ -70,10 +92,9 @@ def gen_leader_data(lea_addr):
     info = LeaderInfo.make(res.json()["info"])
 
     url = "{0}subordinates".format(lea_addr)
-    res, err = rest.get(url)
+    subs, err = get_all_pages(url, "subordinates")
     if err is not None:
         return {}
-    subs = res.json()["subordinates"]
     sub_info_list = [SoldierInfo.make(s) for s in subs]
 
     return {
@@ -1,10 +1,16 @@
 import pymongo
 import datetime
+import utils.mongo as mongo
+
+MONGO_HOST = "192.168.0.21"
+# MONGO_HOST = "localhost"
 
 
 def get_collection(col):
-    return pymongo.MongoClient("192.168.0.21")["troops"][col]
-    # return pymongo.MongoClient("localhost")["troops"]["values"]
+    """
+    共有のクライアントからコレクションを借りる．withで使う
+    """
+    return mongo.collection(MONGO_HOST, "troops", col)
 
 
 def get_values(purpose, place, type, max_count, days=1, hours=0, minutes=0):
@@ -12,7 +18,6 @@ def get_values(purpose, place, type, max_count, days=1, hours=0, minutes=0):
     limit_time = now - datetime.timedelta(
         days=days, hours=hours, minutes=minutes)
 
-    col = get_collection(purpose.replace("sensing-", ""))
     s_purpose = {"purpose": purpose}
     s_place = {"place": place}
     s_type = {"data.type": type}
@@ -24,8 +29,10 @@ def get_values(purpose, place, type, max_count, days=1, hours=0, minutes=0):
     search.update(s_time)
 
     filter = {"_id": 0}
-    res = col.find(search, projection=filter).sort("time", pymongo.DESCENDING)
-    res_list = list(res)
+    with get_collection(purpose.replace("sensing-", "")) as col:
+        res = col.find(search, projection=filter).sort("time",
+                                                       pymongo.DESCENDING)
+        res_list = list(res)
     if len(res_list) > max_count:
         res_list = res_list[::len(res_list) // max_count + 1]
 
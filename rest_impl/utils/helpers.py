@@ -1,7 +1,10 @@
+import bisect
+import json
 import logging
+import utils.wire as wire
 from utils import logger
 from functools import wraps
-from flask import jsonify, request
+from flask import jsonify, request, g, make_response, Response
 from werkzeug.exceptions import BadRequest
 
 
@@ -48,10 +51,47 @@ def json_input(f):
     """
     PUT/POSTでjsonを受け取るAPI用のデコレータ
     Content-Typeのチェックとjsonのデコードチェックを行う
+    Content-Typeがapplication/x-msgpackであればmsgpackとしてデコードする
+    Content-Encodingが指定されていれば展開してからデコードする
+    デコード結果はrequest_body()で取得する
     """
     @wraps(f)
     def check_json(*args, **kwargs):
         if request.method == 'PUT' or request.method == 'POST':
+            coding = request.headers.get('Content-Encoding', wire.IDENTITY)
+            coding = coding.strip().lower()
+            if not wire.supports_coding(coding):
+                # 扱えるものをAccept-Encodingで返し，Content-Typeによる
+                # 415と区別できるようにする
+                response = jsonify(result='failed',
+                                   msg='unsupported content-encoding: {0}'.
+                                   format(coding))
+                response.headers['Accept-Encoding'] = wire.accept_encoding()
+                return response, 415
+            if request.mimetype == wire.MSGPACK:
+                if not wire.supports(wire.MSGPACK):
+                    return jsonify(result='failed',
+                                   msg='application/json required'), 415
+                try:
+                    data = wire.decompress(request.get_data(), coding)
+                    g.request_body = wire.decode(data, wire.MSGPACK)
+                except ValueError:
+                    return jsonify(result='failed',
+                                   msg="param couldn't decode to msgpack"), 400
+                return f(*args, **kwargs)
+            if coding != wire.IDENTITY:
+                # request.jsonは圧縮されたボディを扱えないので自前でデコードする
+                if request.mimetype != wire.JSON:
+                    return jsonify(result='failed',
+                                   msg='application/json required'), 406
+                try:
+                    data = wire.decompress(request.get_data(), coding)
+                    g.request_body = wire.decode(data, wire.JSON)
+                except ValueError:
+                    return jsonify(result='failed',
+                                   msg="param couldn't decode to json"), 400
+                return f(*args, **kwargs)
+
             # request.json
             #   - bad content-type -> return None
             #   - can't decode -> raise BadRequest
@@ -63,10 +103,73 @@ def json_input(f):
             except BadRequest:
                 return jsonify(result='failed',
                                msg="param couldn't decode to json"), 400
+            g.request_body = request.json
         return f(*args, **kwargs)
     return check_json
 
 
+def request_body():
+    """
+    json_inputでデコードされたリクエストボディを返す
+    """
+    return g.request_body
+
+
+def encoded_response(**kwargs):
+    """
+    jsonifyの代わりに，リクエストのAcceptに応じてjsonかmsgpackで応答する
+    """
+    mimetype = request.accept_mimetypes.best_match([wire.JSON, wire.MSGPACK],
+                                                   default=wire.JSON)
+    if mimetype != wire.MSGPACK or not wire.supports(wire.MSGPACK):
+        return jsonify(**kwargs)
+    response = make_response(wire.encode(kwargs, wire.MSGPACK))
+    response.mimetype = wire.MSGPACK
+    return response
+
+
+def paginated_response(key, items):
+    """
+    IDをキーとするdictの値の一覧を，to_dictしながら逐次（chunked）返す
+    クエリパラメータのlimitで件数を指定すると，ID順にその件数だけ返し，
+    続きを取得するためのIDをnextに入れる（最後であればnull）
+    続きはafterにnextの値を指定して取得する
+    :param str key: 一覧を格納するキー
+    :param Dict items: IDと値のdict
+    :return: レスポンス
+    """
+    after = request.args.get('after')
+    limit = request.args.get('limit')
+    if limit is not None and (not limit.isdigit() or int(limit) == 0):
+        return jsonify(_status=ResponseStatus.make_error(
+            "limit must be a positive integer"
+        )), 400
+
+    # 値は送信する時点で取り出すので，IDの一覧だけを確定させておく
+    if limit is None and after is None:
+        ids = list(items.keys())
+    else:
+        ids = sorted(items.keys())
+    if after is not None:
+        ids = ids[bisect.bisect_right(ids, after):]
+    head = {"_status": ResponseStatus.Success}
+    if limit is not None:
+        head["next"] = ids[int(limit) - 1] if len(ids) > int(limit) else None
+        ids = ids[:int(limit)]
+
+    def generate():
+        yield json.dumps(head)[:-1] + ', {0}: ['.format(json.dumps(key))
+        sep = ''
+        for i in ids:
+            value = items.get(i)
+            if value is None:  # 送信中に削除された
+                continue
+            yield sep + json.dumps(value.to_dict())
+            sep = ', '
+        yield ']}\n'
+    return Response(generate(), mimetype=wire.JSON)
+
+
 class DelegateHandler(logging.Handler):
     def __init__(self, func):
         super(DelegateHandler, self).__init__()
@@ -0,0 +1,75 @@
+"""
+ISO8601の時刻文字列の変換
+soldierが送るdatetime.isoformat()の形式
+（e.g. "2016-11-01T12:00:00.123456+09:00"）は正規表現で直接変換し，
+それ以外の形式はdateutilで変換する
+
+    parse("2016-11-01T12:00:00+09:00")
+    parser = CachedParser()  # 同じ文字列は一度だけ変換する
+    parser("2016-11-01T12:00:00+09:00")
+"""
+import datetime
+import re
+
+_ISO_PATTERN = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?"
+    r"(Z|[+-]\d{2}:?\d{2})?$")
+_timezones = {"Z": datetime.timezone.utc}
+
+
+def _timezone(offset):
+    tz = _timezones.get(offset)
+    if tz is None:
+        sign = -1 if offset[0] == "-" else 1
+        minutes = int(offset[1:3]) * 60 + int(offset[-2:])
+        tz = datetime.timezone(datetime.timedelta(minutes=sign * minutes))
+        if minutes == 0:
+            tz = datetime.timezone.utc
+        _timezones[offset] = tz
+    return tz
+
+
+def parse(value):
+    """
+    ISO8601の文字列をdatetimeに変換する．タイムゾーンが無ければnaiveのまま
+    :param str value: 時刻の文字列
+    :return datetime: 変換結果
+    :raises ValueError: 変換できない文字列
+    """
+    match = _ISO_PATTERN.match(value)
+    if match is not None:
+        year, month, day, hour, minute, second, fraction, offset = \
+            match.groups()
+        try:
+            return datetime.datetime(
+                int(year), int(month), int(day), int(hour), int(minute),
+                int(second) if second is not None else 0,
+                int(fraction.ljust(6, "0")) if fraction is not None else 0,
+                _timezone(offset) if offset is not None else None)
+        except ValueError:
+            pass  # 日付の範囲外などはdateutilの判断に任せる
+    import dateutil.parser
+    try:
+        return dateutil.parser.parse(value)
+    except OverflowError as e:
+        raise ValueError(str(e))
+
+
+class CachedParser(object):
+    """
+    変換結果を文字列ごとに保持するparse
+    同じWorkの値は全て同じ時刻の文字列を持つので，reportの処理の間だけ
+    生成して使う．datetimeは変更できないので結果はそのまま共有する
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.cache = {}
+
+    def __call__(self, value):
+        parsed = self.cache.get(value)
+        if parsed is None:
+            if len(self.cache) >= self.max_size:
+                self.cache.clear()
+            parsed = self.cache[value] = parse(value)
+        return parsed
@@ -0,0 +1,124 @@
+"""
+部下の生存確認用のタイマーホイール
+部下ごとにスレッドを立てる代わりに，1つのスレッドで全ての部下の
+最終heartbeat時刻を見張り，timeout秒途絶えた部下をまとめて通知する
+"""
+import math
+import time
+from threading import Condition, Thread
+from typing import Callable, Dict, List
+from utils import logger
+
+
+class LivenessTracker(object):
+    """
+    tick秒ごとに1つ進むスロットの輪に部下のIDを登録しておき，
+    スロットに達したIDのうち期限切れのものをon_expireに渡す
+    heartbeatの受信（touch）は最終受信時刻を更新するだけで，
+    まだ期限切れでないIDはスロットに達したときに本来の期限のスロットに移す
+    """
+
+    def __init__(self, timeout: float, on_expire: Callable, tick=1.0,
+                 clock=time.monotonic, background=True):
+        """
+        :param float timeout: heartbeatが途絶えてから期限切れとするまでの秒数
+        :param Callable on_expire: 期限切れになったIDのリストを受け取る関数
+        :param float tick: スロットの間隔 [sec]
+        :param Callable clock: 現在時刻を返す関数
+        :param bool background: 最初のtouchで見張りのスレッドを起動する
+        """
+        self.timeout = timeout
+        self.on_expire = on_expire
+        self.tick = tick
+        self.clock = clock
+        self.background = background
+
+        # timeout後の期限がホイール1周以内に収まるようにする
+        self.slots = [set() for _ in range(int(timeout / tick) + 2)]
+        self.last_seen = {}  # type: Dict[str, float]
+        self.cursor = self._tick_of(clock())
+        self.cond = Condition()
+        self.thread = None
+        self.stopped = False
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def __contains__(self, sid):
+        return sid in self.last_seen
+
+    def _tick_of(self, t):
+        return int(math.floor(t / self.tick))
+
+    def _schedule(self, sid, deadline):
+        index = max(int(math.ceil(deadline / self.tick)), self.cursor + 1)
+        self.slots[index % len(self.slots)].add(sid)
+
+    def touch(self, sid):
+        """
+        heartbeatを受信したことを記録する．未登録のIDであれば登録する
+        :param str sid: 部下のID
+        """
+        with self.cond:
+            now = self.clock()
+            if sid not in self.last_seen:
+                self._schedule(sid, now + self.timeout)
+            self.last_seen[sid] = now
+            if self.thread is None and self.background:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def forget(self, sid):
+        """
+        見張りを止める．スロットからは期限を迎えたときに取り除く
+        :param str sid: 部下のID
+        """
+        with self.cond:
+            self.last_seen.pop(sid, None)
+
+    def expire(self, now=None) -> List[str]:
+        """
+        現在時刻までのスロットを処理し，期限切れのIDをon_expireに渡す
+        :param float now: 現在時刻．Noneであればclockから取得する
+        :return List[str]: 期限切れになったID
+        """
+        expired = []
+        with self.cond:
+            if now is None:
+                now = self.clock()
+            target = self._tick_of(now)
+            # 長く止まっていた場合もホイールを1周すれば全てのIDを見られる
+            self.cursor = max(self.cursor, target - len(self.slots))
+            while self.cursor < target:
+                self.cursor += 1
+                slot = self.slots[self.cursor % len(self.slots)]
+                due = list(slot)
+                slot.clear()
+                for sid in due:
+                    seen = self.last_seen.get(sid)
+                    if seen is None:  # forget済み
+                        continue
+                    if now - seen >= self.timeout:
+                        del self.last_seen[sid]
+                        expired.append(sid)
+                    else:
+                        self._schedule(sid, seen + self.timeout)
+        if len(expired) > 0:
+            try:
+                self.on_expire(expired)
+            except Exception as e:
+                logger.error("liveness: on_expire failed: {0}".format(e))
+        return expired
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if self.cond.wait_for(lambda: self.stopped,
+                                      timeout=self.tick):
+                    return
+            self.expire()
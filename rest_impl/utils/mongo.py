@@ -0,0 +1,127 @@
+"""
+プロセス内で共有するMongoClientの管理
+MongoClientは内部にコネクションプールを持ちスレッドセーフなので，
+ホストごとに1つだけ生成して全てのcampaign・コレクション・viewerで使い回す
+
+    client = mongo.registry.acquire("localhost")
+    client["troops"]["values"].insert_many(...)
+    mongo.registry.release("localhost")
+
+参照数が0になったクライアントはidle_timeout秒使われなければ閉じる
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+from utils import logger
+
+_URI_PATTERN = re.compile(r"mongodb://(.*?)/(.*?)/(.*)")
+
+
+def parse_uri(uri):
+    """
+    mongodb://host/db/colの形式のURIを分解する
+    :param str uri: 格納先のURI
+    :return: (host, db, col)．URIの形式が不正であればNone
+    """
+    match_result = _URI_PATTERN.match(uri)
+    if match_result is None:
+        return None
+    return match_result.group(1), match_result.group(2), match_result.group(3)
+
+
+def _make_client(host):
+    import pymongo
+    return pymongo.MongoClient(host)
+
+
+class MongoRegistry(object):
+    def __init__(self, idle_timeout=300, client_factory=_make_client):
+        """
+        :param float idle_timeout: 参照の無いクライアントを閉じるまでの秒数
+        :param Callable client_factory: ホストからクライアントを生成する関数
+        """
+        self.idle_timeout = idle_timeout
+        self.client_factory = client_factory
+        self.lock = threading.Lock()
+        # host -> [client, 参照数, 参照数が0になった時刻]
+        self.entries = {}
+
+    def acquire(self, host):
+        """
+        ホストのクライアントを取得し，参照数を増やす
+        :param str host: 接続先のホスト
+        :return: MongoClient
+        """
+        with self.lock:
+            self._evict_idle(time.monotonic())
+            entry = self.entries.get(host)
+            if entry is None:
+                logger.info("open mongodb client: {0}".format(host))
+                entry = self.entries[host] = \
+                    [self.client_factory(host), 0, None]
+            entry[1] += 1
+            entry[2] = None
+            return entry[0]
+
+    def release(self, host):
+        """
+        ホストのクライアントの参照数を減らす
+        :param str host: acquireに与えたホスト
+        """
+        with self.lock:
+            now = time.monotonic()
+            entry = self.entries.get(host)
+            if entry is not None and entry[1] > 0:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    entry[2] = now
+            self._evict_idle(now)
+
+    def evict_idle(self):
+        """
+        idle_timeout秒以上参照の無いクライアントを閉じる
+        """
+        with self.lock:
+            self._evict_idle(time.monotonic())
+
+    def close_all(self):
+        """
+        参照の有無によらず全てのクライアントを閉じる
+        """
+        with self.lock:
+            for client, _, _ in self.entries.values():
+                client.close()
+            self.entries.clear()
+
+    def _evict_idle(self, now):
+        idle = [host for host, (_, refs, since) in self.entries.items()
+                if refs == 0 and now - since >= self.idle_timeout]
+        for host in idle:
+            logger.info("close idle mongodb client: {0}".format(host))
+            self.entries.pop(host)[0].close()
+
+    def stats(self):
+        """
+        :return Dict[str, int]: ホストごとの参照数
+        """
+        with self.lock:
+            return {host: refs for host, (_, refs, _) in self.entries.items()}
+
+
+registry = MongoRegistry()
+
+
+@contextmanager
+def collection(host, db_name, col_name):
+    """
+    withの間だけ共有のクライアントからコレクションを借りる
+    :param str host: 接続先のホスト
+    :param str db_name: データベース名
+    :param str col_name: コレクション名
+    """
+    client = registry.acquire(host)
+    try:
+        yield client[db_name][col_name]
+    finally:
+        registry.release(host)
@@ -0,0 +1,135 @@
+"""
+エラー通知の非同期送信
+notifyはメッセージを積むだけで，1つのスレッドがmin_interval秒に1件以上の
+速さにならないようにURLへPOSTする
+同じメッセージはwindow秒に1度だけ送り，その間に繰り返されたものは
+まとめて"(N occurrences in the last 60 sec)"として次に送る
+"""
+import time
+from collections import OrderedDict
+from threading import Condition, Thread
+from typing import Callable, Dict
+import requests
+from utils import logger
+
+
+class Notifier(object):
+    def __init__(self, url, payload: Callable, window=60.0, min_interval=1.0,
+                 max_pending=100, post=requests.post, timeout=5.0):
+        """
+        :param str url: 通知の送信先．テストではローカルのサーバを指定できる
+        :param Callable payload: メッセージから送信するデータを生成する関数
+        :param float window: 同じメッセージをまとめる秒数
+        :param float min_interval: 送信の最小間隔 [sec]
+        :param int max_pending: 送信待ちにできる（異なる）メッセージの最大数
+        :param Callable post: requests.postと同じ引数を取る送信関数
+        :param float timeout: 1回の送信のタイムアウト [sec]
+        """
+        self.url = url
+        self.payload = payload
+        self.window = window
+        self.min_interval = min_interval
+        self.max_pending = max_pending
+        self.post = post
+        self.timeout = timeout
+
+        self.cond = Condition()
+        # メッセージ -> [回数, 最初に受けた時刻]
+        self.pending = OrderedDict()  # type: Dict[str, list]
+        self.last_sent = {}  # type: Dict[str, float]
+        self.next_post = 0.0
+        self.thread = None
+        self.stopped = False
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def notify(self, msg) -> bool:
+        """
+        メッセージを送信待ちに積む．送信は待たない
+        :param str msg: 通知するメッセージ
+        :return bool: 積めればTrue，送信待ちが一杯で捨てればFalse
+        """
+        with self.cond:
+            if self.stopped:
+                return False
+            entry = self.pending.get(msg)
+            if entry is not None:
+                entry[0] += 1
+                self.coalesced += 1
+                return True
+            if len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.pending[msg] = [1, time.monotonic()]
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+            return True
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "pending": len(self.pending),
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "errors": self.errors,
+            }
+
+    def _due(self, msg):
+        sent = self.last_sent.get(msg)
+        return 0.0 if sent is None else sent + self.window
+
+    def _next(self):
+        """
+        次に送るメッセージと，それを送れる時刻を求める
+        :return: (メッセージ, 時刻)．送信待ちが無ければ(None, None)
+        """
+        now = time.monotonic()
+        for msg, sent in list(self.last_sent.items()):
+            if now - sent >= self.window and msg not in self.pending:
+                del self.last_sent[msg]
+        if len(self.pending) == 0:
+            return None, None
+        msg = min(self.pending, key=self._due)
+        return msg, max(self._due(msg), self.next_post)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.stopped:
+                        return
+                    msg, due = self._next()
+                    now = time.monotonic()
+                    if msg is not None and due <= now:
+                        break
+                    self.cond.wait(None if msg is None else due - now)
+                count, first = self.pending.pop(msg)
+                self.last_sent[msg] = now
+                self.next_post = now + self.min_interval
+            if count > 1:
+                msg = "{0} ({1} occurrences in the last {2:.0f} sec)".format(
+                    msg, count, max(now - first, 1))
+            try:
+                res = self.post(self.url, data=self.payload(msg),
+                                timeout=self.timeout)
+                res.raise_for_status()
+                sent = True
+            except Exception as e:
+                logger.error("notifier: failed to post: {0}".format(e))
+                sent = False
+            with self.cond:
+                if sent:
+                    self.sent += 1
+                else:
+                    self.errors += 1
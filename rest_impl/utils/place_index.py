@@ -0,0 +1,140 @@
+"""
+部下のplaceからIDを引く索引
+placeは"Floor-3.west-side"のように"."で区切った階層を持つ
+Campaign・Missionのplaceは，先頭の要素が直属の部下のplaceに，
+残りがその部下の配下のplaceに対応する．部下のplace自体が"room1.desk2"の
+ように階層を持てば，"room1"や"room1.*"はその部下全体を対象とする
+"""
+import bisect
+import fnmatch
+from typing import Dict, Set
+
+ALL = "All"
+_GLOB_CHARS = "*?["
+
+
+def _match_segment(segment, pattern):
+    if pattern == ALL or segment == pattern:
+        return True
+    return any(c in pattern for c in _GLOB_CHARS) and \
+        fnmatch.fnmatchcase(segment, pattern)
+
+
+def resolve_place(place, pattern):
+    """
+    部下のplaceがpatternの対象であれば，patternのうちその部下の配下に
+    当たる残りを返す．placeとpatternは"."で区切った要素ごとに比べ，
+    各要素はそのもの，"All"，"Floor-*"のようなglobのいずれかで照合する
+    patternの方が短ければ（placeがpatternの配下であれば）部下全体が対象
+        resolve_place("Floor-3", "Floor-3.west-side") -> "west-side"
+        resolve_place("Floor-3.west", "Floor-3") -> "All"
+        resolve_place("Floor-3.west", "Floor-*.*") -> "All"
+    :param str place: 部下のplace
+    :param str pattern: Campaign・Missionのplace
+    :return str: 配下のplaceのパターン．全体が対象であれば"All"，
+        対象でなければNone
+    """
+    if pattern == ALL:
+        return ALL
+    segments = place.split(".")
+    patterns = pattern.split(".")
+    for segment, p in zip(segments, patterns):
+        if not _match_segment(segment, p):
+            return None
+    rest = patterns[len(segments):]
+    return ".".join(rest) if len(rest) > 0 else ALL
+
+
+def _fixed_prefix(pattern):
+    """
+    :return str: patternの先頭から，glob文字か"All"の要素が現れるまでの部分
+    """
+    fixed = []
+    for segment in pattern.split("."):
+        if segment == ALL:
+            fixed.append("")
+            break
+        glob_at = min((segment.find(c) for c in _GLOB_CHARS
+                       if c in segment), default=-1)
+        if glob_at >= 0:
+            fixed.append(segment[:glob_at])
+            break
+        fixed.append(segment)
+    return ".".join(fixed)
+
+
+def match_place(place, pattern):
+    """
+    :param str place: 部下のplace
+    :param str pattern: Campaign・Missionのplace
+    :return bool: 部下がpatternの対象であればTrue
+    """
+    return resolve_place(place, pattern) is not None
+
+
+class PlaceIndex(object):
+    def __init__(self):
+        self.places = {}  # type: Dict[str, Set[str]]
+        self.sorted_places = []
+        self.place_of = {}  # type: Dict[str, str]
+
+    def __len__(self):
+        return len(self.place_of)
+
+    def add(self, sid, place):
+        """
+        部下を登録する．登録済みであればplaceを更新する
+        :param str sid: 部下のID
+        :param str place: 部下のplace
+        """
+        if self.place_of.get(sid) == place:
+            return
+        self.remove(sid)
+        self.place_of[sid] = place
+        ids = self.places.get(place)
+        if ids is None:
+            ids = self.places[place] = set()
+            bisect.insort(self.sorted_places, place)
+        ids.add(sid)
+
+    def remove(self, sid):
+        """
+        :param str sid: 取り除く部下のID
+        """
+        place = self.place_of.pop(sid, None)
+        if place is None:
+            return
+        ids = self.places[place]
+        ids.discard(sid)
+        if len(ids) == 0:
+            del self.places[place]
+            i = bisect.bisect_left(self.sorted_places, place)
+            del self.sorted_places[i]
+
+    def match(self, pattern) -> Set[str]:
+        """
+        patternの対象となる部下のIDを返す（resolve_placeを参照）
+        対象のplaceは，patternの固定部分の上位の階層にあるものと，
+        固定部分で始まるものに限られるので，それらだけを照合する
+        :param str pattern: Campaign・Missionのplace
+        :return Set[str]: 部下のIDの集合
+        """
+        if pattern == ALL:
+            return set(self.place_of)
+        prefix = _fixed_prefix(pattern)
+        result = set()
+        # 固定部分の上位の階層（"Floor-3.west"に対する"Floor-3"など）
+        end = prefix.find(".")
+        while end >= 0:
+            result.update(self.places.get(prefix[:end], ()))
+            end = prefix.find(".", end + 1)
+        # 固定部分で始まるplace
+        i = bisect.bisect_left(self.sorted_places, prefix)
+        while i < len(self.sorted_places):
+            place = self.sorted_places[i]
+            if not place.startswith(prefix):
+                break
+            if match_place(place, pattern):
+                result.update(self.places[place])
+            i += 1
+        return result
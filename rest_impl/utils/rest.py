@@ -1,12 +1,27 @@
 import requests
 import flask
+import utils.wire as wire
 from utils import logger
 from json import dumps
 from functools import wraps
+from urllib.parse import urlparse
 
 
 test_clients = dict()
 
+# msgpackのリクエストボディを受け付けなかったホスト
+# 以降そのホストにはjsonで送信する
+json_only_hosts = set()
+_UNSUPPORTED_CODES = (406, 415)
+
+# POSTのボディの圧縮形式．Noneであれば圧縮しない
+# compress_thresholdバイト未満のボディは圧縮しても小さくならないので送らない
+compression = None
+compress_threshold = 1024
+# 圧縮したボディを受け付けなかったホスト
+# 以降そのホストには圧縮せずに送信する
+identity_only_hosts = set()
+
 
 def _set_etag(f):
     @wraps(f)
@@ -28,9 +43,127 @@ def _get(url, params=None, etag=None, **kwargs):
     return _rest_check_response(res)
 
 
+def set_compression(coding, threshold=None):
+    """
+    POSTのボディの圧縮形式を設定する
+    :param str coding: wire.GZIPかwire.ZSTD．Noneであれば圧縮しない
+    :param int threshold: 圧縮するボディの最小バイト数
+    :raise ValueError: 扱えない圧縮形式の場合
+    """
+    global compression, compress_threshold
+    if coding is not None and not wire.supports_coding(coding):
+        raise ValueError("unsupported compression: {0}".format(coding))
+    compression = coding
+    if threshold is not None:
+        compress_threshold = threshold
+
+
+def _prepare_body(url, json, binary, encoded):
+    """
+    POSTで送信するボディを決める
+    binary指定されていればmsgpackにエンコードし，エンコード済みのmsgpackでも
+    送信先がmsgpackを受け付けなければjsonに戻す
+    圧縮する場合はjsonもここでエンコードしておく
+    :return: (encoded, json)．encodedがNoneでなければそれをそのまま送る
+    """
+    if encoded is None and binary and json is not None and \
+            wire.supports(wire.MSGPACK):
+        encoded = (wire.MSGPACK, wire.encode(json, wire.MSGPACK))
+    if encoded is not None and encoded[0] == wire.MSGPACK and \
+            urlparse(url).netloc in json_only_hosts:
+        encoded, json = None, wire.decode(encoded[1], wire.MSGPACK)
+    if encoded is None and json is not None and compression is not None:
+        encoded = (wire.JSON, wire.encode(json, wire.JSON))
+    return encoded, json
+
+
+def _select_coding(url, body):
+    """
+    :return str: ボディの圧縮形式．圧縮しなければNone
+    """
+    if compression is None or len(body) < compress_threshold or \
+            urlparse(url).netloc in identity_only_hosts:
+        return None
+    return compression
+
+
+def _without_headers(kwargs):
+    return {k: v for k, v in kwargs.items() if k != 'headers'}
+
+
+def _rejects_coding(res, coding):
+    """
+    415が圧縮形式によるものかを判定する
+    json_inputは扱えない圧縮形式にはAccept-Encodingを付けて415を返し，
+    扱えないContent-Typeにはヘッダを付けずに415を返す
+    :return bool: 送信先がcodingを受け付けなかったのであればTrue
+    """
+    if res.status_code != 415:
+        return False
+    accepted = res.headers.get('Accept-Encoding')
+    if accepted is None:
+        return False
+    codings = [c.split(';')[0].strip().lower() for c in accepted.split(',')]
+    return coding not in codings
+
+
+def _post_encoded(send, url, body, headers):
+    """
+    エンコード済みのボディを必要に応じて圧縮して送信する
+    圧縮したボディが受け付けられなければそのホストをidentity_only_hostsに
+    登録し，圧縮せずに送り直す
+    :param Callable send: (ボディ, ヘッダ)を受け取って送信し，
+        レスポンスを返す関数
+    :return: レスポンス
+    """
+    coding = _select_coding(url, body)
+    if coding is None:
+        return send(body, headers)
+    res = send(wire.compress(body, coding),
+               dict(headers, **{'Content-Encoding': coding}))
+    if not _rejects_coding(res, coding):
+        return res
+    logger.info(">> [POST] {0} doesn't accept {1} body, fallback to identity".
+                format(url, coding))
+    identity_only_hosts.add(urlparse(url).netloc)
+    return send(body, headers)
+
+
+def _encoded_headers(headers, mimetype):
+    headers = dict(headers)
+    headers['Content-Type'] = mimetype
+    headers['Accept'] = wire.accept_header()
+    return headers
+
+
+def _fallback_to_json(url, res):
+    """
+    msgpackが受け付けられなかった場合にそのホストをjson_only_hostsに登録する
+    :return bool: jsonで送り直すべきであればTrue
+    """
+    if res.status_code not in _UNSUPPORTED_CODES:
+        return False
+    logger.info(">> [POST] {0} doesn't accept msgpack, fallback to json".
+                format(url))
+    json_only_hosts.add(urlparse(url).netloc)
+    return True
+
+
 @_set_etag
-def _post(url, data=None, json=None, etag=None, **kwargs):
+def _post(url, data=None, json=None, etag=None, binary=False, encoded=None,
+          **kwargs):
     try:
+        encoded, json = _prepare_body(url, json, binary, encoded)
+        while encoded is not None:
+            mimetype, body = encoded
+            res = _post_encoded(
+                lambda b, h: requests.post(url, data=b, headers=h,
+                                           **_without_headers(kwargs)),
+                url, body, _encoded_headers(kwargs['headers'], mimetype))
+            if mimetype != wire.MSGPACK or not _fallback_to_json(url, res):
+                return _rest_check_response(res)
+            # jsonで送り直す．圧縮するのであればここでエンコードされる
+            encoded, json = _prepare_body(url, None, False, encoded)
         res = requests.post(url, data=data, json=json, **kwargs)
     except requests.exceptions.RequestException as e:
         logger.error(">> [POST] {0} failed with exception: {1}".format(url, e))
@@ -62,8 +195,18 @@ def _delete(url, **kwargs):
     return _rest_check_response(res)
 
 
+def decode_body(res):
+    """
+    レスポンスボディをContent-Typeに応じてjsonかmsgpackとしてデコードする
+    :raise ValueError: デコードできない場合
+    """
+    content_type = res.headers.get('Content-Type', '')
+    if content_type.split(';')[0].strip() == wire.MSGPACK:
+        return wire.decode(res.content, wire.MSGPACK)
+    return res.json()
+
+
 def _rest_check_response(res):
-    import json
     # check whether resource is not modified
     if res.status_code == 304:
         return res, None
@@ -73,13 +216,13 @@ def _rest_check_response(res):
 
     # check whether response is json
     try:
-        res_dict = res.json()
+        res_dict = decode_body(res)
         if res_dict is None:
             logger.error(errmsg + "response.json() returns None")
             return res, "response.json() returns None"
             # requestsのjsonがNoneになる状況は不明．ドキュメントには失敗したらNone
             # とあるが，テストしたらHTMLレスポンスにJSONDecodeErrorを返した．
-    except json.JSONDecodeError as e:
+    except ValueError as e:
         logger.error(errmsg + "got no-json response with code {0}".
                      format(res.status_code))
         return res, e
@@ -106,6 +249,10 @@ class ResponseEx(flask.Response):
         self.request = MagicMock(method=method)
         self.url = url
 
+    @property
+    def content(self):
+        return self.data
+
     def json(self):
         import json
         return json.loads(self.data.decode("utf-8"))
@@ -125,15 +272,34 @@ def _select_client(url):
 @_set_etag
 def _test_get(url, etag=None, **kwargs):
     c, path = _select_client(url)
-    # paramsはFlaskClientのgetには無いのでひとまず握りつぶす
+    # FlaskClientにはparamsが無いのでquery_stringに読み替える
+    if 'params' in kwargs:
+        kwargs['query_string'] = kwargs.pop('params')
     res = c.get(path, **kwargs)
     res = ResponseEx(res, "GET", url)
     return _rest_check_response(res)
 
 
 @_set_etag
-def _test_post(url, data=None, json=None, etag=None, **kwargs):
+def _test_post(url, data=None, json=None, etag=None, binary=False,
+               encoded=None, **kwargs):
     c, path = _select_client(url)
+    # FlaskClientにはparamsが無いのでquery_stringに読み替える
+    if 'params' in kwargs:
+        kwargs['query_string'] = kwargs.pop('params')
+    encoded, json = _prepare_body(url, json, binary, encoded)
+    while encoded is not None:
+        mimetype, body = encoded
+        send_headers = _encoded_headers(kwargs['headers'], mimetype)
+        del send_headers['Content-Type']
+        res = _post_encoded(
+            lambda b, h: ResponseEx(
+                c.post(path, data=b, content_type=mimetype, headers=h,
+                       **_without_headers(kwargs)), "POST", url),
+            url, body, send_headers)
+        if mimetype != wire.MSGPACK or not _fallback_to_json(url, res):
+            return _rest_check_response(res)
+        encoded, json = _prepare_body(url, None, False, encoded)
     if json is not None:
         res = c.post(path, data=dumps(json),
                      content_type='application/json', **kwargs)
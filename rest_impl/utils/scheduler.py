@@ -0,0 +1,160 @@
+"""
+周期タイマーのスケジューラ
+Missionごとにスレッドを立てる代わりに，1つのスレッドが全てのタイマーの
+次の発火時刻をヒープで管理し，同じ時刻に発火するものをまとめて通知する
+発火時刻の差がslack秒以内のタイマーは同じ時刻に発火したものとみなす
+"""
+import heapq
+import itertools
+import time
+from threading import Condition, Thread
+from typing import Callable, Dict, List
+from utils import logger
+
+
+class Scheduler(object):
+    """
+    (次の発火時刻, 登録番号, キー)のヒープでタイマーを管理する
+    削除や置き換えではヒープは書き換えず，登録番号の古い要素を
+    取り出したときに捨てる
+    """
+
+    def __init__(self, on_fire: Callable, slack=0.0, clock=time.monotonic,
+                 background=True):
+        """
+        :param Callable on_fire: 同時に発火したキーのリストを受け取る関数
+        :param float slack: まとめて発火させる発火時刻の差 [sec]
+        :param Callable clock: 現在時刻を返す関数
+        :param bool background: 最初のaddで発火用のスレッドを起動する
+        """
+        self.on_fire = on_fire
+        self.slack = slack
+        self.clock = clock
+        self.background = background
+        self.heap = []
+        self.timers = {}  # type: Dict[str, (float, int)]
+        self.counter = itertools.count()
+        self.cond = Condition()
+        self.thread = None
+        self.stopped = False
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def add(self, key, interval, start=None):
+        """
+        interval秒ごとに発火するタイマーを登録する．登録済みであれば置き換える
+        :param str key: タイマーのキー
+        :param float interval: 発火の間隔 [sec]
+        :param float start: 最初の発火時刻．Noneであれば現在からinterval秒後
+        :raise ValueError: intervalが正でない場合
+        """
+        if not interval > 0:
+            raise ValueError("interval must be positive: {0}".format(interval))
+        with self.cond:
+            if start is None:
+                start = self.clock() + interval
+            seq = next(self.counter)
+            self.timers[key] = (interval, seq)
+            heapq.heappush(self.heap, (start, seq, key))
+            self._compact()
+            if self.thread is None and self.background:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def remove(self, key):
+        """
+        :param str key: 取り除くタイマーのキー
+        """
+        with self.cond:
+            self.timers.pop(key, None)
+            self._compact()
+
+    def next_due(self):
+        """
+        :return float: 最も早い発火時刻．タイマーが無ければNone
+        """
+        with self.cond:
+            self._drop_stale()
+            return self.heap[0][0] if len(self.heap) > 0 else None
+
+    def fire(self, now=None) -> List[List[str]]:
+        """
+        現在時刻までに発火時刻を迎えたタイマーを発火時刻ごとにon_fireに渡す
+        :param float now: 現在時刻．Noneであればclockから取得する
+        :return List[List[str]]: on_fireに渡したキーのリスト
+        """
+        groups = []
+        with self.cond:
+            if now is None:
+                now = self.clock()
+            while True:
+                self._drop_stale()
+                if len(self.heap) == 0 or self.heap[0][0] > now:
+                    break
+                # slack秒以内に発火するものは先取りしてまとめる
+                limit = self.heap[0][0] + self.slack
+                keys = []
+                rescheduled = []
+                while len(self.heap) > 0 and self.heap[0][0] <= limit:
+                    due, seq, key = heapq.heappop(self.heap)
+                    timer = self.timers.get(key)
+                    if timer is None or timer[1] != seq:
+                        continue
+                    keys.append(key)
+                    interval = timer[0]
+                    # 遅れて処理しても発火時刻はずらさない
+                    # 1周期以上遅れた分は飛ばす
+                    next_due = due + interval
+                    if next_due <= now:
+                        next_due += (now - next_due) // interval * interval \
+                            + interval
+                    rescheduled.append((next_due, seq, key))
+                for entry in rescheduled:
+                    heapq.heappush(self.heap, entry)
+                groups.append(keys)
+        for keys in groups:
+            try:
+                self.on_fire(keys)
+            except Exception as e:
+                logger.error("scheduler: on_fire failed: {0}".format(e))
+        return groups
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def _drop_stale(self):
+        while len(self.heap) > 0:
+            _, seq, key = self.heap[0]
+            timer = self.timers.get(key)
+            if timer is not None and timer[1] == seq:
+                return
+            heapq.heappop(self.heap)
+
+    def _compact(self):
+        # 捨てられた要素がタイマーの数より多くなればヒープを作り直す
+        if len(self.heap) > 2 * len(self.timers) + 16:
+            self.heap = [e for e in self.heap
+                         if self.timers.get(e[2], (0, -1))[1] == e[1]]
+            heapq.heapify(self.heap)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if self.stopped:
+                    return
+                self._drop_stale()
+                if len(self.heap) == 0:
+                    self.cond.wait()
+                    continue
+                wait = self.heap[0][0] - self.clock()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+            self.fire()
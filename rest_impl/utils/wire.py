@@ -0,0 +1,216 @@
+"""
+リクエスト・レスポンスボディのエンコード形式
+JSONを基本とし，msgpackがインストールされていればmsgpackも扱える
+ボディの圧縮（Content-Encoding）はgzipを基本とし，zstandardが
+インストールされていればzstdも扱える
+"""
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = 'application/json'
+MSGPACK = 'application/x-msgpack'
+
+IDENTITY = 'identity'
+GZIP = 'gzip'
+ZSTD = 'zstd'
+# 展開後のボディの上限．圧縮率の極端に高いボディでメモリを使い切らないため
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+
+def supports(mimetype):
+    """
+    指定された形式でエンコード・デコードできるかを返す
+    :param str mimetype: 形式のMIMEタイプ
+    :return bool: 扱えればTrue
+    """
+    if mimetype == MSGPACK:
+        return msgpack is not None
+    return mimetype == JSON
+
+
+def accept_header():
+    """
+    リクエストのAcceptヘッダに指定する値を返す．JSONは常に受け付ける
+    """
+    if msgpack is None:
+        return JSON
+    return "{0}, {1};q=0.9".format(MSGPACK, JSON)
+
+
+def encode(obj, mimetype=JSON):
+    """
+    :param obj: エンコードするオブジェクト
+    :param str mimetype: エンコード形式
+    :return bytes: エンコード結果
+    """
+    if mimetype == MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj).encode('utf-8')
+
+
+def decode(data, mimetype=JSON):
+    """
+    :param bytes data: デコードするデータ
+    :param str mimetype: dataのエンコード形式
+    :return: デコード結果
+    :raise ValueError: dataがデコードできない場合
+    """
+    if mimetype == MSGPACK:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise ValueError(e)
+    return json.loads(data.decode('utf-8'))
+
+
+def supports_coding(coding):
+    """
+    指定された形式で圧縮・展開できるかを返す
+    :param str coding: Content-Encodingの値
+    :return bool: 扱えればTrue
+    """
+    if coding == ZSTD:
+        return zstandard is not None
+    return coding in (IDENTITY, GZIP)
+
+
+def accept_encoding():
+    """
+    扱える圧縮形式を返す．Accept-Encodingヘッダに指定する
+    """
+    codings = [GZIP, ZSTD, IDENTITY]
+    return ", ".join(c for c in codings if supports_coding(c))
+
+
+def compress(data, coding, level=None):
+    """
+    :param bytes data: 圧縮するデータ
+    :param str coding: 圧縮形式（GZIPかZSTD）
+    :param int level: 圧縮レベル．Noneであれば形式ごとの既定値
+    :return bytes: 圧縮結果
+    """
+    if coding == ZSTD:
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level).compress(data)
+    if coding == GZIP:
+        # gzip.compressより軽い．ヘッダの時刻は0になる
+        obj = zlib.compressobj(6 if level is None else level,
+                               zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return obj.compress(data) + obj.flush()
+    return data
+
+
+def decompress(data, coding, max_size=MAX_DECOMPRESSED_SIZE):
+    """
+    :param bytes data: 展開するデータ
+    :param str coding: dataの圧縮形式
+    :param int max_size: 展開後のサイズの上限
+    :return bytes: 展開結果
+    :raise ValueError: 展開できないか，展開後のサイズが上限を超える場合
+    """
+    if coding == IDENTITY:
+        return data
+    try:
+        if coding == ZSTD:
+            with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+                result = reader.read(max_size + 1)
+        elif coding == GZIP:
+            obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            result = obj.decompress(data, max_size + 1)
+            if len(result) <= max_size and not obj.eof:
+                raise ValueError("truncated gzip data")
+        else:
+            raise ValueError("unsupported coding: {0}".format(coding))
+    except (zlib.error, getattr(zstandard, 'ZstdError', zlib.error)) as e:
+        raise ValueError(e)
+    if len(result) > max_size:
+        raise ValueError("decompressed size exceeds {0} bytes".format(
+            max_size))
+    return result
+
+
+def is_object(data, mimetype=JSON):
+    """
+    デコードせずに，dataがオブジェクト(map)として始まっているかを確認する
+    :param bytes data: エンコード済みのデータ
+    :param str mimetype: dataのエンコード形式
+    :return bool: splice_rowsに渡せる形であればTrue
+    """
+    if mimetype == MSGPACK:
+        return _msgpack_map_header(data) is not None
+    data = data.strip()
+    return data[:1] == b'{' and data[-1:] == b'}'
+
+
+def _msgpack_map_header(data):
+    """
+    :return (int, int): mapの要素数とヘッダのバイト数．mapでなければNone
+    """
+    if len(data) == 0:
+        return None
+    head = data[0]
+    if head & 0xf0 == 0x80:
+        return head & 0x0f, 1
+    if head == 0xde and len(data) >= 3:
+        return int.from_bytes(data[1:3], 'big'), 3
+    if head == 0xdf and len(data) >= 5:
+        return int.from_bytes(data[1:5], 'big'), 5
+    return None
+
+
+def _add_json_key(key, value, data):
+    data = data.strip()
+    item = "{0}: {1}".format(json.dumps(key), json.dumps(value)).encode()
+    body = data[1:].lstrip()
+    if body[:1] == b'}':
+        return b'{' + item + b'}'
+    return b'{' + item + b', ' + body
+
+
+def _add_msgpack_key(packer, key, value, data):
+    count, header_len = _msgpack_map_header(data)
+    return packer.pack_map_header(count + 1) + packer.pack(key) + \
+        packer.pack(value) + data[header_len:]
+
+
+def splice_rows(head, key, rows, mimetype=JSON):
+    """
+    エンコード済みのオブジェクトをデコードせずにつなぎ合わせて
+    head[key]をそれらのリストとしたオブジェクトをエンコードした結果を作る
+    各オブジェクトには，rowsに与えられたキーと値を1つ加える
+    追加するキーがNoneであればオブジェクトをそのまま入れる
+    :param dict head: 出力するオブジェクトのkey以外の要素
+    :param str key: rowsを格納するキー
+    :param rows: (追加するキー, 値, エンコード済みのオブジェクト)のリスト
+    :param str mimetype: rowsとエンコード結果の形式
+    :return bytes: エンコード結果
+    """
+    if mimetype == MSGPACK:
+        packer = msgpack.Packer(use_bin_type=True)
+        parts = [packer.pack_map_header(len(head) + 1)]
+        for k, v in head.items():
+            parts.append(packer.pack(k))
+            parts.append(packer.pack(v))
+        parts.append(packer.pack(key))
+        parts.append(packer.pack_array_header(len(rows)))
+        parts.extend(_add_msgpack_key(packer, k, v, data)
+                     if k is not None else data for k, v, data in rows)
+        return b''.join(parts)
+
+    prefix = json.dumps(head)[:-1]
+    if len(head) > 0:
+        prefix += ", "
+    prefix += "{0}: [".format(json.dumps(key))
+    return prefix.encode() + \
+        b', '.join(_add_json_key(k, v, data) if k is not None
+                   else data.strip() for k, v, data in rows) + b']}'
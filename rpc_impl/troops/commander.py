@@ -4,6 +4,8 @@ import copy
 from time import sleep
 import xmlrpc.client as xmlrpc_client
 from logging import getLogger, StreamHandler, DEBUG
+import utils.isotime as isotime
+import utils.mongo as mongo
 from utils.utils import trace_error, run_rpc
 
 logger = getLogger(__name__)
@@ -140,24 +142,21 @@ class MongoPush(object):
 
     def __init__(self, uri):
         import pymongo
-        import re
-        match_result = re.match(r"mongodb://(.*?)/(.*?)/(.*)", uri)
-        if match_result is None:
+        self.target = mongo.parse_uri(uri)
+        if self.target is None:
             logger.error("uri is not mongodb-uri: %s", uri)
             return
-        host = match_result.group(1)
-        db_name = match_result.group(2)
-        col_name = match_result.group(3)
-        client = pymongo.MongoClient(host)
-        try:
-            # The ismaster command is cheap and does not require auth.
-            client.admin.command('ismaster')
-        except pymongo.errors.ConnectionFailure:
-            logger.error("failed to connect to mongodb: %s", uri)
-        self.col = client[db_name][col_name]
+        # クライアントはホストごとに共有し，使う間だけ参照を持つ
+        # 置き換えられたmissionのクライアントは，書き込み中でなくなり
+        # 参照が無くなってからregistryが閉じる
+        with mongo.collection(*self.target) as col:
+            try:
+                # The ismaster command is cheap and does not require auth.
+                col.database.client.admin.command('ismaster')
+            except pymongo.errors.ConnectionFailure:
+                logger.error("failed to connect to mongodb: %s", uri)
 
     def push_values(self, values):
-        import dateutil.parser
         if len(values) == 0:
             return
 
@@ -165,9 +164,12 @@ class MongoPush(object):
         vals = copy.deepcopy(values)
 
         # timeの値を文字列からdatetime型に変換する
-        [v.update({"time": dateutil.parser.parse(v["time"])}) for v in vals]
+        # 同じWorkの値は同じ文字列を持つので，変換結果を使い回す
+        parse = isotime.CachedParser()
+        [v.update({"time": parse(v["time"])}) for v in vals]
 
-        self.col.insert_many(vals)
+        with mongo.collection(*self.target) as col:
+            col.insert_many(vals)
         # FIXME: DB接続できてなかったり落ちてたら再接続するとかキャッシュするとか
         # 必要だとは思う
 